@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark and check of the DataFlash .BIN reader (uasutils.dataflash).
+
+Writes synthetic logs (FMT, GPS, ATT, CAM, MODE and ORGN messages, with random
+bytes between some messages like a log with dropped writes) for a range of
+flight lengths, reads them with read_bin_track() / read_bin_camera() and
+with a sequential struct.unpack_from reader (one message at a time, the way
+pymavlink's DFReader decodes), checks the fixes read against those written and
+reports the best time of several runs.  Fixes the sequential reader loses
+or decodes from the noise after a dropped write are reported.
+
+example: runfile('bench-bin-read.py', args='-minutes=1,10,60')
+example (keep the logs): runfile('bench-bin-read.py', args='-minutes=10 -outdir=D:/temp/binlogs')
+"""
+
+import argparse
+import struct
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+from uasutils.dataflash import read_bin_track, read_bin_camera, HEAD, FMT_TYPE, GPS_EPOCH_NS
+
+#synthetic log settings
+start_utc = '2018-10-23T18:08:00'
+leap_seconds = 18
+gps_hz = 5
+att_hz = 25
+cam_every_s = 2
+noise_every = 997 #random bytes written after every n-th message
+
+#message formats: name -> (type, format, columns); 'solo' GPS has RelAlt (ArduCopter 3.3, 3DR Solo)
+FORMATS = {'FMT': (FMT_TYPE, 'BBnNZ', 'Type,Length,Name,Format,Columns'),
+           'GPS': (130, 'QBBIHBcLLeffffB', 'TimeUS,I,Status,GMS,GWk,NSats,HDop,Lat,Lng,Alt,Spd,GCrs,VZ,Yaw,U'),
+           'ATT': (131, 'QccccCCCC', 'TimeUS,DesRoll,Roll,DesPitch,Pitch,DesYaw,Yaw,ErrRP,ErrYaw'),
+           'CAM': (132, 'QBHIHLLeeeccC', 'TimeUS,I,Img,GPSTime,GPSWeek,Lat,Lng,Alt,RelAlt,GPSAlt,R,P,Y'),
+           'MODE': (133, 'QMBB', 'TimeUS,Mode,ModeNum,Rsn'),
+           'ORGN': (134, 'QBLLe', 'TimeUS,Type,Lat,Lng,Alt')}
+SOLO_GPS = (130, 'QBIHBcLLeeEefB', 'TimeUS,Status,GMS,GWk,NSats,HDop,Lat,Lng,RelAlt,Alt,Spd,GCrs,VZ,U')
+
+#struct codes of the format characters
+STRUCT_CODES = {'a': '64s', 'b': 'b', 'B': 'B', 'h': 'h', 'H': 'H', 'i': 'i', 'I': 'I', 'f': 'f', 'd': 'd',
+                'n': '4s', 'N': '16s', 'Z': '64s', 'c': 'h', 'C': 'H', 'e': 'i', 'E': 'I',
+                'L': 'i', 'M': 'B', 'q': 'q', 'Q': 'Q'}
+
+
+def write_synthetic_bin(path, seconds, solo=False, seed=0):
+    '''
+    Writes a synthetic log of a seconds long flight to path.  Returns the
+    written GPS fixes (UTC ns, lat, lon) and camera trigger UTC ns.
+    '''
+    rng = np.random.default_rng(seed)
+    formats = dict(FORMATS, GPS=SOLO_GPS) if solo else FORMATS
+    structs = {name: struct.Struct('<BBB' + ''.join(STRUCT_CODES[ch] for ch in fmt)) for name, (t, fmt, cols) in formats.items()}
+
+    boot0_us = 45_000_000
+    utc0 = np.datetime64(start_utc, 'ns').astype(np.int64)
+    gps0_ms = (utc0 + leap_seconds * 1_000_000_000 - GPS_EPOCH_NS) // 1_000_000
+    week0, ms0 = divmod(int(gps0_ms), 604_800_000)
+
+    #messages as (boot us, name, values), sorted by boot time when written
+    msgs = []
+    n = int(seconds * gps_hz)
+    t_us = boot0_us + np.arange(n) * (1_000_000 // gps_hz)
+    lat = 38.33 + np.cumsum(rng.normal(0, 2e-6, n))
+    lon = -121.67 + np.cumsum(rng.normal(0, 2e-6, n))
+    fix_ms = ms0 + (t_us - boot0_us) // 1000
+    for i in range(n):
+        lat_i, lon_i = int(round(lat[i] * 1e7)), int(round(lon[i] * 1e7))
+        if solo:
+            values = (int(t_us[i]) + 180_000, 3, int(fix_ms[i]), week0, 12, 80, lat_i, lon_i, 5000, 1200, 500, 9000, 0.1, 1)
+        else:
+            values = (int(t_us[i]) + 180_000, 0, 3, int(fix_ms[i]), week0, 12, 80, lat_i, lon_i, 1200, 5.0, 90.0, 0.1, 0.0, 1)
+        msgs.append((int(t_us[i]) + 180_000, 'GPS', values))
+    for t in range(boot0_us, int(t_us[-1]), 1_000_000 // att_hz):
+        msgs.append((t, 'ATT', (t, 0, int(rng.integers(-3000, 3000)), 0, int(rng.integers(-3000, 3000)), 0, 9000, 0, 0)))
+    cams = []
+    for img, t in enumerate(range(boot0_us + 500_000, int(t_us[-1]), cam_every_s * 1_000_000)):
+        ms = ms0 + (t - boot0_us) // 1000
+        cams.append(utc0 + (t - boot0_us) * 1000)
+        msgs.append((t, 'CAM', (t, 0, img, int(ms), week0, 383300000, -1216700000, 5000, 5000, 5000, 0, 0, 9000)))
+    msgs.append((boot0_us, 'MODE', (boot0_us, 3, 3, 0)))
+    #home 2 m above sea level, so the track's ele (above home) is GPS Alt - 2 m
+    msgs.append((boot0_us, 'ORGN', (boot0_us, 1, 383300000, -1216700000, 200)))
+    msgs.sort(key=lambda m: m[0])
+
+    with open(path, 'wb') as f:
+        for name, (t, fmt, cols) in formats.items():
+            length = structs[name].size
+            f.write(structs['FMT'].pack(*HEAD, FMT_TYPE, t, length, name.encode(), fmt.encode(), cols.encode()))
+        for i, (t, name, values) in enumerate(msgs):
+            f.write(structs[name].pack(*HEAD, formats[name][0], *values))
+            if i % noise_every == noise_every - 1:
+                #dropped write: part of a message (header included)
+                f.write(bytes(HEAD) + rng.integers(0, 256, 20, dtype=np.uint8).tobytes())
+    fix_ns = utc0 + (t_us - boot0_us) * 1000
+    return fix_ns, lat, lon, np.array(cams, dtype=np.int64)
+
+
+def read_bin_sequential(path):
+    '''GPS fixes (UTC ns, lat, lon) of log path, decoding one message at a time with struct'''
+    data = Path(path).read_bytes()
+    fmts = {FMT_TYPE: (struct.Struct('<BBB' + 'BB4s16s64s'), 'FMT', ['Type', 'Length', 'Name', 'Format', 'Columns'])}
+    rows = []
+    pos = 0
+    while pos + 3 <= len(data):
+        if data[pos] != HEAD[0] or data[pos + 1] != HEAD[1] or data[pos + 2] not in fmts:
+            pos += 1
+            continue
+        st, name, cols = fmts[data[pos + 2]]
+        if pos + st.size > len(data):
+            break
+        values = st.unpack_from(data, pos)[3:]
+        pos += st.size
+        if name == 'FMT':
+            try:
+                fmt = values[3].rstrip(b'\x00').decode()
+                fmts.setdefault(values[0], (struct.Struct('<BBB' + ''.join(STRUCT_CODES[ch] for ch in fmt)),
+                                            values[2].rstrip(b'\x00').decode(), values[4].rstrip(b'\x00').decode().split(',')))
+            except (UnicodeDecodeError, KeyError):
+                #FMT header bytes in noise
+                pass
+        elif name == 'GPS':
+            msg = dict(zip(cols, values))
+            if msg['Status'] >= 3:
+                rows.append((msg['GWk'], msg['GMS'], msg['Lat'] * 1e-7, msg['Lng'] * 1e-7))
+    week, ms, lat, lon = (np.array(col) for col in zip(*rows))
+    return GPS_EPOCH_NS + week * 604_800_000_000_000 + ms * 1_000_000 - leap_seconds * 1_000_000_000, lat, lon
+
+
+def best_time(func, repeat):
+    '''Best wall time of repeat calls to func, and its result'''
+    times = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - t0)
+    return min(times), result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the DataFlash .BIN reader on synthetic logs.')
+    parser.add_argument('-minutes', '--minutes', dest='minutes', default='1,10,60',
+                        help='comma separated flight lengths in minutes [default 1,10,60]')
+    parser.add_argument('-seqmax', '--sequential_max_minutes', dest='seqmax', type=float, default=10,
+                        help='longest flight the sequential reader is timed on [default 10]')
+    parser.add_argument('-outdir', '--output_directory', dest='outdir', default=None,
+                        help='directory for the synthetic logs [default: temporary directory]')
+    parser.add_argument('-n', '--repeat', dest='repeat', type=int, default=3,
+                        help='number of runs per reader [default 3]')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        outdir = Path(args.outdir or tmpdir)
+        outdir.mkdir(parents=True, exist_ok=True)
+        print(f'{"minutes":>8s} {"MB":>7s} {"fixes":>8s} {"numpy s":>9s} {"fixes/s":>11s} {"struct s":>9s} {"speedup":>8s}')
+        for minutes in [float(m) for m in args.minutes.split(',')]:
+            for solo in [False, True]:
+                path = outdir.joinpath(f'synthetic_{minutes:g}min{"_solo" if solo else ""}.BIN')
+                fix_ns, lat, lon, cam_ns = write_synthetic_bin(path, minutes * 60, solo=solo)
+
+                t_np, track = best_time(lambda: read_bin_track(path), args.repeat)
+                assert len(track) == len(fix_ns), f'{len(track)} fixes read, {len(fix_ns)} written'
+                assert np.array_equal(track['dt'].to_numpy(dtype='datetime64[ns]').view(np.int64), fix_ns)
+                assert np.allclose(track['lat'], lat, atol=1e-7) and np.allclose(track['lon'], lon, atol=1e-7)
+                #solo: GPS RelAlt, else GPS Alt (12 m) above the ORGN home (2 m)
+                assert np.allclose(track['ele'], 50 if solo else 10)
+                cams = read_bin_camera(path)
+                assert np.array_equal(cams['dt'].to_numpy(dtype='datetime64[ns]').view(np.int64), cam_ns)
+
+                t_seq, speedup = np.nan, ''
+                if not solo and minutes <= args.seqmax:
+                    t_seq, (seq_ns, seq_lat, seq_lon) = best_time(lambda: read_bin_sequential(path), args.repeat)
+                    speedup = f'{t_seq / t_np:7.1f}x'
+                    #the sequential reader resyncs on header bytes in the noise of a dropped write
+                    lost = np.count_nonzero(~np.isin(fix_ns, seq_ns))
+                    bogus = np.count_nonzero(~np.isin(seq_ns, fix_ns))
+                    if lost or bogus:
+                        speedup += f'  (struct reader: {lost} fixes lost, {bogus} bogus)'
+                print(f'{minutes:8g} {path.stat().st_size / 1e6:7.1f} {len(track):8d} {t_np:9.3f} '
+                      f'{len(track) / t_np:11.0f} {t_seq:9.3f} {speedup:>8s}{"  (solo GPS format)" if solo else ""}')
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the header-only EXIF timestamp reader (uasutils.exif) against the
+original get_dt_original() which ran exifread.process_file() over every tag.
+
+Times both readers on the JPG and DNG files in a directory and checks that
+they return the same DateTimeOriginal.  The readers take turns going first
+(so neither always reads the files after the other has cached them) and the
+best of -runs runs of each is reported.  Run it against a directory on the
+storage you actually use (local disk vs. network share) since that is where
+most of the difference is.
+
+example: runfile('bench-exif-read.py', args='-dir=D:/mydir/data/images -n=200')
+"""
+
+import argparse
+import time
+from pathlib import Path
+import exifread
+from uasutils.exif import read_dt_tags_header, get_dt_original
+
+#file types to benchmark
+ftypes = ['JPG', 'DNG']
+
+
+def get_dt_original_exifread(fn):
+    '''Gets DateTimeOriginal value from EXIF (original full exifread version)'''
+    with open(fn, 'rb') as i:
+        tags = exifread.process_file(i)
+    dt_orig = str(tags.get('EXIF DateTimeOriginal'))
+    return dt_orig
+
+
+def time_reader(func, files):
+    '''Returns (seconds, list of results) for func applied to every file'''
+    t0 = time.perf_counter()
+    results = [func(fn) for fn in files]
+    return time.perf_counter() - t0, results
+
+
+# ===========================  BEGIN PARSER ==============================
+descriptionstr = ('  Benchmark header-only EXIF timestamp reader against exifread.')
+parser = argparse.ArgumentParser(description=descriptionstr,
+                                 epilog='example: run bench-exif-read.py '
+                                         '-dir=D:/mydir/data/images -n=200')
+#input directory arg
+parser.add_argument('-dir', '--input_directory', dest='indir',
+                    required=True,
+                    help='directory with JPG and/or DNG images (searched recursively)')
+#max files per type
+parser.add_argument('-n', '--max_files', dest='nmax',
+                    type=int, required=False, default=100,
+                    help='max number of files of each type to read [default 100]')
+#repeats
+parser.add_argument('-runs', '--runs', dest='runs',
+                    type=int, required=False, default=3,
+                    help='number of runs of each reader, alternating which goes first, best is kept [default 3]')
+
+#parse
+args = parser.parse_args()
+indir = Path(args.indir)
+
+for ftype in ftypes:
+    files = sorted(indir.glob('**/*.' + ftype))[:args.nmax]
+    if not files:
+        print(f'{ftype}: no files found, skipping.')
+        continue
+
+    #alternate which reader goes first, the first one of a run may be the one that reads
+    #the files from disk and warms the page cache for the other, and keep the best time
+    readers = {'new': get_dt_original, 'old': get_dt_original_exifread}
+    best = {name: float('inf') for name in readers}
+    results = {}
+    for run in range(max(args.runs, 1)):
+        for name in (['new', 'old'] if run % 2 == 0 else ['old', 'new']):
+            t, results[name] = time_reader(readers[name], files)
+            best[name] = min(best[name], t)
+    t_old, old = best['old'], results['old']
+    t_new, new = best['new'], results['new']
+    n_header = 0
+    for fn in files:
+        try:
+            read_dt_tags_header(fn)
+            n_header += 1
+        except ValueError:
+            pass
+
+    mismatches = [fn for fn, a, b in zip(files, old, new) if a != b]
+    print(f'{ftype}: {len(files)} files, best of {max(args.runs, 1)} runs')
+    print(f'    exifread.process_file:  {1000 * t_old / len(files):8.2f} ms/file')
+    print(f'    header reader:          {1000 * t_new / len(files):8.2f} ms/file')
+    print(f'    speedup:                {t_old / t_new:8.1f}x')
+    print(f'    read from header:       {n_header} of {len(files)} (rest fell back to exifread)')
+    if mismatches:
+        print(f'    WARNING: {len(mismatches)} files returned different timestamps, e.g. {mismatches[0]}')
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the streaming gpx reader (uasutils.gpx.read_mp_gpx) against the
+original etree.parse + XPath mp_gpx_to_df() (adapted from
+https://github.com/sackerman-usgs/UAS_processing).
+
+Parses every gpx file in a directory with both readers, checks the results
+match and reports the best time of several runs for each reader.
+
+example: runfile('bench-gpx-read.py', args='-gpxdir=../testdata/gpx')
+"""
+
+import argparse
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from lxml import etree
+from uasutils.gpx import read_mp_gpx, GPX_NAMESPACE
+
+
+def _to_numeric_or_keep(ser):
+    '''pd.to_numeric(errors='ignore') which newer pandas no longer has'''
+    try:
+        return pd.to_numeric(ser)
+    except (ValueError, TypeError):
+        return ser
+
+
+def mp_gpx_tag_to_pdseries(tree, namespace, tag):
+    '''Extract tag value from GPX file as pandas series (original version)'''
+    elist = tree.xpath('./def:trk//def:trkpt//def:'+tag, namespaces=namespace)
+    ser = pd.Series([e.text for e in elist], name=tag)
+    return(ser)
+
+
+def mp_gpx_to_df(gpxfile, namespace):
+    '''Original etree.parse + XPath gpx reader'''
+    tree = etree.parse(gpxfile)
+    namespace = {'def': namespace}
+    elist = tree.xpath('./def:trk//def:trkpt',namespaces=namespace)
+    gpxdf = pd.DataFrame([e.values() for e in elist], columns=['lat', 'lon']).apply(pd.to_numeric)
+    taglist = ['time', 'ele', 'course', 'roll', 'pitch', 'mode']
+    for tag in taglist:
+        gpxdf = gpxdf.join(_to_numeric_or_keep(mp_gpx_tag_to_pdseries(tree, namespace, tag)))
+    return(gpxdf)
+
+
+def run(func, files):
+    '''Returns (seconds, list of dataframes)'''
+    t0 = time.perf_counter()
+    dfs = [func(fn) for fn in files]
+    return time.perf_counter() - t0, dfs
+
+
+# ===========================  BEGIN PARSER ==============================
+descriptionstr = ('  Benchmark streaming gpx reader against the original XPath reader.')
+parser = argparse.ArgumentParser(description=descriptionstr,
+                                 epilog='example: run bench-gpx-read.py '
+                                         '-gpxdir=../testdata/gpx')
+#input gpx directory arg
+parser.add_argument('-gpxdir', '--gpx_directory', dest='gpxdir',
+                    required=True,
+                    help='directory with gpx files')
+#repeats
+parser.add_argument('-n', '--repeat', dest='repeat',
+                    type=int, required=False, default=3,
+                    help='number of times to parse the directory [default 3]')
+
+#parse
+args = parser.parse_args()
+files = sorted(str(fn) for fn in Path(args.gpxdir).glob('*.gpx'))
+mb = sum(Path(fn).stat().st_size for fn in files) / 1e6
+print(f'{len(files)} gpx files, {mb:.1f} MB')
+
+results = {}
+for name, func in [('etree.parse + xpath', lambda fn: mp_gpx_to_df(fn, GPX_NAMESPACE)),
+                   ('iterparse (streaming)', read_mp_gpx)]:
+    times = []
+    for i in range(args.repeat):
+        elapsed, dfs = run(func, files)
+        times.append(elapsed)
+    results[name] = dfs
+    npts = sum(len(df) for df in dfs)
+    print(f'    {name:24s} {min(times):7.3f} s  ({mb / min(times):6.1f} MB/s, {npts / min(times):8.0f} trkpt/s)')
+
+#check both readers agree on the numeric columns
+old, new = results.values()
+for fn, a, b in zip(files, old, new):
+    cols = ['lat', 'lon', 'ele', 'course', 'roll', 'pitch']
+    if len(a) != len(b) or (len(a) and not np.allclose(a[cols].to_numpy(float), b[cols].to_numpy(float), equal_nan=True)):
+        print(f'    WARNING: readers differ for {fn}')
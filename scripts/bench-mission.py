@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the whole workflow on synthetic missions (uasutils.synthetic).
+
+For each scale (number of camera triggers) a mission is written to a
+temporary directory: Mission Planner style gpx files at -hz fixes per
+second and tiny JPG (and with -dng, DNG) images with EXIF timestamps.
+Each step of geotag-with-gpx.py is then timed on its own (gpx load with and
+without the parsed track cache, track QC, EXIF timestamp scan with and
+without the image index, 1 Hz aggregation, nearest match, per-flight
+geotag, interpolation (TimeDiff checked against the written image and GPS
+times), csv write, EXIF GPS write, the exiftool process pool against a
+stub exiftool), followed by the frequency check, time sync offset
+estimate (which must find the clock error of every flight within 1 s),
+*_original cleanup (of a copy of every image) and rename.  Every image must be geotagged, written and its
+backup deleted, or the run stops.  The best time of -n runs of each step
+is printed and saved with the software versions to a json file; -compare
+prints the change against a json file saved by an earlier version.
+
+example: runfile('bench-mission.py', args='-scales=1000,5000,20000 -json=bench-mission.json')
+example (compare): runfile('bench-mission.py', args='-json=new.json -compare=old.json')
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from uasutils.synthetic import make_mission
+from uasutils.scan import walk_images, find_images
+from uasutils.imgindex import indexed_dt_tags
+from uasutils.gpx import load_gpx_dir
+from uasutils.trackcache import TrackCache
+from uasutils.geotag import screen_track, geotag_images, write_geotags
+from uasutils.match import match_images_to_track, to_ns
+from uasutils.exif import EXIF_DT_FORMAT
+from uasutils.frequency import FrequencyReport, image_times_ns
+from uasutils.timesync import track_speed_signal, estimate_offset
+from uasutils.cleanup import find_backups, remove_backups
+from uasutils.rename import plan_renames, find_collisions, RenameJournal
+from uasutils.exiftool import ExifToolPool
+from uasutils import exiftool_stub
+
+#Hard coded variables (same as geotag-with-gpx.py)
+ftypes = ['JPG', 'DNG']
+max_gps_err_per_sec_meters = 25
+max_time_offset = 10
+expected_freq_seconds = 1
+
+
+def exiftool_pool_check(imgfiles, nprocs=4):
+    '''
+    Writes GPS tags to imgfiles and one missing file through an ExifToolPool
+    of stub exiftool processes (uasutils/exiftool_stub.py): every image must
+    be reported written, the missing file must get exiftool's error, and
+    every process must exit when the pool is closed.
+    '''
+    missing = imgfiles[0].with_name('missing.JPG')
+    records = [(fn, 38.33, -121.67, 60.0, 90.0) for fn in imgfiles] + [(missing, 38.33, -121.67, None, None)]
+    with ExifToolPool(nprocs, [sys.executable, exiftool_stub.__file__]) as exiftool:
+        errors = exiftool.write_gps_batch(records, keep_original=False)
+        procs = [tool.proc for tool in exiftool.tools]
+    assert errors[:-1] == [None] * len(imgfiles), f'{sum(e is not None for e in errors[:-1])} stub writes failed'
+    assert errors[-1] is not None and 'File not found' in errors[-1], f'missing file not reported: {errors[-1]!r}'
+    assert all(proc.poll() is not None for proc in procs), 'stub exiftool processes still running after close'
+
+
+def check_timediff(geotagdf, name):
+    '''TimeDiff of every geotag row must be |ImageDateTime - UTCTime| (the columns written to the csv)'''
+    diff = np.abs(to_ns(geotagdf['ImageDateTime']) - to_ns(geotagdf['UTCTime'])) / 1e9
+    bad = np.flatnonzero(np.abs(diff - geotagdf['TimeDiff'].to_numpy()) > 1e-6)
+    assert len(bad) == 0, (f'{name}: TimeDiff does not match ImageDateTime and UTCTime for {len(bad)} images, '
+                           f'e.g. {geotagdf.iloc[bad[0]][["ImageDateTime", "UTCTime", "TimeDiff"]].to_dict()}')
+
+
+def run_mission(mission, workers):
+    '''
+    Runs every step on mission (make_mission() result), returns dict step
+    -> (seconds, items).  Output printed by the steps is discarded.
+    '''
+    results = {}
+    imgdir, gpxdir, imgoffset = mission['imgdir'], mission['gpxdir'], mission['imgoffset']
+
+    def timed(name, items, func, *args, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            result = func(*args, **kwargs)
+            results[name] = (time.perf_counter() - t0, items)
+        return result
+
+    nfix, nimg = mission['nfixes'], mission['nimages']
+    with tempfile.TemporaryDirectory() as cachedir:
+        gpxdf = timed('gpx_load', nfix, load_gpx_dir, gpxdir, workers=1)
+        timed('gpx_load_parallel', nfix, load_gpx_dir, gpxdir, workers=None)
+        timed('gpx_cache_write', nfix, load_gpx_dir, gpxdir, workers=1, cache=TrackCache(cachedir))
+        timed('gpx_cache_read', nfix, load_gpx_dir, gpxdir, workers=1, cache=TrackCache(cachedir))
+    gpxdf, dropped = timed('track_qc', nfix, screen_track, gpxdf, max_gps_err_per_sec_meters, verbose=False)
+
+    imgfiles, backups = timed('image_walk', nimg, walk_images, imgdir, ftypes)
+    timed('image_find_glob', nimg, find_images, imgdir, ftypes)
+    dttags = timed('exif_scan', nimg, indexed_dt_tags, imgdir, imgfiles, workers=workers, use_index=False)
+    timed('exif_index_cold', nimg, indexed_dt_tags, imgdir, imgfiles, workers=workers)
+    timed('exif_index_warm', nimg, indexed_dt_tags, imgdir, imgfiles, workers=workers)
+
+    gpx1hzdf = timed('aggregate_1hz', nfix, lambda: gpxdf.groupby('dt', as_index=False).mean(numeric_only=True))
+    imgdts = pd.to_datetime(pd.Series([dt for dt, subsec in dttags]), format=EXIF_DT_FORMAT)
+    timed('nearest_match', nimg, match_images_to_track, gpx1hzdf, imgfiles, imgdts, imgoffset, max_time_offset)
+    geotagdf, nomatch = timed('geotag_images', nimg, geotag_images, gpxdf, imgfiles, dttags, imgoffset,
+                              max_time_offset, dropped=dropped)
+    assert not nomatch.any(), f'{nomatch.sum()} of {nimg} synthetic images not matched'
+    check_timediff(geotagdf, 'geotag_images')
+    interpdf, nomatch_interp = timed('geotag_interp', nimg, geotag_images, gpxdf, imgfiles, dttags, imgoffset,
+                                     max_time_offset, interp=True, dropped=dropped)
+    assert not nomatch_interp.any(), f'{nomatch_interp.sum()} of {nimg} synthetic images not interpolated'
+    check_timediff(interpdf, 'geotag_interp')
+    with tempfile.TemporaryDirectory() as csvdir:
+        timed('csv_write', nimg, geotagdf.to_csv, Path(csvdir, 'geotag.csv'), index=False)
+    written = timed('exif_write', nimg, write_geotags, geotagdf, nomatch, workers=max(workers, 4))
+    assert None not in written, 'GPS tags not written to every synthetic image'
+    timed('exiftool_pool', nimg, exiftool_pool_check, imgfiles)
+
+    report = timed('frequency', nimg, FrequencyReport, imgfiles, dttags, expected_freq_seconds)
+    timed('frequency_gpx', nimg, report.gpx_coverage, gpxdf['dt'], imgoffset, max_time_offset)
+    image_ns, valid = image_times_ns(dttags)
+    timed('timesync', nimg, lambda: estimate_offset(image_ns[valid], track_speed_signal(gpxdf), -60, 60))
+    #every flight's clock error must be found from its own images over the whole mission track
+    #(in +-10 minutes: flights of the same length are alike, so a wider search can land on another flight)
+    reference = track_speed_signal(gpxdf)
+    flightdirs = np.array([fn.parent for fn in imgfiles], dtype=object)
+    for flightdir in sorted(set(flightdirs)):
+        rows = (flightdirs == flightdir) & valid
+        est, corr, confidence, curve = estimate_offset(image_ns[rows], reference, -600, 600)
+        assert abs(est - imgoffset) <= 1, (f'{flightdir.name}: offset estimated {est:.1f} s '
+                                           f'(confidence {confidence:.2f}), not {imgoffset} s')
+
+    if backups:
+        backups = timed('backup_walk', len(backups), find_backups, imgdir)
+        cleanup = timed('cleanup', len(backups), remove_backups, backups, workers=8, check_geotag=True)
+        assert cleanup.deleted == len(backups), f'{cleanup.deleted} of {len(backups)} backups deleted'
+
+    def rename():
+        moves, mkdirs = plan_renames(imgfiles, [dt for dt, subsec in dttags], 0, 1, sepdir=True)
+        if find_collisions(moves):
+            raise ValueError('rename collisions in synthetic mission')
+        journal = RenameJournal(imgdir)
+        journal.write(moves, mkdirs)
+        journal.apply()
+    timed('rename', nimg, rename)
+    return results
+
+
+def versions():
+    '''Software versions recorded with the results'''
+    try:
+        commit = subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                                cwd=Path(__file__).parent, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ''
+    return {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+            'pandas': pd.__version__, 'platform': platform.platform()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the workflow on synthetic missions.')
+    parser.add_argument('-scales', '--scales', dest='scales', default='1000,5000,20000',
+                        help='comma separated numbers of camera triggers [default 1000,5000,20000]')
+    parser.add_argument('-dng', '--dng', dest='dng', action='store_true',
+                        help='write a DNG as well as a JPG for every trigger')
+    parser.add_argument('-hz', '--gps_hz', dest='hz', type=float, default=5,
+                        help='gpx fixes per second [default 5]')
+    parser.add_argument('-perflight', '--captures_per_flight', dest='perflight', type=int, default=600,
+                        help='camera triggers per flight (one gpx file and image directory each) [default 600]')
+    parser.add_argument('-kb', '--image_kb', dest='kb', type=float, default=4,
+                        help='size of each synthetic JPG in KB (DNGs are 4x) [default 4]')
+    parser.add_argument('-workers', '--workers', dest='workers', type=int, default=1,
+                        help='number of parallel workers for reading image EXIF [default 1]')
+    parser.add_argument('-n', '--repeat', dest='repeat', type=int, default=1,
+                        help='number of runs per scale (a new mission each), best time is kept [default 1]')
+    parser.add_argument('-outdir', '--output_directory', dest='outdir', default=None,
+                        help='directory for the synthetic missions [default: temporary directory]')
+    parser.add_argument('-json', '--json', dest='json', default='bench-mission.json',
+                        help='json file the results are written to [default bench-mission.json]')
+    parser.add_argument('-compare', '--compare', dest='compare', default=None,
+                        help='json file of an earlier run to compare against')
+    args = parser.parse_args()
+
+    mission_ftypes = ['JPG', 'DNG'] if args.dng else ['JPG']
+    runs = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for ncaptures in [int(n) for n in args.scales.split(',')]:
+            best = {}
+            for i in range(args.repeat):
+                outdir = Path(args.outdir or tmpdir, f'mission_{ncaptures}_{i}')
+                t0 = time.perf_counter()
+                mission = make_mission(outdir, ncaptures, mission_ftypes, args.perflight, args.hz,
+                                       jpg_bytes=int(args.kb * 1024), dng_bytes=int(args.kb * 4096), backups=True)
+                tgen = time.perf_counter() - t0
+                print(f'\n{ncaptures} triggers: {mission["nimages"]} images, {mission["nflights"]} flights, '
+                      f'{mission["nfixes"]} fixes, {mission["bytes"] / 1e6:.0f} MB written in {tgen:.1f} s')
+                for step, (seconds, items) in run_mission(mission, args.workers).items():
+                    if step not in best or seconds < best[step][0]:
+                        best[step] = (seconds, items)
+            runs.append({'captures': ncaptures, 'images': mission['nimages'], 'fixes': mission['nfixes'],
+                         'flights': mission['nflights'],
+                         'steps': {step: {'seconds': round(seconds, 6), 'items': items,
+                                          'per_sec': round(items / seconds, 1) if seconds > 0 else None}
+                                   for step, (seconds, items) in best.items()}})
+            print(f'{"step":20s} {"seconds":>9s} {"items":>8s} {"items/sec":>11s}')
+            for step, r in runs[-1]['steps'].items():
+                print(f'{step:20s} {r["seconds"]:9.3f} {r["items"]:8d} {r["per_sec"] or 0:11.0f}')
+
+    result = {'created': datetime.now().isoformat(timespec='seconds'), 'versions': versions(),
+              'settings': {'dng': args.dng, 'hz': args.hz, 'perflight': args.perflight, 'kb': args.kb,
+                           'workers': args.workers, 'repeat': args.repeat},
+              'runs': runs}
+    with open(args.json, 'w') as f:
+        json.dump(result, f, indent=1)
+    print(f'\nResults written to {args.json}')
+
+    #change against an earlier run (same scale and step)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            old = json.load(f)
+        print(f'\nCompared to {args.compare} ({old["versions"].get("commit", "")}, {old["created"]}): '
+              f'time new / old (below 1 is faster)')
+        oldruns = {run['captures']: run for run in old['runs']}
+        for run in runs:
+            if run['captures'] not in oldruns:
+                continue
+            print(f'{run["captures"]} triggers:')
+            oldsteps = oldruns[run['captures']]['steps']
+            for step, r in run['steps'].items():
+                if step in oldsteps and oldsteps[step]['seconds'] > 0:
+                    ratio = r['seconds'] / oldsteps[step]['seconds']
+                    print(f'    {step:20s} {oldsteps[step]["seconds"]:9.3f} -> {r["seconds"]:9.3f}  {ratio:6.2f}'
+                          + ('  slower' if ratio > 1.2 else ''))
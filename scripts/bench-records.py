@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of building a per-image output table with uasutils.records.RecordStore
+against growing a DataFrame one row at a time (the old df.append pattern,
+run as pd.concat per row since DataFrame.append is gone from pandas 2+).
+
+Synthetic images (name, camera time, position) are added one record at a
+time at each size.  Time per image should stay flat for RecordStore
+(linear scaling) and grow with size for the per-row DataFrame (quadratic),
+which is only run up to -legacymax images.
+
+example: runfile('bench-records.py', args='-sizes 1000 5000 10000 50000')
+"""
+
+import argparse
+import time
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from uasutils.records import RecordStore
+
+#columns of the synthetic records
+DTYPES = {'ImageName': object, 'ImageDateTime': 'datetime64[ns]',
+          'GPSLatitude': float, 'GPSLongitude': float, 'GPSAltitude': float}
+
+
+def synthetic_images(n, seed=0):
+    '''Returns list of n (name, datetime, lat, lon, alt) tuples at ~1 image/sec'''
+    rng = np.random.default_rng(seed)
+    t0 = datetime(2018, 10, 23, 18, 9)
+    lat = 38.33 + np.cumsum(rng.normal(0, 1e-5, n))
+    lon = -121.67 + np.cumsum(rng.normal(0, 1e-5, n))
+    alt = 50 + rng.normal(0, 0.5, n)
+    return [(f'IMG_{i:06d}.JPG', t0 + timedelta(seconds=i), lat[i], lon[i], alt[i]) for i in range(n)]
+
+
+def build_per_row(images):
+    '''Old pattern: grow the DataFrame by one row per image'''
+    df = pd.DataFrame(columns=list(DTYPES))
+    for name, dt, lat, lon, alt in images:
+        row = pd.DataFrame([{'ImageName': name, 'ImageDateTime': dt,
+                             'GPSLatitude': lat, 'GPSLongitude': lon, 'GPSAltitude': alt}])
+        df = row if df.empty else pd.concat([df, row], ignore_index=True)
+    return df
+
+
+def build_store(images):
+    '''RecordStore: append records, build the DataFrame once'''
+    store = RecordStore(DTYPES)
+    for name, dt, lat, lon, alt in images:
+        store.append(ImageName=name, ImageDateTime=dt, GPSLatitude=lat, GPSLongitude=lon, GPSAltitude=alt)
+    return store.to_frame()
+
+
+def best_time(func, images, repeat):
+    '''Returns (best seconds of repeat runs, result of last run)'''
+    times = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        df = func(images)
+        times.append(time.perf_counter() - t0)
+    return min(times), df
+
+
+# ===========================  BEGIN PARSER ==============================
+descriptionstr = ('  Benchmark RecordStore against growing a DataFrame one row per image.')
+parser = argparse.ArgumentParser(description=descriptionstr,
+                                 epilog='example: run bench-records.py '
+                                         '-sizes 1000 5000 10000 50000')
+#number of synthetic images
+parser.add_argument('-sizes', '--sizes', dest='sizes',
+                    type=int, nargs='+', required=False, default=[1000, 5000, 10000, 50000],
+                    help='numbers of synthetic images [default 1000 5000 10000 50000]')
+#largest size for the per-row DataFrame
+parser.add_argument('-legacymax', '--legacy_max', dest='legacymax',
+                    type=int, required=False, default=10000,
+                    help='only run the per-row DataFrame up to this many images [default 10000]')
+#repeats
+parser.add_argument('-n', '--repeat', dest='repeat',
+                    type=int, required=False, default=3,
+                    help='number of runs per size (best is reported) [default 3]')
+
+#parse
+args = parser.parse_args()
+
+print(f'{"images":>8s}  {"RecordStore":>22s}  {"DataFrame per row":>22s}')
+per_image = []
+for n in args.sizes:
+    images = synthetic_images(n)
+    t_store, df_store = best_time(build_store, images, args.repeat)
+    per_image.append(t_store / n)
+    line = f'{n:8d}  {t_store:8.3f} s {t_store / n * 1e6:7.2f} us/img'
+    if n <= args.legacymax:
+        t_row, df_row = best_time(build_per_row, images, 1)
+        line += f'  {t_row:8.3f} s {t_row / n * 1e6:7.2f} us/img'
+        if not np.allclose(df_row['GPSLatitude'].to_numpy(float), df_store['GPSLatitude'].to_numpy(float)):
+            line += '  WARNING: results differ'
+    else:
+        line += f'  {"skipped":>22s}'
+    print(line)
+
+#linear scaling -> time per image roughly constant across sizes
+print(f'RecordStore time per image, largest / smallest size: {per_image[-1] / per_image[0]:.2f}x')
@@ -7,60 +7,122 @@ Will loop through dir of images and create a csv file with imagename,
 datetime from exif.  User will need to add true utc time (from image content)
 in a separate application/image viewer.
 
+With -gpxdir the offset is estimated automatically instead, from a directory
+of flight images and the gpx track of the flight (uasutils/timesync.py): the
+image capture rate is cross-correlated with the track speed (or with the
+camera trigger messages of DataFlash .BIN logs in -gpxdir) over every offset
+that puts the images within the track, or -minoffset to -maxoffset seconds.  The estimate, its correlation and a
+confidence score are printed and filled in the csv.
+
 example: runfile('derive-time-sync-offset.py', args='-dir=T:/UAS/2018-676-FA/SfM_img/RA_TIMESYNC')
+example (automatic): runfile('derive-time-sync-offset.py', args='-dir=D:/mydir/data/images/f01 -gpxdir=D:/mydir/data/gpx')
 
 @author: jlogan
 """
 import argparse
+from math import isnan
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
 import pandas as pd
-import exifread
+from uasutils.scan import find_images, add_scan_args
+from uasutils.imgindex import indexed_dt_tags
+from uasutils.records import RecordStore
+from uasutils.gpx import load_gpx_dir, track_files
+from uasutils.dataflash import read_bin_camera
+from uasutils.match import to_ns
+from uasutils.frequency import image_times_ns
+from uasutils.timesync import track_speed_signal, event_signal, estimate_offset
+from uasutils.profiling import add_profile_args, profiler_from_args, finish_profile
 
 #file types to use
 ftypes = ['JPG']
 
-#using exifread which works for DNG and JPG
-def get_dt_orignal(fn):
-    '''Gets DateTimeOriginal value from EXIF'''
-    with open(fn, 'rb') as i:
-        tags = exifread.process_file(i)
-    dt_orig = str(tags.get('EXIF DateTimeOriginal'))
-    return dt_orig
-
-# ===========================  BEGIN PARSER ==============================
-descriptionstr = ('  Script to rename images collected with UAS camera.')
-parser = argparse.ArgumentParser(description=descriptionstr, 
-                                 epilog='example: run derive-time-sync-offset.py '
-                                         '-dir=D:/mydir/data/timesyncimages ')
-#input directory arg
-parser.add_argument('-dir', '--input_directory', dest='indir',  
-                    required=True,
-                    help='input directory with time sync images')
-
-#parse
-args = parser.parse_args()
-
-#set var
-indir = Path(args.indir)
-
-#make dataframe
-columns = ['IMAGENAME','CAMERATIME', 'UTCTIME', 'IMAGE_TO_UTC_OFFSET']
-df = pd.DataFrame(columns=columns)
-
-
-#loop through files, append to df
-for ftype in ftypes:
-    for fn in indir.glob('*.' + ftype):
+#automatic estimation (-gpxdir)
+min_confidence = 0.3 #estimates with lower confidence are reported as unreliable
+window = 5 #seconds the image rate and track speed are smoothed over
+
+#guard needed because -procs worker processes re-import this script on windows
+if __name__ == '__main__':
+    # ===========================  BEGIN PARSER ==============================
+    descriptionstr = ('  Script to list camera times of time sync images, or estimate the camera to utc offset from the gpx track.')
+    parser = argparse.ArgumentParser(description=descriptionstr, 
+                                     epilog='example: run derive-time-sync-offset.py '
+                                             '-dir=D:/mydir/data/timesyncimages ')
+    #input directory arg
+    parser.add_argument('-dir', '--input_directory', dest='indir',  
+                        required=True,
+                        help='input directory with time sync images (or flight images with -gpxdir)')
+
+    #automatic estimation args
+    parser.add_argument('-gpxdir', '--gpx_directory', dest='gpxdir',
+                        required=False,
+                        help='estimate the offset from the gpx files of the flight in this directory')
+    parser.add_argument('-minoffset', '--min_offset_sec', dest='minoffset',
+                        type=float, required=False, default=None,
+                        help='smallest camera to utc offset searched in seconds, the range must include the true offset '
+                             '(a camera set to local time is hours off) [default: every offset that puts the images '
+                             'within the track]')
+    parser.add_argument('-maxoffset', '--max_offset_sec', dest='maxoffset',
+                        type=float, required=False, default=None,
+                        help='largest camera to utc offset searched in seconds [default: see -minoffset]')
+
+    #parallel exif reading args (-workers, -procs)
+    add_scan_args(parser)
+    #instrumentation args (-profile, -cprofile)
+    add_profile_args(parser)
+
+    #parse
+    args = parser.parse_args()
+    prof = profiler_from_args(args)
+
+    #set var
+    indir = Path(args.indir)
+
+    #read image timestamps from the image index (only new/changed images are read, in parallel if -workers > 1)
+    with prof.stage('exif_scan') as stage:
+        imgfiles = find_images(indir, ftypes, recursive=False)
+        dttags = indexed_dt_tags(indir, imgfiles, workers=args.workers, processes=args.use_processes, use_index=not args.noindex)
+        stage['items'] = stage['files'] = len(imgfiles)
+
+    #estimate offset by cross-correlating image capture rate with track speed
+    utctime, offset = '', ''
+    if args.gpxdir is not None:
+        #camera trigger (CAM) messages of DataFlash logs match the images one to one, otherwise use the track speed
+        with prof.stage('gpx_load'):
+            cams = [read_bin_camera(fn) for fn in track_files(args.gpxdir) if fn.suffix.lower() == '.bin']
+            cams = [df for df in cams if df is not None and len(df)]
+            if cams:
+                print(f'Using {sum(len(df) for df in cams)} camera trigger messages of {len(cams)} DataFlash logs.')
+                reference = event_signal(to_ns(pd.concat(cams)['dt']))
+            else:
+                reference = track_speed_signal(load_gpx_dir(Path(args.gpxdir)))
+        with prof.stage('timesync', items=len(imgfiles)):
+            ns, valid = image_times_ns(dttags)
+            est, corr, confidence, curve = estimate_offset(ns[valid], reference, args.minoffset, args.maxoffset, window=window)
+        if isnan(est):
+            raise Exception(f'No offset (in range {args.minoffset} to {args.maxoffset} seconds) puts the image times '
+                            f'within the gpx track, stopping execution')
+        print(f'Estimated camera to utc offset: {est:.1f} s (correlation {corr:.2f}, confidence {confidence:.2f})')
+        if confidence < min_confidence:
+            print(f'Confidence is below {min_confidence}, check the offset with time sync images.')
+        else:
+            print(f'Use -imgoffset={est:.1f} for geotag-with-gpx.py.')
+        offset = round(est, 1)
+
+    #collect one record per image, UTCTIME and IMAGE_TO_UTC_OFFSET are left for the user to fill in
+    #(or filled with the estimate)
+    store = RecordStore({'IMAGENAME': object, 'CAMERATIME': 'datetime64[ns]',
+                         'UTCTIME': object, 'IMAGE_TO_UTC_OFFSET': object}, capacity=len(imgfiles))
+    for fn, (dt_orig, subsec) in zip(imgfiles, dttags):
         #get image taken datetime from exif
-        imgdt = datetime.strptime(get_dt_orignal(fn), '%Y:%m:%d %H:%M:%S')
-        
-        df = df.append({
-                'IMAGENAME': fn,
-                'CAMERATIME':  imgdt,
-                'UTCTIME': '',
-                'IMAGE_TO_UTC_OFFSET':  '',
-                }, ignore_index=True)
-    
-#write to csv (sort by name first)
-df.sort_values('IMAGENAME').to_csv(indir.joinpath('cameratimeoffset.csv'), index=False)    
+        imgdt = datetime.strptime(dt_orig, '%Y:%m:%d %H:%M:%S')
+        if offset != '':
+            utctime = imgdt + timedelta(seconds=offset)
+        store.append(IMAGENAME=fn, CAMERATIME=imgdt, UTCTIME=utctime, IMAGE_TO_UTC_OFFSET=offset)
+    df = store.to_frame()
+
+    #write to csv (sort by name first)
+    df.sort_values('IMAGENAME').to_csv(indir.joinpath('cameratimeoffset.csv'), index=False)
+
+    #per-stage time, CPU, reads and memory (-profile)
+    finish_profile(prof, args, indir.joinpath('cameratimeoffset'))
@@ -9,6 +9,13 @@ Since some gpx file have more than 1 position recorded for each second, and beca
 UAS camera only has 1 sec precision, all positions will be averaged for each second.
 Position assigned to image will be mean of all positions for the second during which 
 the image was acquired.
+With -interp, the full rate track is instead interpolated at the image time
+(including SubSecTimeOriginal if the camera writes it).
+
+GPS tags are written in place to the images that were matched (see
+uasutils/exifwrite.py).  Images the built-in writer can't handle, or all
+images with -exiftool, are written by a pool of exiftool processes
+(uasutils/exiftool.py).
 
 example: runfile('geotag-with-gpx.py', args='-imgdir=D:/mydir/data/images 
                                              -gpxdir=D:/mydir/data/gpx 
@@ -18,16 +25,17 @@ example: runfile('geotag-with-gpx.py', args='-imgdir=D:/mydir/data/images
 
 import argparse
 from pathlib import Path
-from datetime import datetime, timedelta
-import exifread
-import numpy as np
-from lxml import etree
-import pandas as pd
-import subprocess
-import pytz
-
-#Path to your exiftool.exe
-EXIFTOOLPATH = r'D:/soft/exiftool-10.49/exiftool.exe'
+from datetime import datetime
+from uasutils.scan import find_images, add_scan_args
+from uasutils.imgindex import indexed_dt_tags, refresh_index
+from uasutils.gpx import load_gpx_dir
+from uasutils.trackcache import TrackCache
+from uasutils.geotag import screen_track, geotag_images, print_flight_assignment, write_geotags, written_files
+from uasutils.exiftool import find_exiftool
+from uasutils.profiling import add_profile_args, profiler_from_args, finish_profile
+
+#Path to your exiftool.exe (None: EXIFTOOL environment variable or exiftool on PATH)
+EXIFTOOLPATH = None
 
 #Inputs (these will be used if not entered in command line)
 gpxdirstr = 'T:/UAS/2018-676-FA/tlogs/yellow/aircraft/gpx'
@@ -36,235 +44,167 @@ cam_to_utc_adjust_sec = 0 #Number of seconds (+-) to adjust camera time to get t
 
 #Hard coded variables (change these if needed)
 geotagfn = 'geotag'  #suffix for naming output geotag csv file (prefix is imgdir)
+trackqcfn = 'trackqc'  #suffix for naming output csv of suspect track intervals (prefix is imgdir)
 ftypes = ['JPG', 'DNG']  #file types to geotag
 max_gps_err_per_sec_meters = 25 #cutoff to determine if there are overlapping gpx files in gpx batch
 max_time_offset = 10 #max acceptable difference between GPX time and image time
+gpx_cache_max_mb = 500 #size limit of parsed gpx cache (default location gpxdir/.gpxcache)
+exiftool_procs = 4 #number of exiftool processes used for images the built-in writer can't handle
 
 #log start time
 start = datetime.now()
 
-#Helper functions
-
-#using exifread which works for DNG and JPG
-def get_dt_original(fn):
-    '''Gets DateTimeOriginal value from EXIF'''
-    with open(fn, 'rb') as i:
-        tags = exifread.process_file(i)
-    dt_orig = str(tags.get('EXIF DateTimeOriginal'))
-    return dt_orig
-
-def m_per_deg_lat(latdeg):
-    '''Calculates meters per degree of latitude at latdeg
-       from: https://en.wikipedia.org/wiki/Geographic_coordinate_system#Expressing_latitude_and_longitude_as_linear_units
-    '''
-    m_at_lat = 111132.954 - 559.822 * np.cos(np.deg2rad(2.0 * latdeg)) + 1.175 * np.cos(np.deg2rad(4.0 * latdeg)) - 0.0023 * np.cos(np.deg2rad(6.0 * latdeg))
-    return m_at_lat
-
-def m_per_deg_lon(latdeg):
-    '''Calculates meters per degree of longitude at latdeg
-       from: https://en.wikipedia.org/wiki/Geographic_coordinate_system#Expressing_latitude_and_longitude_as_linear_units
-    '''
-    m_at_lon = 111412.84 * np.cos(np.deg2rad(latdeg)) - 93.5 * np.cos(np.deg2rad(3.0 * latdeg)) + 0.118 * np.cos(np.deg2rad(5.0 * latdeg))
-    return m_at_lon   
-
-def nearest(items, pivot):
-    #from: https://stackoverflow.com/questions/32237862/find-the-closest-date-to-a-given-date
-    return min(items, key=lambda x: abs(x - pivot))
-
-def nearest_ind(items, pivot):
-    #from: https://stackoverflow.com/questions/32237862/find-the-closest-date-to-a-given-date
-    time_diff = np.abs([date - pivot for date in items])
-    return time_diff.argmin(0)
-
-def mp_gpx_tag_to_pdseries(tree, namespace, tag):
-    """
-    from: https://github.com/sackerman-usgs/UAS_processing/blob/master/UAS_GPXandJPG_processing.ipynb
-    # Extract tag value from GPX file as pandas series
-    First, get the element list.
-    """
-    elist = tree.xpath('./def:trk//def:trkpt//def:'+tag, namespaces=namespace)
-    ser = pd.Series([e.text for e in elist], name=tag)
-    return(ser)
-    
-def mp_gpx_to_df(gpxfile, namespace):
-    """
-    Adapted from: https://github.com/sackerman-usgs/UAS_processing/blob/master/UAS_GPXandJPG_processing.ipynb
-    """
-    # Parse GPX
-    tree = etree.parse(gpxfile)
-    
-    # Extract latitude and longitude to initialize GPX dataframe
-    namespace = {'def': namespace}
-    elist = tree.xpath('./def:trk//def:trkpt',namespaces=namespace)
-    gpxdf = pd.DataFrame([e.values() for e in elist], columns=['lat', 'lon']).apply(pd.to_numeric)
-    
-    # Extract each tag (including time) and add to dataframe
-    taglist = ['time', 'ele', 'course', 'roll', 'pitch', 'mode']
-    for tag in taglist:
-        gpxdf = gpxdf.join(pd.to_numeric(mp_gpx_tag_to_pdseries(tree, namespace, tag), errors='ignore'))
-    
-    return(gpxdf)
-    
-
-# ===========================  BEGIN ARGUMENT PARSER ==============================
-descriptionstr = ('  Script to geotag directories of images using a collection of gpx files.')
-parser = argparse.ArgumentParser(description=descriptionstr, 
-                                 epilog='example: run geotag-with-gpx.py '
-                                         '-imgdir=D:/mydir/data/images '
-                                         '-gpxdir=D:/mydir/data/gpx '
-                                         '-imgoffset=5')
-#input gpx directory arg
-parser.add_argument('-gpxdir', '--gpx_directory', dest='gpxdir_arg',  
-                    required=False,
-                    help='input directory with gpx files')
-
-#input image directory arg
-parser.add_argument('-imgdir', '--image_directory', dest='imgdir_arg',  
-                    required=False,
-                    help='input directory with image files or directories of images')
-
-#utc offset arg
-parser.add_argument('-imgoffset', '--cam_to_utc_adjust_sec', dest='imgoffset_arg',  
-                    type=float, required=False,
-                    help='image time to utc adjustment in seconds')
-
-#parse
-args = parser.parse_args()
-# ===========================  END ARGUMENT PARSER ==============================
-
-#if arguments supplied via command line, use values to set inputs, otherwise use
-#inputs set in script above
-if args.gpxdir_arg is not None:
-    gpxdirstr = args.gpxdir_arg
-
-if args.imgdir_arg is not None:
-    imgdirstr = args.imgdir_arg
-
-if args.imgoffset_arg is not None:
-    cam_to_utc_adjust_sec = args.imgoffset_arg
-
-#Set path objects
-gpxdir = Path(gpxdirstr)
-imgdir = Path(imgdirstr)
-
-#check that paths exist
-for directory in [gpxdir, imgdir]:
-    try:
-        if not directory.exists():
-            raise Exception(f'{str(directory.absolute())} dir does not exist, stopping execution')
-    except:
-            raise Exception(f'{str(directory.absolute())} dir does not exist, stopping execution')
-
-#instatiate empty df to store all gpx data
-gpxdf = pd.DataFrame()
-
-#load all gpx file in gpxdir into one df
-for fn in gpxdir.glob('*.gpx'):
-    print('Loading ' + str(fn.resolve()) + ' ...')
-    gpxdf = pd.concat([gpxdf, mp_gpx_to_df(str(fn.resolve()), 'http://www.topografix.com/GPX/1/1')])
-    
-#convert datetime to pandas datetime dtype in UTC, drop orig time column.
-#UTC conversion needed (utc = true)
-gpxdf['dt'] = pd.to_datetime(gpxdf['time'], format='%Y-%m-%dT%H:%M:%S', utc=True)
-gpxdf.drop(columns=['time'], inplace=True)
-
-#ensure that duplicates are close together spatially, 
-#then calc mean lat/long/elev for each
-latdf = gpxdf.groupby('dt')['lat'].agg(['max','min'])
-latdf['diff_deg'] = np.abs(latdf['max']-latdf['min'])
-#calc approx. dist. in meters 
-latdf['diff_m'] = latdf['diff_deg'] * m_per_deg_lat(latdf['max'])
-
-londf = gpxdf.groupby('dt')['lon'].agg(['max','min'])
-londf['diff_deg'] = np.abs(londf['max']-londf['min'])
-#calc approx. dist. in meters
-londf['diff_m'] = londf['diff_deg'] * m_per_deg_lon(londf['max'])
-
-#ensure that neither lat or lon change more than 'max_gps_err_per_sec_meters' in each 
-#second.  If they do, this indicates that there may be overlapping gpx files (from two GPS units?)
-if any(i >= max_gps_err_per_sec_meters for i in [latdf.diff_m.abs().max(), londf.diff_m.abs().max()]):
-    raise ValueError(f'Coordinates in gpx files varied by more than {max_gps_err_per_sec_meters} meters within one second interval. Possible overlapping gpx files. Stopping execution.')
-    
-# if all good, groupby dt and derive mean coordinates into new 1 Hz df
-gpx1hzdf = gpxdf.groupby('dt', as_index=False).mean()
-
-#instatiate new dataframe to hold image name, lat, long, etc
-geotagdf = pd.DataFrame(columns=['ImagePath','SourceFile','ImageDateTime', 'ImageDateTime_Adj','UTCTime','TimeDiff','GPSLatitude','GPSLongitude','GPSAltitude', 'GPSHeading','GPSRoll','GPSPitch'])
-
-#loop through ftypes
-for ftype in ftypes:
-#loop through subdir and write data to pandas df
-    #for fn in tqdm(imgdir.glob('*.' + ftype)):
-    for fn in imgdir.glob('**/*.' + ftype):
-        #Load image datetime from exif
-        imgdt = datetime.strptime(get_dt_original(fn), '%Y:%m:%d %H:%M:%S')
-        
-        #adjust image time
-        adjimgdt = imgdt + timedelta(seconds=cam_to_utc_adjust_sec)
-        #after applying cam_to_utc_adjust, this should be in utc, so make tzone aware
-        adjimgdt = adjimgdt.replace(tzinfo=pytz.UTC)
-                          
-        #find nearest dt stamp in gpx1hzdf
-        idx = nearest_ind(gpx1hzdf['dt'], adjimgdt)
-        gpxtime = gpx1hzdf.loc[idx]['dt'].to_pydatetime()
-
-        #check if exceeds max time offset
-        abs_actual_offset = np.abs((imgdt - gpxtime.replace(tzinfo=None)).total_seconds())
-        if abs_actual_offset > max_time_offset:
-            print(f'No GPS data found within {max_time_offset} seconds of adjusted image time for image {fn}, skipping geotag operation.')
-            geotagdf = geotagdf.append({
-                    'ImagePath': fn,
-                    'SourceFile': fn,
-                    'ImageDateTime': imgdt,
-                    'ImageDateTime_Adj' : adjimgdt,
-                    'UTCTime': gpxtime,
-                    'TimeDiff': abs_actual_offset,
-                    'GPSLatitude': np.NaN,
-                    'GPSLongitude': np.NaN,
-                    'GPSAltitude': np.NaN,
-                    'GPSHeading': np.NaN,
-                    'GPSRoll': np.NaN,
-                    'GPSPitch': np.NaN,
-                    }, ignore_index=True)
-        else:
-            geotagdf = geotagdf.append({
-                    'ImagePath': fn,
-                    'SourceFile': fn,
-                    'ImageDateTime': imgdt,
-                    'ImageDateTime_Adj' : adjimgdt,
-                    'UTCTime': gpxtime,
-                    'TimeDiff': abs_actual_offset,
-                    'GPSLatitude': gpx1hzdf.loc[idx]['lat'],
-                    'GPSLongitude': gpx1hzdf.loc[idx]['lon'],
-                    'GPSAltitude': gpx1hzdf.loc[idx]['ele'],
-                    'GPSHeading': gpx1hzdf.loc[idx]['course'],
-                    'GPSRoll': gpx1hzdf.loc[idx]['roll'],
-                    'GPSPitch': gpx1hzdf.loc[idx]['pitch'],
-                    }, ignore_index=True)
-
-#Print to console
-print(f'GPX record: {str(gpxdf["dt"].min())} - {str(gpxdf["dt"].max())}')
-print(f'Image time record: {str(geotagdf["ImageDateTime"].min())} - {str(geotagdf["ImageDateTime"].max())}')
-print(f'Adjusted image time record (image time + {cam_to_utc_adjust_sec}): {str(geotagdf["ImageDateTime_Adj"].min())} - {str(geotagdf["ImageDateTime_Adj"].max())}')
-print(f'GPS positions found for {geotagdf["GPSLatitude"].notna().sum()} of {len(geotagdf)} images.')
-
-#Export to geotag csv 
-geotagdf.to_csv(imgdir.joinpath(f'{str(imgdir.name)}_{geotagfn}.csv'), index=False)
-csvfnstr = imgdir.joinpath(f'{str(imgdir.name)}_{geotagfn}.csv').as_posix()
-
-#run exiftool using subprocess
-#add -P to keep original file modification date
-print(f'running exiftool command: {EXIFTOOLPATH} -P -csv={csvfnstr} -gpslatituderef=N -gpslongituderef=W -gpsaltituderef=above -gpstrackref=T -r {imgdirstr}')
-subprocess.run(f'{EXIFTOOLPATH} -P -csv={csvfnstr} -gpslatituderef=N -gpslongituderef=W -gpsaltituderef=above -gpstrackref=T -r {imgdirstr}'.split())
-
-#log total time
-ts = datetime.now() - start
-
-            
-#Give user command to undo
-print(f'Geotagging completed in {str(ts)}.')
-print('Original files have been preserved.')
-print('If you would like to undo the geotagging operation, issue the following command in a terminal window:\n')
-print(f'         {EXIFTOOLPATH} -restore_original -r {imgdirstr}')           
-            
-    
\ No newline at end of file
+#guard needed because worker processes (gpx parsing, -procs) re-import this
+#script on windows
+if __name__ == '__main__':
+    # ===========================  BEGIN ARGUMENT PARSER ==============================
+    descriptionstr = ('  Script to geotag directories of images using a collection of gpx files.')
+    parser = argparse.ArgumentParser(description=descriptionstr, 
+                                     epilog='example: run geotag-with-gpx.py '
+                                             '-imgdir=D:/mydir/data/images '
+                                             '-gpxdir=D:/mydir/data/gpx '
+                                             '-imgoffset=5')
+    #input gpx directory arg
+    parser.add_argument('-gpxdir', '--gpx_directory', dest='gpxdir_arg',  
+                        required=False,
+                        help='input directory with gpx files (and/or DataFlash .BIN logs)')
+
+    #input image directory arg
+    parser.add_argument('-imgdir', '--image_directory', dest='imgdir_arg',  
+                        required=False,
+                        help='input directory with image files or directories of images')
+
+    #utc offset arg
+    parser.add_argument('-imgoffset', '--cam_to_utc_adjust_sec', dest='imgoffset_arg',  
+                        type=float, required=False,
+                        help='image time to utc adjustment in seconds')
+
+    #interpolate positions instead of using 1 Hz means
+    parser.add_argument('-interp', '--interpolate', dest='interp',
+                        action='store_true',
+                        help='interpolate track at sub-second image time instead of using 1 Hz mean positions')
+
+    #number of processes used to parse gpx files
+    parser.add_argument('-gpxworkers', '--gpx_workers', dest='gpxworkers',
+                        type=int, required=False, default=None,
+                        help='number of processes for parsing gpx files [default: number of cpus]')
+
+    #parsed gpx cache args
+    parser.add_argument('-gpxcache', '--gpx_cache_directory', dest='gpxcache_arg',
+                        required=False,
+                        help='directory for cache of parsed gpx files [default: gpxdir/.gpxcache]')
+    parser.add_argument('-nocache', '--no_gpx_cache', dest='nocache',
+                        action='store_true',
+                        help='always parse gpx files, do not read or write the cache')
+
+    #exif writing args
+    parser.add_argument('-atomic', '--atomic_write', dest='atomic',
+                        action='store_true',
+                        help='write GPS tags to a temporary copy of each image that replaces it when complete')
+    parser.add_argument('-exiftool', '--use_exiftool', dest='use_exiftool',
+                        action='store_true',
+                        help='write GPS tags to all images with exiftool instead of the built-in writer, keeps *_original copies')
+    parser.add_argument('-exiftoolpath', '--exiftool_path', dest='exiftoolpath_arg',
+                        required=False,
+                        help='path to exiftool [default: EXIFTOOL environment variable or exiftool on PATH]')
+
+    #parallel exif reading args (-workers, -procs)
+    add_scan_args(parser)
+    #instrumentation args (-profile, -cprofile)
+    add_profile_args(parser)
+
+    #parse
+    args = parser.parse_args()
+    prof = profiler_from_args(args)
+    # ===========================  END ARGUMENT PARSER ==============================
+
+    #if arguments supplied via command line, use values to set inputs, otherwise use
+    #inputs set in script above
+    if args.gpxdir_arg is not None:
+        gpxdirstr = args.gpxdir_arg
+
+    if args.imgdir_arg is not None:
+        imgdirstr = args.imgdir_arg
+
+    if args.imgoffset_arg is not None:
+        cam_to_utc_adjust_sec = args.imgoffset_arg
+
+    if args.exiftoolpath_arg is not None:
+        EXIFTOOLPATH = args.exiftoolpath_arg
+
+    #Set path objects
+    gpxdir = Path(gpxdirstr)
+    imgdir = Path(imgdirstr)
+
+    #check that paths exist
+    for directory in [gpxdir, imgdir]:
+        try:
+            if not directory.exists():
+                raise Exception(f'{str(directory.absolute())} dir does not exist, stopping execution')
+        except:
+                raise Exception(f'{str(directory.absolute())} dir does not exist, stopping execution')
+
+    #load all gpx file in gpxdir into one df sorted by time (files parsed in parallel),
+    #'source' column holds the gpx file name of each fix
+    #(unchanged files are loaded from the parsed gpx cache)
+    if args.nocache:
+        gpxcache = None
+    else:
+        gpxcache = TrackCache(args.gpxcache_arg or gpxdir.joinpath('.gpxcache'), max_bytes=gpx_cache_max_mb * 1024 * 1024)
+    with prof.stage('gpx_load') as stage:
+        gpxdf = load_gpx_dir(gpxdir, workers=args.gpxworkers, cache=gpxcache)
+        stage['items'], stage['files'] = len(gpxdf), gpxdf['source'].nunique()
+
+    #single pass track QC: report suspect intervals (written to imgdir_trackqc.csv) and drop fixes in
+    #seconds where positions vary by more than 'max_gps_err_per_sec_meters', which indicates that
+    #there may be overlapping gpx files (from two GPS units?)
+    with prof.stage('track_qc', items=len(gpxdf)):
+        gpxdf, dropped = screen_track(gpxdf, max_gps_err_per_sec_meters, qcfile=imgdir.joinpath(f'{str(imgdir.name)}_{trackqcfn}.csv'))
+
+    #read image timestamps from the image index (only new/changed images are read, in parallel if -workers > 1), order is deterministic
+    with prof.stage('exif_scan') as stage:
+        imgfiles = find_images(imgdir, ftypes)
+        dttags = indexed_dt_tags(imgdir, imgfiles, workers=args.workers, processes=args.use_processes, use_index=not args.noindex)
+        stage['items'] = stage['files'] = len(imgfiles)
+
+    #match all images to nearest dt stamp of 1 Hz mean positions in one pass,
+    #or interpolate full rate track at image time (with sub-second precision if available)
+    with prof.stage('match', items=len(imgfiles)):
+        geotagdf, nomatch = geotag_images(gpxdf, imgfiles, dttags, cam_to_utc_adjust_sec, max_time_offset,
+                                          interp=args.interp, dropped=dropped)
+    for fn in geotagdf['ImagePath'][nomatch]:
+        print(f'No GPS data found within {max_time_offset} seconds of adjusted image time for image {fn}, skipping geotag operation.')
+
+    #Print to console
+    print(f'GPX record: {str(gpxdf["dt"].min())} - {str(gpxdf["dt"].max())}')
+    print(f'Image time record: {str(geotagdf["ImageDateTime"].min())} - {str(geotagdf["ImageDateTime"].max())}')
+    print(f'Adjusted image time record (image time + {cam_to_utc_adjust_sec}): {str(geotagdf["ImageDateTime_Adj"].min())} - {str(geotagdf["ImageDateTime_Adj"].max())}')
+    print_flight_assignment(geotagdf)
+    print(f'GPS positions found for {geotagdf["GPSLatitude"].notna().sum()} of {len(geotagdf)} images.')
+
+    #Export to geotag csv 
+    with prof.stage('csv_write', items=len(geotagdf)):
+        geotagdf.to_csv(imgdir.joinpath(f'{str(imgdir.name)}_{geotagfn}.csv'), index=False)
+
+    #write GPS tags only to images with a position (keeps file modification date),
+    #exiftool (persistent processes) is used for images the built-in writer can't handle
+    with prof.stage('exif_write') as stage:
+        written = write_geotags(geotagdf, nomatch, workers=max(args.workers, 4), atomic=args.atomic,
+                                use_exiftool=args.use_exiftool, exiftoolpath=EXIFTOOLPATH, exiftool_procs=exiftool_procs)
+        stage['items'] = stage['files'] = len(written)
+        #sizes and mtimes are kept, so the index has to be told about the new positions
+        refresh_index(imgdir, written_files(geotagdf, nomatch, written), workers=args.workers,
+                      use_index=not args.noindex)
+
+    #log total time
+    ts = datetime.now() - start
+
+    print(f'Geotagging completed in {str(ts)}.')
+    if 'exiftool' in written:
+        #Give user command to undo
+        print('Original files have been preserved for images written by exiftool.')
+        print('If you would like to undo the geotagging operation, issue the following command in a terminal window:\n')
+        print(f'         {" ".join(find_exiftool(EXIFTOOLPATH))} -restore_original -r {imgdirstr}')
+
+    #per-stage time, CPU, reads and memory (-profile)
+    finish_profile(prof, args, imgdir.joinpath(f'{str(imgdir.name)}_{geotagfn}'))
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Script version of notebooks/image_frequency_checker.
+
+Reports gaps between image times longer than the expected capture interval,
+duplicate timestamps and bursts of images, and with -gpxdir the images
+without a GPS fix nearby and gaps in the track while images were taken (see
+uasutils/frequency.py).  Timestamps come from the image metadata index, so
+rerunning on a large directory only reads new/changed images.  All images
+and their flags are written to imgdir_frequency.csv.
+
+example: runfile('image-frequency-checker.py', args='-imgdir=D:/mydir/data/images -freq=2')
+example (with gpx coverage): runfile('image-frequency-checker.py', args='-imgdir=D:/mydir/data/images
+                                       -gpxdir=D:/mydir/data/gpx -imgoffset=5')
+"""
+
+import argparse
+from pathlib import Path
+from datetime import datetime
+from uasutils.scan import walk_images, add_scan_args
+from uasutils.imgindex import indexed_dt_tags
+from uasutils.gpx import load_gpx_dir
+from uasutils.trackcache import TrackCache
+from uasutils.frequency import FrequencyReport, MAX_PRINT
+from uasutils.profiling import add_profile_args, profiler_from_args, finish_profile
+
+#Inputs (these will be used if not entered in command line)
+imgdirstr = 'D:/temp/test_geotag'
+expected_freq_seconds = 1 #images taken further apart than this are reported as gaps
+
+#Hard coded variables (change these if needed)
+frequencyfn = 'frequency'  #suffix for naming output csv file (prefix is imgdir)
+ftypes = ['JPG', 'DNG']  #file types to check
+max_time_offset = 10 #max acceptable difference between GPX time and image time
+gpx_cache_max_mb = 500 #size limit of parsed gpx cache (default location gpxdir/.gpxcache)
+
+#log start time
+start = datetime.now()
+
+#guard needed because worker processes (gpx parsing, -procs) re-import this
+#script on windows
+if __name__ == '__main__':
+    # ===========================  BEGIN ARGUMENT PARSER ==============================
+    descriptionstr = ('  Script to check the capture frequency of a directory of images.')
+    parser = argparse.ArgumentParser(description=descriptionstr,
+                                     epilog='example: run image-frequency-checker.py '
+                                             '-imgdir=D:/mydir/data/images -freq=2')
+    #input image directory arg
+    parser.add_argument('-imgdir', '--image_directory', dest='imgdir_arg',
+                        required=False,
+                        help='input directory with image files or directories of images')
+    #expected frequency arg
+    parser.add_argument('-freq', '--expected_freq_seconds', dest='freq_arg',
+                        type=float, required=False,
+                        help='report gaps between images longer than this many seconds')
+    parser.add_argument('-burst', '--burst_seconds', dest='burst',
+                        type=float, required=False, default=None,
+                        help='report runs of images closer together than this many seconds [default freq/2]')
+
+    #gpx coverage args
+    parser.add_argument('-gpxdir', '--gpx_directory', dest='gpxdir',
+                        required=False,
+                        help='directory with gpx files to check image times against (optional)')
+    parser.add_argument('-imgoffset', '--cam_to_utc_adjust_sec', dest='imgoffset',
+                        type=float, required=False, default=0,
+                        help='image time to utc adjustment in seconds [default 0]')
+    parser.add_argument('-gpxworkers', '--gpx_workers', dest='gpxworkers',
+                        type=int, required=False, default=None,
+                        help='number of processes for parsing gpx files [default: number of cpus]')
+    parser.add_argument('-nocache', '--no_gpx_cache', dest='nocache',
+                        action='store_true',
+                        help='always parse gpx files, do not read or write the cache')
+    parser.add_argument('-maxprint', '--max_print', dest='maxprint',
+                        type=int, required=False, default=MAX_PRINT,
+                        help=f'max rows of each list printed (all are in the csv) [default {MAX_PRINT}]')
+
+    #parallel exif reading args (-workers, -procs, -noindex)
+    add_scan_args(parser)
+    #instrumentation args (-profile, -cprofile)
+    add_profile_args(parser)
+
+    #parse
+    args = parser.parse_args()
+    prof = profiler_from_args(args)
+    # ===========================  END ARGUMENT PARSER ==============================
+
+    #if arguments supplied via command line, use values to set inputs, otherwise use
+    #inputs set in script above
+    if args.imgdir_arg is not None:
+        imgdirstr = args.imgdir_arg
+
+    if args.freq_arg is not None:
+        expected_freq_seconds = args.freq_arg
+
+    imgdir = Path(imgdirstr)
+    if not imgdir.exists():
+        raise Exception(f'{str(imgdir.absolute())} dir does not exist, stopping execution')
+
+    #image timestamps from the image index (only new/changed images are read)
+    with prof.stage('exif_scan') as stage:
+        imgfiles, backups = walk_images(imgdir, ftypes)
+        dttags = indexed_dt_tags(imgdir, imgfiles, workers=args.workers, processes=args.use_processes, use_index=not args.noindex)
+        stage['items'] = stage['files'] = len(imgfiles)
+
+    #sorted times, gaps, duplicates and bursts
+    with prof.stage('frequency', items=len(imgfiles)):
+        report = FrequencyReport(imgfiles, dttags, expected_freq_seconds, args.burst)
+
+    #cross-check against the gpx track
+    if args.gpxdir is not None:
+        gpxdir = Path(args.gpxdir)
+        if not gpxdir.exists():
+            raise Exception(f'{str(gpxdir.absolute())} dir does not exist, stopping execution')
+        gpxcache = None if args.nocache else TrackCache(gpxdir.joinpath('.gpxcache'), max_bytes=gpx_cache_max_mb * 1024 * 1024)
+        with prof.stage('gpx_load') as stage:
+            gpxdf = load_gpx_dir(gpxdir, workers=args.gpxworkers, cache=gpxcache)
+            stage['items'], stage['files'] = len(gpxdf), gpxdf['source'].nunique()
+        with prof.stage('gpx_coverage', items=len(imgfiles)):
+            report.gpx_coverage(gpxdf['dt'], args.imgoffset, max_time_offset)
+
+    report.print_summary(args.maxprint)
+    with prof.stage('csv_write', items=len(report.images)):
+        report.images.to_csv(imgdir.joinpath(f'{str(imgdir.name)}_{frequencyfn}.csv'), index=False)
+
+    #log total time
+    print(f'\nFrequency check completed in {str(datetime.now() - start)}.')
+
+    #per-stage time, CPU, reads and memory (-profile)
+    finish_profile(prof, args, imgdir.joinpath(f'{str(imgdir.name)}_{frequencyfn}'))
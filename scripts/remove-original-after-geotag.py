@@ -2,20 +2,31 @@
 """
 Created on Thu Dec 20 11:12:41 2018
 
-Removes *.*_original files after 'geotag-with-gpx.py'
+Removes *.*_original files after 'geotag-with-gpx.py -exiftool'
+(the built-in GPS writer does not leave *_original copies)
 
-example: runfile('geotag-with-gpx.py', args='-dir=D:/temp/testrename -f=2 -utc=0 -sepdir')
+Backups are found with one os.scandir walk and deleted over a thread pool
+(see uasutils/cleanup.py).  -dryrun lists what would be deleted and
+-checkgps only deletes backups whose image has a GPS position that the
+backup doesn't have (the geotag was written).
+
+example: runfile('remove-original-after-geotag.py', args='-imgdir=D:/temp/test_geotag -checkgps')
+example (dry run): runfile('remove-original-after-geotag.py', args='-imgdir=D:/temp/test_geotag -dryrun')
 @author: jlogan
 """
 
 import argparse
 from pathlib import Path
-import os
+from uasutils.cleanup import find_backups, remove_backups, BACKUP_PATTERN, MAX_PRINT
+from uasutils.profiling import add_profile_args, profiler_from_args, finish_profile
 
 
 #Inputs (these will be used if not entered in command line)
 imgdirstr = 'D:/temp/test_geotag'
 
+#Hard coded variables (change these if needed)
+workers = 8 #threads deleting files (deletes on NAS mounts are latency bound)
+
 # ===========================  BEGIN ARGUMENT PARSER ==============================
 descriptionstr = ('  Script to remove "*.*_original" files after "geotag-with-gpx.py"')
 parser = argparse.ArgumentParser(description=descriptionstr, 
@@ -25,9 +36,27 @@ parser = argparse.ArgumentParser(description=descriptionstr,
 parser.add_argument('-imgdir', '--image_directory', dest='imgdir_arg',  
                     required=False,
                     help='input directory with image files or directories of images')
+parser.add_argument('-pattern', '--pattern', dest='pattern',
+                    required=False, default=BACKUP_PATTERN,
+                    help=f'file name pattern of the backups to delete [default {BACKUP_PATTERN}]')
+parser.add_argument('-dryrun', '--dry_run', dest='dryrun',
+                    action='store_true',
+                    help='report what would be deleted, delete nothing')
+parser.add_argument('-checkgps', '--check_geotagged', dest='checkgps',
+                    action='store_true',
+                    help='only delete backups whose image has a new GPS position (was geotagged)')
+parser.add_argument('-workers', '--workers', dest='workers',
+                    type=int, required=False, default=workers,
+                    help=f'number of threads deleting files [default {workers}]')
+parser.add_argument('-maxprint', '--max_print', dest='maxprint',
+                    type=int, required=False, default=MAX_PRINT,
+                    help=f'max skipped/failed files listed [default {MAX_PRINT}]')
+#instrumentation args (-profile, -cprofile)
+add_profile_args(parser)
 
 #parse
 args = parser.parse_args()
+prof = profiler_from_args(args)
 # ===========================  END ARGUMENT PARSER ==============================
 
 #if arguments supplied via command line, use values to set inputs, otherwise use
@@ -39,25 +68,17 @@ if args.imgdir_arg is not None:
 imgdir = Path(imgdirstr)
 
 #check that paths exist
-try:
-    if not imgdir.exists():
-        raise Exception(f'{str(imgdir.absolute())} dir does not exist, stopping execution')
-except:
-        raise Exception(f'{str(imgdir.absolute())} dir does not exist, stopping execution')
-
-n = 0
-
-#recursively delete *_original files
-for fn in imgdir.glob('**/*.*_original'):
-    try:
-        print(f'Deleting {fn}')
-        os.remove(fn)
-        n += 1
-    except OSError:  
-        pass
-
-print(f'Deleted {n} files.')
+if not imgdir.exists():
+    raise Exception(f'{str(imgdir.absolute())} dir does not exist, stopping execution')
 
+#recursively find and delete backups
+with prof.stage('backup_walk') as stage:
+    backups = find_backups(imgdir, args.pattern)
+    stage['items'] = len(backups)
+print(f'Found {len(backups)} {args.pattern} files.')
+with prof.stage('cleanup', items=len(backups), files=len(backups)):
+    report = remove_backups(backups, args.workers, dry_run=args.dryrun, check_geotag=args.checkgps)
+report.print_summary(args.maxprint)
 
-    
-    
\ No newline at end of file
+#per-stage time, CPU, reads and memory (-profile)
+finish_profile(prof, args, imgdir.joinpath(f'{str(imgdir.name)}_cleanup'))
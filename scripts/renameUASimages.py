@@ -5,127 +5,157 @@ Script to rename imagery with flight prefix and UTC time/date from EXIF
 
 example: runfile('renameUASimages.py', args='-dir=D:/temp/testrename -f=2 -utc=0 -sepdir')
 example to skip user confirmation: runfile('renameUASimages.py', args='-dir=D:/temp/testrename -f=2 -utc=0 -sepdir -skipconf')
+example to finish an interrupted rename: runfile('renameUASimages.py', args='-dir=D:/temp/testrename -resume')
+
+All new names are planned from one metadata scan and checked for collisions,
+the plan is written to a journal in the directory, then applied in one pass.
+Images that already have a flight prefix are not renamed again.
 @author: jlogan
 """
 import argparse
 import sys
+import time
 from pathlib import Path
-import shutil
-from tqdm import tqdm
-from datetime import datetime, timedelta
-import exifread
+from datetime import datetime
+from uasutils.exif import EXIF_DT_FORMAT
+from uasutils.scan import find_images, scan_dt_tags, add_scan_args
+from uasutils.imgindex import open_index
+from uasutils.rename import plan_renames, with_backup_moves, find_collisions, RenameJournal, user_prompt
+from uasutils.cleanup import BACKUP_SUFFIX
+from uasutils.profiling import add_profile_args, profiler_from_args, finish_profile
 
 #file types to process
 ftypes = ['JPG', 'DNG']
 
-#using exifread which works for DNG and JPG
-def get_dt_original(fn):
-    '''Gets DateTimeOriginal value from EXIF'''
-    with open(fn, 'rb') as i:
-        tags = exifread.process_file(i)
-    dt_orig = str(tags.get('EXIF DateTimeOriginal'))
-    return dt_orig
-
-def new_image_name(img, utcoffset, fltnum):
-    '''Formats new image name.'''
-    #get image time stamp
-    #PIL doesn't work for DNG
-    #imgdt = datetime.strptime(Image.open(img)._getexif()[36867], '%Y:%m:%d %H:%M:%S')  
-    #using exifread instead
-    imgdt = datetime.strptime(get_dt_original(img), '%Y:%m:%d %H:%M:%S')
-    #add UTC offset to get UTC time
-    imgutcdt = imgdt + timedelta(hours=utcoffset)
-    #format output utc dt, using ISO 8601 format
-    #imgutcdtlabel = datetime.strftime(imgutcdt, '%Y%m%d-%H%M%S')
-    imgutcdtlabel = datetime.strftime(imgutcdt, '%Y%m%dT%H%M%SZ')
-    outname = 'F' + f'{fltnum:02}' + '_' + imgutcdtlabel + '_' + str(img.name)
-    return outname
-
-def user_prompt(question:str):
-    """ Prompts a Yes/No questions. 
-    https://stackoverflow.com/questions/3041986/apt-command-line-interface-like-yes-no-input"""
-    import sys
-    from distutils.util import strtobool
-
-    while True:
-        sys.stdout.write(question + " [y/n]: ")
-        user_input = input().lower()
-        try:
-            result = strtobool(user_input)
-            return result
-        except ValueError:
-            sys.stdout.write("Please use y/n or yes/no.\n")
-
-# ===========================  BEGIN PARSER ==============================
-descriptionstr = ('  Script to rename images collected with UAS camera.')
-parser = argparse.ArgumentParser(description=descriptionstr, 
-                                 epilog='example: run renameUASimages.py '
-                                         '-dir=D:/mydir/data/images -f=2 '
-                                         '-utcoffset=-8 '
-                                         '-sepdir')
-#input directory arg
-parser.add_argument('-dir', '--input_directory', dest='indir',  
-                    required=True,
-                    help='input directory with images')
-#flight arg
-parser.add_argument('-f', '--flight_number', dest='fltnum',  
-                    type=int, required=True,
-                    help='flight number')
-#utc offset arg
-parser.add_argument('-utc', '--utc_offset', dest='utcoffset',  
-                    type=int, required=True,
-                    help='image tzone to utc offset in hours [example: PST to UTC = 8]')
-#arg to separate files into raw and jpg dir
-parser.add_argument('-sepdir', '--sep_files_dir', help='separate raw and jpg into separate dir',
-    action='store_true')
-#argument to skip user confirmation to continue
-parser.add_argument('-skipconf', '--skip_confirmation', dest='skipconf',  
-                    nargs='?', const=True, type=bool,
-                    help='skip user confirmation')
-
-#parse
-args = parser.parse_args()
-
-#set var
-fltnum = args.fltnum
-indir = Path(args.indir)
-sepdir = args.sep_files_dir
-utcoffset = args.utcoffset
-skipconf = args.skipconf
-
-#Show sample rename to user
-ftype = ftypes[0]
-fsample = next(indir.glob('*.' + ftype))
-print('Image ' + fsample.name + ' has time stamp: ' + 
-      str(datetime.strptime(get_dt_original(fsample), '%Y:%m:%d %H:%M:%S')) +
-      '\n' + 'Image ' + fsample.name + ' will be renamed to: ' + 
-      new_image_name(fsample, utcoffset, fltnum)+ '\n')
-
-if not skipconf:
-    #Get confirmation to continue
-    if user_prompt('Do you want to rename this and all images in this directory following this pattern?'):
-        #loop through ftypes
-        for ftype in ftypes:
-            #loop through files
-            for fn in tqdm(indir.glob('*.' + ftype)):
-                fn.rename(Path(fn.parent, Path(new_image_name(fn, utcoffset, fltnum))))
+def scan_directory(indir, workers=1, processes=False, imgindex=None):
+    '''
+    Returns images in indir and their EXIF DateTimeOriginal, read in one (parallel) pass.
+    If imgindex (uasutils.imgindex.ImageIndex) is given, timestamps come from it.
+    '''
+    imgfiles = find_images(indir, ftypes, recursive=False)
+    if imgindex is not None:
+        dttags = [(m['dt_original'], m['subsec']) for m in imgindex.update(imgfiles, workers, processes)]
     else:
-        print('Terminating script.')
-        sys.exit()
-else:
-    #loop through ftypes
-        for ftype in ftypes:
-            #loop through files
-            for fn in tqdm(indir.glob('*.' + ftype)):
-                fn.rename(Path(fn.parent, Path(new_image_name(fn, utcoffset, fltnum))))
-                
-            
-#move to separate directories if specified
-if sepdir:
-    for ftype in ftypes:
-        newdir = Path(indir, ftype.lower())
-        newdir.mkdir()
-        for fn in indir.glob('*.' + ftype):
-            shutil.move(fn, Path(newdir, fn.name))
-        
-    
\ No newline at end of file
+        dttags = scan_dt_tags(imgfiles, workers=workers, processes=processes)
+    return imgfiles, [dt_orig for dt_orig, subsec in dttags]
+
+def update_index(imgindex, moves):
+    '''Records moves (old, new) of images in imgindex (backups and files not in the index are left alone)'''
+    if imgindex is not None:
+        imgindex.rename_many([(old, new) for old, new in moves if not old.name.endswith(BACKUP_SUFFIX)])
+
+#guard needed because -procs worker processes re-import this script on windows
+if __name__ == '__main__':
+    # ===========================  BEGIN PARSER ==============================
+    descriptionstr = ('  Script to rename images collected with UAS camera.')
+    parser = argparse.ArgumentParser(description=descriptionstr, 
+                                     epilog='example: run renameUASimages.py '
+                                             '-dir=D:/mydir/data/images -f=2 '
+                                             '-utcoffset=-8 '
+                                             '-sepdir')
+    #input directory arg
+    parser.add_argument('-dir', '--input_directory', dest='indir',  
+                        required=True,
+                        help='input directory with images')
+    #flight arg
+    parser.add_argument('-f', '--flight_number', dest='fltnum',  
+                        type=int, required=False,
+                        help='flight number')
+    #utc offset arg
+    parser.add_argument('-utc', '--utc_offset', dest='utcoffset',  
+                        type=int, required=False,
+                        help='image tzone to utc offset in hours [example: PST to UTC = 8]')
+    #arg to separate files into raw and jpg dir
+    parser.add_argument('-sepdir', '--sep_files_dir', help='separate raw and jpg into separate dir',
+        action='store_true')
+    #argument to skip user confirmation to continue
+    parser.add_argument('-skipconf', '--skip_confirmation', dest='skipconf',  
+                        nargs='?', const=True, type=bool,
+                        help='skip user confirmation')
+    #interrupted rename args
+    parser.add_argument('-resume', '--resume', dest='resume', action='store_true',
+                        help='finish an interrupted rename of this directory (from its journal)')
+    parser.add_argument('-rollback', '--rollback', dest='rollback', action='store_true',
+                        help='restore the original names of an interrupted rename of this directory')
+    #parallel exif reading args (-workers, -procs)
+    add_scan_args(parser)
+    #instrumentation args (-profile, -cprofile)
+    add_profile_args(parser)
+
+    #parse
+    args = parser.parse_args()
+    prof = profiler_from_args(args)
+
+    #set var
+    fltnum = args.fltnum
+    indir = Path(args.indir)
+    sepdir = args.sep_files_dir
+    utcoffset = args.utcoffset
+    skipconf = args.skipconf
+
+    start = time.perf_counter()
+    #image metadata index (None if -noindex)
+    imgindex = open_index(indir, use_index=not args.noindex)
+    journal = RenameJournal(indir)
+
+    if journal.exists():
+        #a previous run was interrupted: resume or roll back its plan, don't plan on a half renamed directory
+        if args.resume:
+            with prof.stage('rename') as stage:
+                journal.read().apply(args.workers)
+                update_index(imgindex, journal.moves)
+                stage['items'] = stage['files'] = len(journal.moves)
+        elif args.rollback:
+            with prof.stage('rollback') as stage:
+                journal.read().rollback(args.workers)
+                update_index(imgindex, [(new, old) for old, new in journal.moves])
+                stage['items'] = stage['files'] = len(journal.moves)
+        else:
+            raise Exception(f'{journal.path} found: a previous rename of this directory was interrupted, '
+                            'rerun with -resume to finish it or -rollback to restore the original names')
+    elif args.resume or args.rollback:
+        print(f'No interrupted rename in {indir}, nothing to do.')
+    else:
+        if fltnum is None or utcoffset is None:
+            parser.error('-f and -utc are required')
+
+        #every target name up front from one metadata scan
+        with prof.stage('exif_scan') as stage:
+            imgfiles, dt_origs = scan_directory(indir, args.workers, args.use_processes, imgindex)
+            stage['items'] = stage['files'] = len(imgfiles)
+        with prof.stage('plan', items=len(imgfiles)):
+            moves, mkdirs = plan_renames(imgfiles, dt_origs, utcoffset, fltnum, sepdir)
+            #exiftool backups are renamed with their images, so they can still be paired and cleaned up
+            moves = with_backup_moves(moves, indir.glob('*' + BACKUP_SUFFIX))
+            collisions = find_collisions(moves)
+        if collisions:
+            raise Exception(f'{len(collisions)} rename collisions, nothing renamed:\n' + '\n'.join(collisions[:20]))
+        print(f'Planned {len(moves)} renames/moves in {time.perf_counter() - start:.2f} s')
+        if not moves:
+            print('All images already renamed.')
+        else:
+            #Show sample rename to user
+            fsample, newsample = moves[0]
+            dt_orig = dt_origs[imgfiles.index(fsample)]
+            print('Image ' + fsample.name + ' has time stamp: ' + 
+                  str(datetime.strptime(dt_orig, EXIF_DT_FORMAT)) +
+                  '\n' + 'Image ' + fsample.name + ' will be renamed to: ' + 
+                  str(newsample.relative_to(indir)) + '\n')
+
+            #Get confirmation to continue
+            if not skipconf and not user_prompt('Do you want to rename this and all images in this directory following this pattern?'):
+                print('Terminating script.')
+                sys.exit()
+
+            #journal first, then all renames and moves in one pass
+            with prof.stage('rename', items=len(moves), files=len(moves)):
+                journal.write(moves, mkdirs)
+                journal.apply(args.workers)
+                update_index(imgindex, moves)
+
+    if imgindex is not None:
+        imgindex.close()
+    print(f'Rename completed in {time.perf_counter() - start:.2f} s.')
+
+    #per-stage time, CPU, reads and memory (-profile)
+    finish_profile(prof, args, indir.joinpath(f'{str(indir.name)}_rename'))
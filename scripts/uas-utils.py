@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Single entry point for the UAS image workflow.
+
+Runs rename, geotag, cleanup of *_original files and the image frequency
+check as stages of one pipeline (see uasutils/pipeline.py): the image
+directory is walked once and each image's metadata is read once, instead of
+once per script.  Stages without the inputs they need are skipped, e.g.
+geotag without -gpxdir, and a timing summary of every stage is printed.
+
+example: runfile('uas-utils.py', args='-imgdir=D:/mydir/data/images -f=2 -utc=7
+                                       -gpxdir=D:/mydir/data/gpx -imgoffset=5 -skipconf')
+example (only frequency check): runfile('uas-utils.py', args='-imgdir=D:/mydir/data/images -stages=frequency')
+"""
+
+import argparse
+from pathlib import Path
+from uasutils.scan import add_scan_args
+from uasutils.pipeline import Context, run_pipeline, print_summary, STAGES, DEFAULT_STAGES
+from uasutils.profiling import add_profile_args, profiler_from_args, finish_profile
+
+#Hard coded variables (change these if needed)
+ftypes = ['JPG', 'DNG']  #file types to process
+geotagfn = 'geotag'  #suffix for naming output geotag csv file (prefix is imgdir)
+trackqcfn = 'trackqc'  #suffix for naming output csv of suspect track intervals (prefix is imgdir)
+frequencyfn = 'frequency'  #suffix for naming output frequency csv file (prefix is imgdir)
+max_gps_err_per_sec_meters = 25 #cutoff to determine if there are overlapping gpx files in gpx batch
+max_time_offset = 10 #max acceptable difference between GPX time and image time
+gpx_cache_max_mb = 500 #size limit of parsed gpx cache (default location gpxdir/.gpxcache)
+exiftool_procs = 4 #number of exiftool processes used for images the built-in writer can't handle
+cleanup_workers = 8 #threads deleting *_original files (deletes on NAS mounts are latency bound)
+
+#guard needed because worker processes (gpx parsing, -procs) re-import this
+#script on windows
+if __name__ == '__main__':
+    # ===========================  BEGIN ARGUMENT PARSER ==============================
+    descriptionstr = ('  Rename, geotag, clean up and check UAS images in one pass over the image directory.')
+    parser = argparse.ArgumentParser(description=descriptionstr,
+                                     epilog='example: run uas-utils.py '
+                                             '-imgdir=D:/mydir/data/images -f=2 -utc=7 '
+                                             '-gpxdir=D:/mydir/data/gpx -imgoffset=5')
+    #input image directory arg
+    parser.add_argument('-imgdir', '--image_directory', dest='imgdir',
+                        required=True,
+                        help='input directory with image files or directories of images')
+    #stages to run
+    parser.add_argument('-stages', '--stages', dest='stages',
+                        required=False, default=','.join(DEFAULT_STAGES),
+                        help=f'comma separated stages to run, in order (available: {", ".join(STAGES)}) '
+                             f'[default {",".join(DEFAULT_STAGES)}]')
+
+    #rename args
+    parser.add_argument('-f', '--flight_number', dest='fltnum',
+                        type=int, required=False,
+                        help='rename: flight number (images to rename must be in one flight directory)')
+    parser.add_argument('-utc', '--utc_offset', dest='utcoffset',
+                        type=int, required=False,
+                        help='rename: image tzone to utc offset in hours [example: PST to UTC = 8]')
+    parser.add_argument('-sepdir', '--sep_files_dir', dest='sepdir',
+                        action='store_true',
+                        help='rename: separate raw and jpg into separate dir')
+    parser.add_argument('-skipconf', '--skip_confirmation', dest='skipconf',
+                        action='store_true',
+                        help='rename: skip user confirmation')
+
+    #geotag args
+    parser.add_argument('-gpxdir', '--gpx_directory', dest='gpxdir',
+                        required=False,
+                        help='geotag: input directory with gpx files (and/or DataFlash .BIN logs)')
+    parser.add_argument('-imgoffset', '--cam_to_utc_adjust_sec', dest='imgoffset',
+                        type=float, required=False, default=0,
+                        help='geotag: image time to utc adjustment in seconds [default 0]')
+    parser.add_argument('-interp', '--interpolate', dest='interp',
+                        action='store_true',
+                        help='geotag: interpolate track at sub-second image time instead of using 1 Hz mean positions')
+    parser.add_argument('-gpxworkers', '--gpx_workers', dest='gpxworkers',
+                        type=int, required=False, default=None,
+                        help='geotag: number of processes for parsing gpx files [default: number of cpus]')
+    parser.add_argument('-gpxcache', '--gpx_cache_directory', dest='gpxcache',
+                        required=False,
+                        help='geotag: directory for cache of parsed gpx files [default: gpxdir/.gpxcache]')
+    parser.add_argument('-nocache', '--no_gpx_cache', dest='nocache',
+                        action='store_true',
+                        help='geotag: always parse gpx files, do not read or write the cache')
+    parser.add_argument('-atomic', '--atomic_write', dest='atomic',
+                        action='store_true',
+                        help='geotag: write GPS tags to a temporary copy of each image that replaces it when complete')
+    parser.add_argument('-exiftool', '--use_exiftool', dest='use_exiftool',
+                        action='store_true',
+                        help='geotag: write GPS tags to all images with exiftool instead of the built-in writer')
+    parser.add_argument('-exiftoolpath', '--exiftool_path', dest='exiftoolpath',
+                        required=False,
+                        help='geotag: path to exiftool [default: EXIFTOOL environment variable or exiftool on PATH]')
+
+    #cleanup args
+    parser.add_argument('-cleanup', '--remove_original', dest='cleanup',
+                        action='store_true',
+                        help='cleanup: delete exiftool *_original files')
+    parser.add_argument('-dryrun', '--dry_run', dest='dryrun',
+                        action='store_true',
+                        help='cleanup: report the *_original files that would be deleted, delete nothing')
+    parser.add_argument('-checkgps', '--check_geotagged', dest='checkgps',
+                        action='store_true',
+                        help='cleanup: only delete *_original files whose image has a new GPS position (was geotagged)')
+
+    #frequency args
+    parser.add_argument('-freq', '--expected_freq_seconds', dest='freq',
+                        type=float, required=False, default=1,
+                        help='frequency: report gaps between images longer than this many seconds [default 1]')
+
+    #parallel exif reading args (-workers, -procs, -noindex)
+    add_scan_args(parser)
+    #instrumentation args (-profile, -cprofile)
+    add_profile_args(parser)
+
+    #hard coded variables are passed to the stages with the args
+    parser.set_defaults(ftypes=ftypes, geotagfn=geotagfn, trackqcfn=trackqcfn, frequencyfn=frequencyfn,
+                        max_gps_err_per_sec_meters=max_gps_err_per_sec_meters,
+                        max_time_offset=max_time_offset, gpx_cache_max_mb=gpx_cache_max_mb,
+                        exiftool_procs=exiftool_procs, cleanup_workers=cleanup_workers)
+
+    #parse
+    args = parser.parse_args()
+    prof = profiler_from_args(args)
+    # ===========================  END ARGUMENT PARSER ==============================
+
+    imgdir = Path(args.imgdir)
+    if not imgdir.exists():
+        raise Exception(f'{str(imgdir.absolute())} dir does not exist, stopping execution')
+
+    stages = [name.strip() for name in args.stages.split(',') if name.strip()]
+    summary = run_pipeline(Context(imgdir, args), stages, profiler=prof)
+    print_summary(summary)
+
+    #per-stage CPU, reads and memory (-profile)
+    finish_profile(prof, args, imgdir.joinpath(f'{str(imgdir.name)}_pipeline'))
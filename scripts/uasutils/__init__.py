@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""
+Shared helpers for the UAS processing scripts in this directory.
+
+The scripts are run directly (python geotag-with-gpx.py ... or runfile() in
+Spyder), so this package is found on sys.path next to them.
+"""
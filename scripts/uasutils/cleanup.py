@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Removal of exiftool *_original backups after geotagging.
+
+exiftool leaves a <image>_original copy of every image it writes.  On NAS
+mounts with tens of thousands of backups, globbing and deleting them one at a
+time is bound by round trip latency.  find_backups() walks the tree once
+with os.scandir, and remove_backups() stats and deletes the files over a
+bounded thread pool.  With check_geotag=True a backup is only deleted if
+its image exists and has a GPS position the backup doesn't have, and with
+dry_run=True nothing is deleted.  The returned CleanupReport has the bytes
+freed, files skipped, failures and throughput.
+
+example:
+    report = remove_backups(find_backups(imgdir), workers=16, check_geotag=True)
+    report.print_summary()
+"""
+
+import fnmatch
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from uasutils.exif import read_image_meta
+
+#exiftool backup names (IMG_0001.JPG_original)
+BACKUP_SUFFIX = '_original'
+BACKUP_PATTERN = '*.*' + BACKUP_SUFFIX
+
+#max failures/skipped files listed by print_summary
+MAX_PRINT = 20
+
+
+def find_backups(imgdir, pattern=BACKUP_PATTERN):
+    '''One os.scandir walk of imgdir returning sorted paths of files whose name matches pattern'''
+    backups = []
+    stack = [str(imgdir)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif fnmatch.fnmatch(entry.name, pattern):
+                    backups.append(Path(entry.path))
+    return sorted(backups)
+
+
+def paired_image(backup, suffix=BACKUP_SUFFIX):
+    '''Image that backup is a copy of (backup name without suffix)'''
+    return backup.with_name(backup.name[:-len(suffix)]) if backup.name.endswith(suffix) else None
+
+
+def _gps(fn):
+    '''(lat, lon, alt) in the EXIF of fn, None if it has no position or can't be read'''
+    try:
+        meta = read_image_meta(fn)
+    except Exception:
+        return None
+    return None if meta['gps_lat'] is None else (meta['gps_lat'], meta['gps_lon'], meta['gps_alt'])
+
+
+def is_geotagged(image, backup):
+    '''
+    True if image has a GPS position that its backup (the file before
+    exiftool wrote it) doesn't have: cameras with GPS already tag images,
+    so a position alone doesn't show the geotag was written.
+    '''
+    gps = _gps(image)
+    return gps is not None and gps != _gps(backup)
+
+
+class CleanupReport:
+    '''Outcome of remove_backups: deleted (or would be with dry_run), skipped and failed files'''
+    def __init__(self, dry_run):
+        self.dry_run = dry_run
+        self.deleted = 0
+        self.bytes = 0
+        self.skipped = []
+        self.failures = []
+        self.elapsed = 0.0
+        self.mode = 'serial'
+
+    def print_summary(self, max_print=MAX_PRINT):
+        verb = 'Would delete' if self.dry_run else 'Deleted'
+        rate = self.deleted / self.elapsed if self.elapsed > 0 else float('inf')
+        print(f'{verb} {self.deleted} files ({self.bytes / 1e6:.1f} MB) in {self.elapsed:.2f} s '
+              f'({rate:.0f} files/sec, {self.bytes / 1e6 / max(self.elapsed, 1e-9):.0f} MB/sec, {self.mode})')
+        for what, items in [('Skipped', self.skipped), ('Could not delete', self.failures)]:
+            if items:
+                print(f'{what} {len(items)} files:')
+                for fn, reason in items[:max_print]:
+                    print(f'    {fn}: {reason}')
+                if len(items) > max_print:
+                    print(f'    ... {len(items) - max_print} more')
+
+
+def _remove(backup, dry_run, check_geotag):
+    '''Removes backup, returns ('deleted', size), ('skipped', reason) or ('failed', reason)'''
+    try:
+        size = os.lstat(backup).st_size
+    except OSError as e:
+        return 'failed', str(e)
+    if check_geotag:
+        image = paired_image(backup)
+        if image is None or not image.exists():
+            return 'skipped', 'no paired image'
+        if not is_geotagged(image, backup):
+            return 'skipped', f'{image.name} has no GPS position written by exiftool'
+    if not dry_run:
+        try:
+            os.remove(backup)
+        except OSError as e:
+            return 'failed', str(e)
+    return 'deleted', size
+
+
+def remove_backups(backups, workers=8, dry_run=False, check_geotag=False):
+    '''
+    Deletes files backups over a pool of workers threads (serial if
+    workers <= 1).  With check_geotag only backups whose paired image has a
+    new GPS position (is_geotagged) are deleted, with dry_run nothing is
+    deleted.  Returns CleanupReport.
+    '''
+    backups = list(backups)
+    report = CleanupReport(dry_run)
+    t0 = time.perf_counter()
+    if workers is None or workers <= 1 or len(backups) < 2:
+        results = [_remove(fn, dry_run, check_geotag) for fn in backups]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(lambda fn: _remove(fn, dry_run, check_geotag), backups))
+        report.mode = f'{workers} threads'
+    report.elapsed = time.perf_counter() - t0
+    for fn, (status, value) in zip(backups, results):
+        if status == 'deleted':
+            report.deleted += 1
+            report.bytes += value
+        elif status == 'skipped':
+            report.skipped.append((fn, value))
+        else:
+            report.failures.append((fn, value))
+    return report
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+Reader for ArduPilot DataFlash (.BIN) logs.
+
+The gpx files in a mission's gpx directory are exported from the .BIN logs
+with Mission Planner, which rounds the fix times to whole seconds and is a
+manual step per flight.  read_bin_track() reads the log directly and returns
+the same columns as parse_gpx_track() (lat, lon, ele, course, roll, pitch,
+mode, dt), with the fix time from the GPS week and milliseconds of the GPS
+messages instead of whole seconds.  ele is the height above home, as in the
+gpx export, not the GPS altitude above sea level.
+
+The log is memory mapped and decoded in bulk: message starts are found with
+NumPy (header bytes followed by the start of the next message), and all
+messages of one type are gathered into an array and viewed with a structured
+dtype built from the type's FMT message, so no message is decoded in a
+Python loop.  Messages are
+
+    0xA3 0x95 <type> <payload described by the FMT message of type>
+
+and FMT messages (type 128) describe every type in the log, including
+themselves.
+
+Boot time stamps (TimeUS, microseconds) of other messages, e.g. ATT and
+CAM, are converted to UTC with a linear fit of the GPS messages' UTC time
+against their TimeUS.
+
+example:
+    gpxdf = read_bin_track('D:/mydir/data/logs/76.BIN')
+    cams = read_bin_camera('D:/mydir/data/logs/76.BIN')
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from uasutils.match import nearest_indices
+
+HEAD = b'\xa3\x95'
+FMT_TYPE = 128
+FMT_LENGTH = 89
+
+#FMT format characters -> (numpy dtype, scale applied when decoding)
+FORMAT_TYPES = {'a': ('<i2', 32), 'b': ('i1', None), 'B': ('u1', None), 'h': ('<i2', None), 'H': ('<u2', None),
+                'i': ('<i4', None), 'I': ('<u4', None), 'f': ('<f4', None), 'd': ('<f8', None),
+                'n': ('S4', None), 'N': ('S16', None), 'Z': ('S64', None),
+                'c': ('<i2', 0.01), 'C': ('<u2', 0.01), 'e': ('<i4', 0.01), 'E': ('<u4', 0.01),
+                'L': ('<i4', 1e-7), 'M': ('u1', None), 'q': ('<i8', None), 'Q': ('<u8', None)}
+
+#FMT message payload
+FMT_DTYPE = np.dtype([('head', 'u1', 2), ('msgtype', 'u1'), ('type', 'u1'), ('length', 'u1'),
+                      ('name', 'S4'), ('format', 'S16'), ('columns', 'S64')])
+
+#GPS time (1980-01-06) to UTC: leap seconds in effect from these UTC dates
+GPS_EPOCH_NS = np.datetime64('1980-01-06', 'ns').astype(np.int64)
+LEAP_SECONDS = [('1999-01-01', 13), ('2006-01-01', 14), ('2009-01-01', 15),
+                ('2012-07-01', 16), ('2015-07-01', 17), ('2017-01-01', 18)]
+
+#column order returned by read_bin_track (same as parse_gpx_track)
+TRACK_COLUMNS = ['lat', 'lon', 'ele', 'course', 'roll', 'pitch', 'mode', 'dt']
+
+
+class DataFlashLog:
+    '''Memory mapped DataFlash log with message offsets found and FMT messages decoded'''
+    def __init__(self, path):
+        self.path = path
+        #empty files can't be mapped
+        self.buf = np.memmap(path, dtype=np.uint8, mode='r') if os.path.getsize(path) else np.zeros(0, dtype=np.uint8)
+        self.formats = self._read_formats()
+        self.starts, self.types = self._find_messages()
+
+    def _read_formats(self):
+        '''Decodes the FMT messages: type -> (name, dtype, scales)'''
+        buf = self.buf
+        if len(buf) < FMT_LENGTH:
+            return {}
+        cand = np.flatnonzero((buf[:-2] == HEAD[0]) & (buf[1:-1] == HEAD[1]) & (buf[2:] == FMT_TYPE))
+        cand = cand[cand + FMT_LENGTH <= len(buf)]
+        fmts = buf[cand[:, None] + np.arange(FMT_LENGTH)].view(FMT_DTYPE).ravel()
+        #payload consistency: the FMT of FMT or a length that at least holds the header
+        fmts = fmts[(fmts['length'] >= 3) & ((fmts['type'] != FMT_TYPE) | (fmts['length'] == FMT_LENGTH))]
+        formats = {}
+        for fmt in fmts:
+            name = fmt['name'].decode('ascii', 'replace').rstrip('\x00')
+            fmtchars = fmt['format'].decode('ascii', 'replace').rstrip('\x00')
+            columns = fmt['columns'].decode('ascii', 'replace').rstrip('\x00').split(',')
+            if any(ch not in FORMAT_TYPES for ch in fmtchars) or len(columns) != len(fmtchars):
+                continue
+            fields = [('head', 'u1', 2), ('msgtype', 'u1')]
+            scales = {}
+            for ch, col in zip(fmtchars, columns):
+                dtype, scale = FORMAT_TYPES[ch]
+                if ch == 'a':
+                    fields.append((col, dtype, scale))
+                else:
+                    fields.append((col, dtype))
+                    if scale is not None:
+                        scales[col] = scale
+            dtype = np.dtype(fields)
+            if dtype.itemsize != fmt['length'] or not name.isalnum():
+                continue
+            #the first definition of a type wins (FMT header bytes in a dropped write can't redefine it)
+            formats.setdefault(int(fmt['type']), (name, dtype, scales))
+        return formats
+
+    def _find_messages(self):
+        '''
+        Returns (starts, types) of the messages in the log: header bytes of a
+        known type that end at the start of another message (or the end of
+        the file), or start at the end of one, without those inside an
+        earlier message's payload.
+        '''
+        buf = self.buf
+        if len(buf) < 3:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint8)
+        lengths = np.zeros(256, dtype=np.int64)
+        for msgtype, (name, dtype, scales) in self.formats.items():
+            lengths[msgtype] = dtype.itemsize
+        cand = np.flatnonzero((buf[:-2] == HEAD[0]) & (buf[1:-1] == HEAD[1]))
+        cand = cand[lengths[buf[cand + 2]] > 0]
+        ends = cand + lengths[buf[cand + 2]]
+        cand, ends = cand[ends <= len(buf)], ends[ends <= len(buf)]
+        #followed by another message, or following one and not running into the next (e.g. before a dropped write)
+        is_start = np.zeros(len(buf) + 1, dtype=bool)
+        is_start[cand] = True
+        is_start[len(buf)] = True
+        nextchained = is_start[ends]
+        is_end = np.zeros(len(buf) + 1, dtype=bool)
+        is_end[ends[nextchained]] = True
+        sure = cand[nextchained]
+        after = np.searchsorted(sure, cand, side='right')
+        clear = np.r_[sure, len(buf)][after] >= ends
+        chained = nextchained | (is_end[cand] & clear)
+        cand, ends = cand[chained], ends[chained]
+        #drop starts inside an accepted message (header bytes in a payload), until stable
+        keep = np.ones(len(cand), dtype=bool)
+        while True:
+            prevend = np.maximum.accumulate(np.where(keep, ends, 0))
+            inside = np.r_[False, cand[1:] < prevend[:-1]]
+            if np.array_equal(keep, ~inside):
+                break
+            keep = ~inside
+        cand = cand[keep]
+        return cand, buf[cand + 2]
+
+    def type_names(self):
+        '''Message names in the log and their counts'''
+        counts = np.bincount(self.types, minlength=256)
+        return {self.formats[t][0]: int(counts[t]) for t in self.formats if counts[t]}
+
+    def messages(self, name):
+        '''
+        All messages called name as a DataFrame of the FMT columns, scaled
+        (e.g. lat/lon in degrees, centi-units in units), text decoded.
+        Returns None if the log has no such messages.
+        '''
+        for msgtype, (fmtname, dtype, scales) in self.formats.items():
+            if fmtname == name:
+                break
+        else:
+            return None
+        starts = self.starts[self.types == msgtype]
+        if len(starts) == 0:
+            return None
+        recs = self.buf[starts[:, None] + np.arange(dtype.itemsize)].view(dtype).ravel()
+        cols = {}
+        for col in dtype.names[2:]:
+            values = recs[col]
+            if values.dtype.kind == 'S':
+                values = np.char.decode(np.char.rstrip(values, b'\x00'), 'ascii', 'replace').astype(object)
+            elif col in scales:
+                values = values * scales[col]
+            elif values.ndim > 1:
+                values = list(values)
+            cols[col] = values
+        return pd.DataFrame(cols)
+
+    def close(self):
+        '''Releases the memory map (decoded messages are copies and stay valid)'''
+        self.buf = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def gps_to_utc_ns(week, ms):
+    '''UTC int64 ns since epoch of GPS week and milliseconds of week (arrays)'''
+    gps_ns = GPS_EPOCH_NS + np.asarray(week, dtype=np.int64) * 604_800_000_000_000 + np.asarray(ms, dtype=np.int64) * 1_000_000
+    leap = np.zeros(len(gps_ns), dtype=np.int64)
+    for date, seconds in LEAP_SECONDS:
+        leap[gps_ns - seconds * 1_000_000_000 >= np.datetime64(date, 'ns').astype(np.int64)] = seconds
+    return gps_ns - leap * 1_000_000_000
+
+
+def _time_us(df):
+    '''Boot time stamp in microseconds (TimeUS, or TimeMS of older logs)'''
+    if 'TimeUS' in df:
+        return df['TimeUS'].to_numpy(dtype=np.int64)
+    return df['TimeMS'].to_numpy(dtype=np.int64) * 1000
+
+
+def _gps_fixes(log):
+    '''
+    Returns (GPS messages with a 3D fix, their UTC ns, their boot time us),
+    (None, None, None) if the log has no GPS messages.  GPS week and ms are
+    GWk/GMS, or Week/TimeMS with boot time T (ms) in older logs.
+    '''
+    gps = log.messages('GPS')
+    if gps is None:
+        return None, None, None
+    if 'I' in gps:
+        #first GPS unit only
+        gps = gps[gps['I'] == 0]
+    if 'GWk' in gps:
+        week, ms = 'GWk', 'GMS'
+    else:
+        week, ms = 'Week', 'TimeMS'
+    gps = gps[(gps['Status'] >= 3) & (gps[week] > 0)].reset_index(drop=True)
+    boot_us = gps['T'].to_numpy(dtype=np.int64) * 1000 if 'T' in gps else _time_us(gps)
+    return gps, gps_to_utc_ns(gps[week], gps[ms]), boot_us
+
+
+def boot_to_utc_ns(boot_us, utc_ns, time_us):
+    '''
+    Converts boot time stamps time_us (microseconds) to UTC int64 ns with a
+    least squares line through the boot time boot_us and UTC time utc_ns of
+    the GPS messages (single message: constant offset).
+    '''
+    time_us = np.asarray(time_us, dtype=np.int64)
+    if len(boot_us) < 2 or boot_us.max() == boot_us.min():
+        return utc_ns[0] + (time_us - boot_us[0]) * 1000
+    #fit relative to the first message (float precision)
+    slope, intercept = np.polyfit((boot_us - boot_us[0]).astype(float), (utc_ns - utc_ns[0]).astype(float), 1)
+    return utc_ns[0] + np.round(slope * (time_us - boot_us[0]) + intercept).astype(np.int64)
+
+
+def _relative_alt(log, gps, us):
+    '''
+    Altitude above home (m) of the GPS fixes, like the ele of a Mission
+    Planner gpx: GPS RelAlt (older logs), else RelHomeAlt of the nearest POS
+    message, else GPS Alt minus the Alt of the last home (ORGN Type 1) set
+    before the fix.  NaN if the log has none of them (GPS Alt alone is
+    above sea level, which would mix datums with gpx tracks).
+    '''
+    if 'RelAlt' in gps:
+        return gps['RelAlt'].to_numpy(dtype=float)
+    pos = log.messages('POS')
+    if pos is not None and len(pos) and 'RelHomeAlt' in pos:
+        return pos['RelHomeAlt'].to_numpy(dtype=float)[nearest_indices(_time_us(pos), us)]
+    orgn = log.messages('ORGN')
+    ele = np.full(len(gps), np.nan)
+    if orgn is not None and len(orgn):
+        home = orgn[orgn['Type'] == 1]
+        if len(home):
+            last = np.searchsorted(_time_us(home), us, side='right') - 1
+            homealt = home['Alt'].to_numpy(dtype=float)[np.maximum(last, 0)]
+            ele = np.where(last >= 0, gps['Alt'].to_numpy(dtype=float) - homealt, np.nan)
+    return ele
+
+
+def read_bin_track(path):
+    '''
+    Reads the GPS track of DataFlash log path as a DataFrame with columns
+    TRACK_COLUMNS like parse_gpx_track(): lat, lon, ele (above home, see
+    _relative_alt()), course, roll and pitch (nearest ATT message),
+    mode (number of the flight mode in effect, as text) and UTC dt with the
+    GPS time of the fix (ms).  Logs without fixes return an empty DataFrame.
+    '''
+    with DataFlashLog(path) as log:
+        gps, utc_ns, us = _gps_fixes(log)
+        if gps is None or len(gps) == 0:
+            df = pd.DataFrame({col: np.zeros(0) for col in TRACK_COLUMNS})
+            df['mode'] = df['mode'].astype(object)
+            df['dt'] = pd.to_datetime(np.zeros(0, dtype=np.int64), unit='ns', utc=True)
+            return df
+        df = pd.DataFrame({'lat': gps['Lat'].to_numpy(dtype=float), 'lon': gps['Lng'].to_numpy(dtype=float),
+                           'ele': _relative_alt(log, gps, us),
+                           'course': gps['GCrs'].to_numpy(dtype=float)})
+
+        att = log.messages('ATT')
+        if att is not None and len(att):
+            nearest = nearest_indices(_time_us(att), us)
+            df['roll'] = att['Roll'].to_numpy(dtype=float)[nearest]
+            df['pitch'] = att['Pitch'].to_numpy(dtype=float)[nearest]
+        else:
+            df['roll'] = np.nan
+            df['pitch'] = np.nan
+
+        mode = log.messages('MODE')
+        df['mode'] = None
+        if mode is not None and len(mode):
+            #last mode change at or before each fix
+            last = np.searchsorted(_time_us(mode), us, side='right') - 1
+            names = mode['Mode'].astype(str).to_numpy(dtype=object)
+            df['mode'] = np.where(last >= 0, names[np.maximum(last, 0)], None)
+
+    df['dt'] = pd.to_datetime(utc_ns, unit='ns', utc=True)
+    return df.sort_values('dt', kind='stable').reset_index(drop=True)
+
+
+def read_bin_camera(path):
+    '''
+    Reads the camera trigger (CAM) messages of DataFlash log path: UTC dt,
+    lat, lon, alt, roll, pitch, yaw.  dt is the GPS time the message
+    carries, or the TimeUS stamp converted with boot_to_utc_ns() if that
+    is missing (messages with neither are left out).  Returns None if the
+    log has no CAM messages.
+    '''
+    with DataFlashLog(path) as log:
+        cam = log.messages('CAM')
+        if cam is None or len(cam) == 0:
+            return None
+        gps, utc_ns, boot_us = _gps_fixes(log)
+    if gps is not None and len(gps):
+        dt_ns = boot_to_utc_ns(boot_us, utc_ns, _time_us(cam))
+        valid = np.ones(len(cam), dtype=bool)
+    else:
+        dt_ns = np.zeros(len(cam), dtype=np.int64)
+        valid = np.zeros(len(cam), dtype=bool)
+    #GPS time of the trigger if the message has one
+    if 'GPSWeek' in cam:
+        has_gps = cam['GPSWeek'].to_numpy() > 0
+        dt_ns[has_gps] = gps_to_utc_ns(cam['GPSWeek'][has_gps], cam['GPSTime'][has_gps])
+        valid |= has_gps
+    df = pd.DataFrame({'dt': pd.to_datetime(dt_ns[valid], unit='ns', utc=True)})
+    #attitude columns are R, P, Y in newer logs
+    for col, srcs in [('lat', ['Lat']), ('lon', ['Lng']), ('alt', ['Alt']),
+                      ('roll', ['R', 'Roll']), ('pitch', ['P', 'Pitch']), ('yaw', ['Y', 'Yaw'])]:
+        src = [src for src in srcs if src in cam]
+        df[col] = cam[src[0]].to_numpy(dtype=float)[valid] if src else np.nan
+    return df
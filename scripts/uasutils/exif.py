@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Fast EXIF timestamp reader shared by all scripts.
+
+exifread.process_file() decodes every tag in the file (including MakerNotes
+and thumbnails) just so we can pull out EXIF DateTimeOriginal.  For 40 MB DNGs
+on a network share that dominates run time.  The reader here only reads the
+first few KB of the file and walks the TIFF IFD chain (IFD0 -> Exif IFD) to
+find DateTimeOriginal and SubSecTimeOriginal.  If anything about the file is
+unexpected it falls back to exifread.
+
+Works for JPG (APP1 Exif segment) and TIFF based raw files (DNG).
+read_image_meta() also returns camera model and any existing GPS position,
+for the image index.
+"""
+
+import struct
+from datetime import datetime
+import exifread
+
+#number of bytes read from the start of each file
+HEADER_BYTES = 8192
+
+#EXIF tags used here
+TAG_EXIF_IFD = 0x8769
+TAG_DT_ORIGINAL = 0x9003
+TAG_SUBSEC_ORIGINAL = 0x9291
+TAG_MODEL = 0x0110
+TAG_GPS_IFD = 0x8825
+
+#keys of the dict returned by read_image_meta()
+IMAGE_META_KEYS = ['dt_original', 'subsec', 'model', 'gps_lat', 'gps_lon', 'gps_alt']
+
+EXIF_DT_FORMAT = '%Y:%m:%d %H:%M:%S'
+
+
+class _FileHeader:
+    '''Bytes from the start of a file, reading past the header only if needed.'''
+    def __init__(self, f, nbytes):
+        self.f = f
+        self.buf = f.read(nbytes)
+
+    def read(self, offset, n):
+        if offset + n <= len(self.buf):
+            return self.buf[offset:offset + n]
+        self.f.seek(offset)
+        data = self.f.read(n)
+        if len(data) != n:
+            raise ValueError('unexpected end of file')
+        return data
+
+
+def _find_tiff_base(hdr):
+    '''Returns offset of TIFF header in file (0 for TIFF/DNG, APP1 payload for JPG)'''
+    sig = hdr.read(0, 4)
+    if sig in (b'II*\x00', b'MM\x00*'):
+        return 0
+    if sig[:2] != b'\xff\xd8':
+        raise ValueError('not a JPG or TIFF file')
+    #walk JPG markers until the Exif APP1 segment
+    pos = 2
+    while True:
+        marker, length = struct.unpack('>2sH', hdr.read(pos, 4))
+        if marker[0] != 0xff or marker[1] in (0xd9, 0xda):
+            raise ValueError('no Exif segment before image data')
+        if marker[1] == 0xe1 and hdr.read(pos + 4, 6) == b'Exif\x00\x00':
+            return pos + 10
+        pos += 2 + length
+
+
+def _read_ifd(hdr, base, offset, endian):
+    '''Returns dict of tag -> (type, count, 4 byte value/offset field)'''
+    count, = struct.unpack(endian + 'H', hdr.read(base + offset, 2))
+    data = hdr.read(base + offset + 2, count * 12)
+    entries = {}
+    for i in range(count):
+        tag, typ, n = struct.unpack(endian + 'HHI', data[i * 12:i * 12 + 8])
+        entries[tag] = (typ, n, data[i * 12 + 8:i * 12 + 12])
+    return entries
+
+
+def _ascii_value(hdr, base, entry, endian):
+    '''Decodes an ASCII IFD entry'''
+    typ, n, field = entry
+    if typ not in (2, 7):
+        raise ValueError('unexpected tag type')
+    if n <= 4:
+        raw = field[:n]
+    else:
+        offset, = struct.unpack(endian + 'I', field)
+        raw = hdr.read(base + offset, n)
+    return raw.split(b'\x00', 1)[0].decode('ascii').strip()
+
+
+def _rational_values(hdr, base, entry, endian):
+    '''Decodes a RATIONAL/SRATIONAL IFD entry to a list of floats'''
+    typ, n, field = entry
+    if typ not in (5, 10):
+        raise ValueError('unexpected tag type')
+    offset, = struct.unpack(endian + 'I', field)
+    vals = struct.unpack(endian + ('I' if typ == 5 else 'i') * (2 * n), hdr.read(base + offset, 8 * n))
+    return [num / den if den else float('nan') for num, den in zip(vals[::2], vals[1::2])]
+
+
+def _open_tiff(hdr):
+    '''Returns (tiff base offset, struct endian prefix, IFD0 entries)'''
+    base = _find_tiff_base(hdr)
+    order = hdr.read(base, 2)
+    if order == b'II':
+        endian = '<'
+    elif order == b'MM':
+        endian = '>'
+    else:
+        raise ValueError('bad TIFF byte order')
+    ifd0_offset, = struct.unpack(endian + 'I', hdr.read(base + 4, 4))
+    return base, endian, _read_ifd(hdr, base, ifd0_offset, endian)
+
+
+def _sub_ifd(hdr, base, endian, ifd, tag):
+    '''Returns entries of the sub IFD that ifd[tag] points to (Exif or GPS IFD)'''
+    offset, = struct.unpack(endian + 'I', ifd[tag][2])
+    return _read_ifd(hdr, base, offset, endian)
+
+
+def _gps_coord(hdr, base, endian, gpsifd, tag, reftag, negref):
+    '''Decodes a GPS degrees/minutes/seconds (or altitude) tag, None if missing'''
+    if tag not in gpsifd:
+        return None
+    vals = _rational_values(hdr, base, gpsifd[tag], endian)
+    value = sum(v / 60 ** i for i, v in enumerate(vals))
+    if reftag in gpsifd:
+        typ, n, field = gpsifd[reftag]
+        ref = field[:1]
+        if ref in negref:
+            value = -value
+    return value
+
+
+def read_dt_tags_header(fn, nbytes=HEADER_BYTES):
+    '''
+    Reads DateTimeOriginal and SubSecTimeOriginal by parsing only the TIFF/EXIF
+    IFD chain at the start of the file.  Returns (dt_original, subsec) strings,
+    subsec is None if not present.  Raises ValueError if the file can't be
+    parsed this way.
+    '''
+    meta = read_image_meta_header(fn, nbytes, full=False)
+    return meta['dt_original'], meta['subsec']
+
+
+def read_image_meta_header(fn, nbytes=HEADER_BYTES, full=True):
+    '''
+    Reads the metadata kept in the image index (uasutils.imgindex) from the
+    header: DateTimeOriginal, SubSecTimeOriginal, camera Model and any
+    existing GPS position (Model and GPS only if full=True).  Returns dict
+    with keys IMAGE_META_KEYS, missing values are None.  Raises ValueError if
+    the file can't be parsed.
+    '''
+    with open(fn, 'rb') as f:
+        hdr = _FileHeader(f, nbytes)
+        try:
+            base, endian, ifd0 = _open_tiff(hdr)
+            if TAG_EXIF_IFD not in ifd0:
+                raise ValueError('no Exif IFD pointer')
+            exififd = _sub_ifd(hdr, base, endian, ifd0, TAG_EXIF_IFD)
+            if TAG_DT_ORIGINAL not in exififd:
+                raise ValueError('no DateTimeOriginal tag')
+            meta = dict.fromkeys(IMAGE_META_KEYS)
+            meta['dt_original'] = _ascii_value(hdr, base, exififd[TAG_DT_ORIGINAL], endian)
+            if TAG_SUBSEC_ORIGINAL in exififd:
+                meta['subsec'] = _ascii_value(hdr, base, exififd[TAG_SUBSEC_ORIGINAL], endian) or None
+            if full and TAG_MODEL in ifd0:
+                meta['model'] = _ascii_value(hdr, base, ifd0[TAG_MODEL], endian) or None
+            if full and TAG_GPS_IFD in ifd0:
+                gpsifd = _sub_ifd(hdr, base, endian, ifd0, TAG_GPS_IFD)
+                meta['gps_lat'] = _gps_coord(hdr, base, endian, gpsifd, 2, 1, (b'S',))
+                meta['gps_lon'] = _gps_coord(hdr, base, endian, gpsifd, 4, 3, (b'W',))
+                meta['gps_alt'] = _gps_coord(hdr, base, endian, gpsifd, 6, 5, (b'\x01',))
+        except (struct.error, UnicodeDecodeError) as e:
+            raise ValueError(f'could not parse EXIF header: {e}')
+    return meta
+
+
+def _exifread_ratio(r):
+    '''float of an exifread Ratio'''
+    return r.num / r.den if r.den else float('nan')
+
+
+def read_image_meta_exifread(fn):
+    '''Same as read_image_meta_header() using exifread (slow path)'''
+    with open(fn, 'rb') as i:
+        tags = exifread.process_file(i, details=False)
+    meta = dict.fromkeys(IMAGE_META_KEYS)
+    meta['dt_original'] = str(tags.get('EXIF DateTimeOriginal'))
+    for key, tag in [('subsec', 'EXIF SubSecTimeOriginal'), ('model', 'Image Model')]:
+        if tag in tags:
+            meta[key] = str(tags[tag]).strip() or None
+    for key, tag, reftag, negref in [('gps_lat', 'GPS GPSLatitude', 'GPS GPSLatitudeRef', ('S',)),
+                                     ('gps_lon', 'GPS GPSLongitude', 'GPS GPSLongitudeRef', ('W',)),
+                                     ('gps_alt', 'GPS GPSAltitude', 'GPS GPSAltitudeRef', ('1',))]:
+        if tag in tags:
+            value = sum(_exifread_ratio(v) / 60 ** i for i, v in enumerate(tags[tag].values))
+            if reftag in tags and str(tags[reftag]).strip() in negref:
+                value = -value
+            meta[key] = value
+    return meta
+
+
+def read_image_meta(fn):
+    '''Returns image metadata dict (IMAGE_META_KEYS), trying the header reader first'''
+    try:
+        return read_image_meta_header(fn)
+    except (ValueError, OSError):
+        return read_image_meta_exifread(fn)
+
+
+def read_dt_tags_exifread(fn):
+    '''Reads DateTimeOriginal and SubSecTimeOriginal using exifread (slow path)'''
+    with open(fn, 'rb') as i:
+        tags = exifread.process_file(i, details=False)
+    subsec = tags.get('EXIF SubSecTimeOriginal')
+    if subsec is not None:
+        subsec = str(subsec).strip() or None
+    return str(tags.get('EXIF DateTimeOriginal')), subsec
+
+
+def read_dt_tags(fn):
+    '''Returns (dt_original, subsec) strings, trying the header reader first'''
+    try:
+        return read_dt_tags_header(fn)
+    except (ValueError, OSError):
+        return read_dt_tags_exifread(fn)
+
+
+def get_dt_original(fn):
+    '''Gets DateTimeOriginal value from EXIF'''
+    return read_dt_tags(fn)[0]
+
+
+def subsec_to_microseconds(subsec):
+    '''Converts EXIF SubSecTime string (fraction of a second digits) to microseconds'''
+    if not subsec:
+        return 0
+    digits = ''.join(c for c in subsec if c.isdigit())
+    if not digits:
+        return 0
+    return int((digits + '000000')[:6])
+
+
+def get_datetime_original(fn, subsec=False):
+    '''Gets DateTimeOriginal as datetime, optionally including SubSecTimeOriginal'''
+    dt_orig, ss = read_dt_tags(fn)
+    imgdt = datetime.strptime(dt_orig, EXIF_DT_FORMAT)
+    if subsec:
+        imgdt = imgdt.replace(microsecond=subsec_to_microseconds(ss))
+    return imgdt
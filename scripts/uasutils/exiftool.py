@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Pool of long running exiftool processes (-stay_open True -@ -).
+
+Used for images the built-in writer (uasutils/exifwrite.py) can't handle.
+Starting exiftool (perl) costs far more than writing a few tags, so
+ExifToolPool starts N processes once and streams one argument batch per
+image to them, reading each image's output and errors separately.
+
+Protocol (what a stub executable for testing has to implement): arguments
+arrive on stdin one per line.  A line '-executeN' runs the batch read so
+far; the process then writes its output to stdout followed by a line
+'{readyN}'.  The batch ends with '-echo4' and a sentinel line, which is
+written to stderr after the batch's messages.  '-stay_open' 'False' makes
+the process exit.
+
+exiftool is found (in order) from the path given, the EXIFTOOL environment
+variable or exiftool on the PATH.  path may also be a list, e.g.
+[sys.executable, 'stub.py'].
+"""
+
+import os
+import queue
+import shutil
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+#environment variable with path to exiftool
+EXIFTOOL_ENV = 'EXIFTOOL'
+
+#sentinel written to stderr after each batch (via -echo4)
+_ERR_SENTINEL = '{ready_err}'
+
+
+def find_exiftool(path=None):
+    '''Returns exiftool command as a list (from path, $EXIFTOOL or PATH), raises FileNotFoundError if not found'''
+    if path is None:
+        path = os.environ.get(EXIFTOOL_ENV) or shutil.which('exiftool')
+        if path is None:
+            raise FileNotFoundError(f'exiftool not found (set {EXIFTOOL_ENV} or use -exiftoolpath)')
+    if isinstance(path, (list, tuple)):
+        return [str(p) for p in path]
+    return [str(path)]
+
+
+class ExifTool:
+    '''One exiftool -stay_open process'''
+    def __init__(self, path=None):
+        self.cmd = find_exiftool(path)
+        self.proc = subprocess.Popen(self.cmd + ['-stay_open', 'True', '-@', '-'],
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                     encoding='utf-8', errors='replace')
+        self.nexec = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _read_until(self, stream, sentinel):
+        '''Reads lines from stream up to sentinel line, returns text before it'''
+        lines = []
+        for line in stream:
+            if line.rstrip('\r\n') == sentinel:
+                return ''.join(lines)
+            lines.append(line)
+        raise RuntimeError(f'exiftool exited unexpectedly (return code {self.proc.poll()})')
+
+    def execute(self, args):
+        '''Runs one batch of exiftool arguments, returns (stdout, stderr) text'''
+        self.nexec += 1
+        ready = f'{{ready{self.nexec}}}'
+        for arg in args:
+            if '\n' in str(arg):
+                raise ValueError(f'exiftool argument contains a newline: {arg!r}')
+        try:
+            self.proc.stdin.write('\n'.join(str(a) for a in args) +
+                                  f'\n-echo4\n{_ERR_SENTINEL}\n-execute{self.nexec}\n')
+            self.proc.stdin.flush()
+        except OSError:
+            raise RuntimeError(f'exiftool exited unexpectedly (return code {self.proc.poll()})')
+        #messages for one image are short, so stderr can't fill its pipe while stdout is read
+        out = self._read_until(self.proc.stdout, ready)
+        err = self._read_until(self.proc.stderr, _ERR_SENTINEL)
+        return out, err
+
+    def close(self, timeout=10):
+        '''Asks the process to exit (kills it after timeout seconds)'''
+        if self.proc.poll() is None:
+            try:
+                self.proc.stdin.write('-stay_open\nFalse\n')
+                self.proc.stdin.flush()
+                self.proc.wait(timeout)
+            except (OSError, subprocess.TimeoutExpired):
+                self.proc.kill()
+                self.proc.wait()
+        for stream in (self.proc.stdin, self.proc.stdout, self.proc.stderr):
+            stream.close()
+
+
+def gps_args(fn, lat, lon, alt=None, heading=None, keep_original=True):
+    '''exiftool arguments to write a GPS position to fn (alt/heading skipped if None or NaN)'''
+    def missing(v):
+        return v is None or v != v
+    args = ['-P']
+    if not keep_original:
+        args.append('-overwrite_original')
+    args += [f'-GPSLatitude={abs(lat)}', f'-GPSLatitudeRef={"S" if lat < 0 else "N"}',
+             f'-GPSLongitude={abs(lon)}', f'-GPSLongitudeRef={"W" if lon < 0 else "E"}']
+    if not missing(alt):
+        args += [f'-GPSAltitude={abs(alt)}', f'-GPSAltitudeRef={"below" if alt < 0 else "above"}']
+    if not missing(heading):
+        args += [f'-GPSTrack={heading % 360}', '-GPSTrackRef=T']
+    return args + [str(fn)]
+
+
+def _batch_error(out, err):
+    '''Error message for one batch from exiftool output, None if a file was written'''
+    errors = [line.strip() for line in err.splitlines() if line.startswith('Error')]
+    if errors:
+        return '; '.join(errors)
+    if 'files updated' not in out and 'image files created' not in out:
+        return (err or out).strip() or 'no files updated'
+    return None
+
+
+class ExifToolPool:
+    '''
+    N ExifTool processes shared by a thread pool.  Each batch is run by
+    whichever process is free.
+    '''
+    def __init__(self, nprocs=4, path=None):
+        self.tools = []
+        try:
+            for i in range(max(1, nprocs)):
+                self.tools.append(ExifTool(path))
+        except OSError:
+            self.close()
+            raise
+        self.free = queue.Queue()
+        for tool in self.tools:
+            self.free.put(tool)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for tool in self.tools:
+            tool.close()
+
+    def execute(self, args):
+        '''Runs one argument batch on a free process, returns (stdout, stderr)'''
+        tool = self.free.get()
+        try:
+            return tool.execute(args)
+        finally:
+            self.free.put(tool)
+
+    def _run_batch(self, args):
+        try:
+            return _batch_error(*self.execute(args))
+        except (RuntimeError, ValueError) as e:
+            return str(e)
+
+    def run_batches(self, batches):
+        '''Runs each argument batch, returns error message (None if written) per batch in order'''
+        with ThreadPoolExecutor(max_workers=len(self.tools)) as pool:
+            return list(pool.map(self._run_batch, batches))
+
+    def write_gps_batch(self, records, keep_original=True, verbose=True):
+        '''
+        Writes GPS tags for each (path, lat, lon, alt, heading) in records.
+        Returns list of error messages (None where successful) in the same
+        order as records (like uasutils.exifwrite.write_gps_batch).
+        '''
+        batches = [gps_args(*r, keep_original=keep_original) for r in records]
+        t0 = time.perf_counter()
+        errors = self.run_batches(batches)
+        elapsed = time.perf_counter() - t0
+        if verbose and batches:
+            nfail = sum(e is not None for e in errors)
+            rate = len(batches) / elapsed if elapsed > 0 else float('inf')
+            print(f'exiftool wrote GPS tags to {len(batches) - nfail} of {len(batches)} images in {elapsed:.2f} s '
+                  f'({rate:.0f} images/sec, {len(self.tools)} processes)')
+        return errors
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-in for exiftool -stay_open, for checking ExifToolPool without perl.
+
+Speaks the protocol described in uasutils/exiftool.py: reads arguments from
+stdin one per line, runs the batch on '-executeN' and answers with exiftool's
+summary lines and '{readyN}', writes '-echo4' text to stderr after the
+batch's messages and exits on '-stay_open' 'False'.  Tags are not written:
+a batch for an existing file reports it updated (and, without
+-overwrite_original, makes the <file>_original copy exiftool would), a
+missing file gets exiftool's error reply.
+
+example:
+    with ExifToolPool(4, [sys.executable, exiftool_stub.__file__]) as exiftool:
+        errors = exiftool.write_gps_batch(records)
+"""
+
+import shutil
+import sys
+from pathlib import Path
+
+
+def run_batch(args):
+    '''Returns (stdout, stderr) text for one batch of arguments'''
+    files = [a for a in args if not a.startswith('-')]
+    if not files:
+        return '', 'No file specified\n'
+    out, err = '', ''
+    updated = 0
+    for fn in files:
+        if not Path(fn).is_file():
+            err += f'Error: File not found - {fn}\n'
+            continue
+        if '-overwrite_original' not in args:
+            shutil.copy2(fn, fn + '_original')
+        updated += 1
+    out += f'    {updated} image files updated\n'
+    if updated < len(files):
+        out += f"    {len(files) - updated} files weren't updated due to errors\n"
+    return out, err
+
+
+def main():
+    batch, echo = [], []
+    lines = iter(sys.stdin.readline, '')
+    for line in lines:
+        arg = line.rstrip('\r\n')
+        if arg == '-stay_open':
+            if next(lines, 'False').strip() == 'False':
+                break
+        elif arg == '-echo4':
+            echo.append(next(lines, '').rstrip('\r\n'))
+        elif arg.startswith('-execute'):
+            out, err = run_batch(batch)
+            sys.stdout.write(out + '{ready' + arg[len('-execute'):] + '}\n')
+            sys.stdout.flush()
+            sys.stderr.write(err + ''.join(text + '\n' for text in echo))
+            sys.stderr.flush()
+            batch, echo = [], []
+        else:
+            batch.append(arg)
+
+
+if __name__ == '__main__':
+    main()
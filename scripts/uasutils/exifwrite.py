@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+Native writer for EXIF GPS tags in JPG and TIFF based raw (DNG) files.
+
+Replaces the exiftool -csv=... -r imgdir call in geotag-with-gpx.py, which
+re-walked the whole tree, rewrote every image (including ones without a
+position) and left *_original copies behind.  write_gps() only touches the
+images it is given:
+
+    - if the image already has a GPS IFD with the same tag layout (e.g. it
+      was geotagged before) the values are overwritten in place
+    - TIFF/DNG: a new GPS IFD is appended to the end of the file and the
+      pointer to it is updated, nothing else in the file moves
+    - JPG: the new GPS IFD is appended to the Exif APP1 segment, so the file
+      is rewritten once
+
+When IFD0 has no GPS pointer entry, a copy of IFD0 with the entry added is
+appended and the TIFF header is pointed at it, so no existing offsets move.
+Tags already in an existing GPS IFD that we don't write are kept.  With
+atomic=True the change is made to a temporary copy that then replaces the
+original.
+
+Tags written: GPSVersionID, GPSLatitude(Ref), GPSLongitude(Ref),
+GPSAltitude(Ref) and GPSTrack(Ref) (heading).  Roll and pitch have no EXIF
+GPS tag and are only kept in the geotag csv.
+"""
+
+import os
+import shutil
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from uasutils.exif import _FileHeader, _open_tiff, HEADER_BYTES, TAG_GPS_IFD
+
+#tiff field types
+BYTE, ASCII, LONG, RATIONAL = 1, 2, 4, 5
+
+#suffix of temporary file used with atomic=True
+TMP_SUFFIX = '.gpstmp'
+
+
+def _dms(value):
+    '''Degrees -> 3 rationals (deg, min, 1/10000 sec) of abs(value)'''
+    total = round(abs(value) * 3600 * 10000)
+    deg, rem = divmod(total, 3600 * 10000)
+    minutes, sec = divmod(rem, 60 * 10000)
+    return [(deg, 1), (minutes, 1), (sec, 10000)]
+
+
+def gps_entries(lat, lon, alt=None, heading=None):
+    '''
+    Returns dict of GPS IFD tag -> (type, count, list of values) for the given
+    position.  alt and heading are skipped if None or NaN.
+    '''
+    def missing(v):
+        return v is None or v != v
+    entries = {0x0000: (BYTE, 4, [2, 3, 0, 0]),
+               0x0001: (ASCII, 2, b'S\x00' if lat < 0 else b'N\x00'),
+               0x0002: (RATIONAL, 3, _dms(lat)),
+               0x0003: (ASCII, 2, b'W\x00' if lon < 0 else b'E\x00'),
+               0x0004: (RATIONAL, 3, _dms(lon))}
+    if not missing(alt):
+        entries[0x0005] = (BYTE, 1, [1 if alt < 0 else 0])
+        entries[0x0006] = (RATIONAL, 1, [(round(abs(alt) * 1000), 1000)])
+    if not missing(heading):
+        entries[0x000e] = (ASCII, 2, b'T\x00')
+        entries[0x000f] = (RATIONAL, 1, [(round((heading % 360) * 100), 100)])
+    return entries
+
+
+def _pack_value(typ, values, endian):
+    '''Packs entry values to bytes'''
+    if typ == ASCII:
+        return values
+    if typ == BYTE:
+        return bytes(values)
+    if typ == RATIONAL:
+        return b''.join(struct.pack(endian + 'II', num, den) for num, den in values)
+    return b''.join(struct.pack(endian + 'I', v) for v in values)
+
+
+def _ifd_layout(hdr, base, offset, endian):
+    '''Returns (list of (tag, type, count, raw 12 byte entry, file position of entry), next ifd offset)'''
+    count, = struct.unpack(endian + 'H', hdr.read(base + offset, 2))
+    data = hdr.read(base + offset + 2, count * 12 + 4)
+    entries = []
+    for i in range(count):
+        raw = data[i * 12:i * 12 + 12]
+        tag, typ, n = struct.unpack(endian + 'HHI', raw[:8])
+        entries.append((tag, typ, n, raw, base + offset + 2 + i * 12))
+    nextifd, = struct.unpack(endian + 'I', data[count * 12:])
+    return entries, nextifd
+
+
+def _ifd_blob(new, raw, offset, endian, nextifd=0):
+    '''
+    Builds an IFD to be placed at offset (relative to tiff base) from new
+    entries (tag -> (type, count, values)) and raw 12 byte entries copied from
+    an existing IFD (tag -> bytes).  Values over 4 bytes follow the IFD.
+    '''
+    tags = sorted(set(new) | set(raw))
+    data_offset = offset + 2 + 12 * len(tags) + 4
+    head = struct.pack(endian + 'H', len(tags))
+    data = b''
+    for tag in tags:
+        if tag not in new:
+            head += raw[tag]
+            continue
+        typ, count, values = new[tag]
+        value = _pack_value(typ, values, endian)
+        if len(value) <= 4:
+            field = value.ljust(4, b'\x00')
+        else:
+            field = struct.pack(endian + 'I', data_offset + len(data))
+            data += value + b'\x00' * (len(value) % 2)
+        head += struct.pack(endian + 'HHI', tag, typ, count) + field
+    return head + struct.pack(endian + 'I', nextifd) + data
+
+
+def _patch_in_place(f, hdr, base, endian, gpsentries, new):
+    '''Overwrites values of an existing GPS IFD if it has all our tags with the same type/count'''
+    layout = {tag: (typ, n, pos) for tag, typ, n, raw, pos in gpsentries}
+    if any(tag not in layout or layout[tag][:2] != (typ, count) for tag, (typ, count, values) in new.items()):
+        return False
+    for tag, (typ, count, values) in new.items():
+        value = _pack_value(typ, values, endian)
+        pos = layout[tag][2] + 8
+        if len(value) > 4:
+            offset, = struct.unpack(endian + 'I', hdr.read(pos, 4))
+            pos = base + offset
+        else:
+            value = value.ljust(4, b'\x00')
+        f.seek(pos)
+        f.write(value)
+    return True
+
+
+def _new_tiff_blocks(ifd0entries, ifd0_nextifd, gpsraw, new, start, endian):
+    '''
+    Returns (bytes to add at tiff offset start, header IFD0 offset or None,
+    (position of IFD0 GPS pointer field, offset value) or None).
+    '''
+    gpsptr = [e for e in ifd0entries if e[0] == TAG_GPS_IFD]
+    if gpsptr:
+        gpsblob = _ifd_blob(new, gpsraw, start, endian)
+        return gpsblob, None, (gpsptr[0][4] + 8, start)
+    #IFD0 has no GPS pointer: append a copy of IFD0 with one added
+    ifd0size = 2 + 12 * (len(ifd0entries) + 1) + 4
+    gps_offset = start + ifd0size
+    raw0 = {tag: raw for tag, typ, n, raw, pos in ifd0entries}
+    ifd0blob = _ifd_blob({TAG_GPS_IFD: (LONG, 1, [gps_offset])}, raw0, start, endian, ifd0_nextifd)
+    return ifd0blob + _ifd_blob(new, gpsraw, gps_offset, endian), start, None
+
+
+def _write_gps_file(f, new):
+    '''Writes GPS entries to open image file f (r+b).  Returns how it was written.'''
+    hdr = _FileHeader(f, HEADER_BYTES)
+    base, endian, ifd0 = _open_tiff(hdr)
+    ifd0_offset, = struct.unpack(endian + 'I', hdr.read(base + 4, 4))
+    ifd0entries, ifd0_nextifd = _ifd_layout(hdr, base, ifd0_offset, endian)
+
+    gpsraw = {}
+    if TAG_GPS_IFD in ifd0:
+        gps_offset, = struct.unpack(endian + 'I', ifd0[TAG_GPS_IFD][2])
+        gpsentries, _ = _ifd_layout(hdr, base, gps_offset, endian)
+        if _patch_in_place(f, hdr, base, endian, gpsentries, new):
+            return 'patched'
+        gpsraw = {tag: raw for tag, typ, n, raw, pos in gpsentries}
+
+    if base == 0:
+        #tiff/dng: append at (word aligned) end of file
+        f.seek(0, 2)
+        end = f.tell()
+        start = end + end % 2
+        blocks, ifd0_new, pointer = _new_tiff_blocks(ifd0entries, ifd0_nextifd, gpsraw, new, start, endian)
+        if start + len(blocks) >= 2 ** 32:
+            raise ValueError('file too large for tiff offsets')
+        f.write(b'\x00' * (start - end) + blocks)
+        if ifd0_new is not None:
+            f.seek(4)
+            f.write(struct.pack(endian + 'I', ifd0_new))
+        else:
+            f.seek(pointer[0])
+            f.write(struct.pack(endian + 'I', pointer[1]))
+        return 'appended'
+
+    #jpg: append to the tiff data in the Exif APP1 segment and rewrite the file
+    f.seek(0)
+    data = f.read()
+    app1 = base - 10
+    app1_end = app1 + 2 + struct.unpack('>H', data[app1 + 2:app1 + 4])[0]
+    tiff = bytearray(data[base:app1_end])
+    start = len(tiff) + len(tiff) % 2
+    blocks, ifd0_new, pointer = _new_tiff_blocks(ifd0entries, ifd0_nextifd, gpsraw, new, start, endian)
+    tiff += b'\x00' * (start - len(tiff)) + blocks
+    if ifd0_new is not None:
+        tiff[4:8] = struct.pack(endian + 'I', ifd0_new)
+    else:
+        tiff[pointer[0] - base:pointer[0] - base + 4] = struct.pack(endian + 'I', pointer[1])
+    seglen = 2 + 6 + len(tiff)
+    if seglen > 0xffff:
+        raise ValueError('Exif segment would exceed 64 KB')
+    f.seek(0)
+    f.write(data[:app1] + b'\xff\xe1' + struct.pack('>H', seglen) + b'Exif\x00\x00' + tiff + data[app1_end:])
+    f.truncate()
+    return 'rewritten'
+
+
+def write_gps(fn, lat, lon, alt=None, heading=None, atomic=False, keep_mtime=True):
+    '''
+    Writes GPS position to the EXIF of JPG/DNG file fn.  With atomic=True the
+    change is made to a copy which replaces fn when complete.  keep_mtime
+    restores the file modification time (like exiftool -P).  Raises
+    ValueError for files that can't be written natively.
+    '''
+    fn = Path(fn)
+    st = fn.stat()
+    new = gps_entries(lat, lon, alt, heading)
+    target = fn.with_name(fn.name + TMP_SUFFIX) if atomic else fn
+    try:
+        if atomic:
+            shutil.copyfile(fn, target)
+        with open(target, 'r+b') as f:
+            how = _write_gps_file(f, new)
+            if atomic:
+                f.flush()
+                os.fsync(f.fileno())
+        if keep_mtime:
+            os.utime(target, ns=(st.st_atime_ns, st.st_mtime_ns))
+        if atomic:
+            os.replace(target, fn)
+    except (struct.error, OSError) as e:
+        if atomic and target.exists():
+            target.unlink()
+        raise ValueError(f'could not write GPS tags: {e}')
+    except ValueError:
+        if atomic and target.exists():
+            target.unlink()
+        raise
+    return how
+
+
+def _write_gps_record(record):
+    '''write_gps() for a (path, lat, lon, alt, heading, atomic) tuple, returns error message or None'''
+    fn, lat, lon, alt, heading, atomic = record
+    try:
+        write_gps(fn, lat, lon, alt, heading, atomic=atomic)
+        return None
+    except (ValueError, OSError) as e:
+        return str(e)
+
+
+def write_gps_batch(records, workers=4, atomic=False, verbose=True):
+    '''
+    Writes GPS tags for each (path, lat, lon, alt, heading) in records using a
+    thread pool.  Returns list of error messages (None where successful) in
+    the same order as records.
+    '''
+    records = [tuple(r) + (atomic,) for r in records]
+    t0 = time.perf_counter()
+    if workers is None or workers <= 1:
+        errors = [_write_gps_record(r) for r in records]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            errors = list(pool.map(_write_gps_record, records))
+    elapsed = time.perf_counter() - t0
+    if verbose and records:
+        nfail = sum(e is not None for e in errors)
+        rate = len(records) / elapsed if elapsed > 0 else float('inf')
+        print(f'Wrote GPS tags to {len(records) - nfail} of {len(records)} images in {elapsed:.2f} s '
+              f'({rate:.0f} images/sec)')
+    return errors
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Time interval index over the flights (gpx files / logs) of a merged track.
+
+A campaign's gpx directory holds dozens of flights of several aircraft and
+load_gpx_dir() merges them into one track.  FlightIndex keeps each flight's
+[start, end] in arrays sorted by start (with the running maximum of the ends,
+so an overlap query is two binary searches) and the rows of each flight, so
+a directory of images can be matched against only the flights that overlap
+it in time instead of the whole campaign.  The track sorted by flight and
+its 1 Hz means per flight are built once, so a single flight's fixes
+(flight_track) and 1 Hz means (flight_1hz) are slices, not copies.
+
+example:
+    flights = FlightIndex(gpxdf)
+    ids = flights.overlapping(first_image_ns, last_image_ns, margin_ns)
+    trackdf = flights.track(ids)
+    secdf = flights.flight_1hz(ids[0])
+"""
+
+import numpy as np
+import pandas as pd
+from uasutils.match import to_ns
+
+
+class FlightIndex:
+    '''Start/end of every flight ('source') of track gpxdf and the rows of each'''
+    def __init__(self, gpxdf):
+        self.gpxdf = gpxdf
+        ns = to_ns(gpxdf['dt'])
+        if 'source' in gpxdf:
+            cat = pd.Categorical(gpxdf['source'])
+            codes, names = cat.codes.astype(np.int64), np.asarray(cat.categories, dtype=object)
+        else:
+            codes, names = np.zeros(len(gpxdf), dtype=np.int64), np.array([''], dtype=object)
+        #rows of each flight (contiguous after a stable sort by flight, still in time order)
+        self._rows = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[self._rows], np.arange(len(names) + 1))
+        nfix = np.diff(bounds)
+        has = np.flatnonzero(nfix > 0)
+        #gpxdf is sorted by time, so a flight starts at its first row and ends at its last
+        rowns = ns[self._rows]
+        starts = rowns[bounds[has]]
+        ends = rowns[bounds[has] + nfix[has] - 1]
+
+        #flights with fixes, sorted by start
+        order = np.argsort(starts, kind='stable')
+        self.names = names[has][order]
+        self.starts = starts[order]
+        self.ends = ends[order]
+        self.nfix = nfix[has][order]
+        self._bounds = bounds[has][order]
+        #running max of the ends (flights sorted by start), monotonic so it can be searched
+        self._maxend = np.maximum.accumulate(self.ends) if len(self.ends) else self.ends
+        self._codes = codes[self._rows]
+        self._byflight = None
+        self._sec = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def overlapping(self, start_ns, end_ns, margin_ns=0):
+        '''Indices (start order) of flights overlapping [start_ns - margin_ns, end_ns + margin_ns]'''
+        lo = np.searchsorted(self._maxend, start_ns - margin_ns, side='left')
+        hi = np.searchsorted(self.starts, end_ns + margin_ns, side='right')
+        ids = np.arange(lo, max(lo, hi))
+        return ids[self.ends[ids] >= start_ns - margin_ns]
+
+    def nearest(self, start_ns, end_ns):
+        '''Index of the flight closest in time to [start_ns, end_ns] (for images outside every flight)'''
+        gap = np.maximum(self.starts - end_ns, 0) + np.maximum(start_ns - self.ends, 0)
+        return int(np.argmin(gap))
+
+    def track(self, ids):
+        '''Rows of gpxdf of flights ids, sorted by time (gpxdf order)'''
+        rows = np.concatenate([self._rows[self._bounds[i]:self._bounds[i] + self.nfix[i]] for i in ids])
+        return self.gpxdf.iloc[np.sort(rows)].reset_index(drop=True)
+
+    def flight_track(self, i):
+        '''Rows of gpxdf of flight i (a slice of the track sorted by flight, in time order)'''
+        if self._byflight is None:
+            self._byflight = self.gpxdf.iloc[self._rows]
+        return self._byflight.iloc[self._bounds[i]:self._bounds[i] + self.nfix[i]]
+
+    def flight_1hz(self, i):
+        '''
+        Mean of the numeric columns of flight i per whole 'dt' (like
+        track.groupby('dt').mean()), a slice of table_1hz().
+        '''
+        first, last = self.rows_1hz(i)
+        return self._sec.iloc[first:last]
+
+    def table_1hz(self):
+        '''1 Hz means of all flights, sorted by flight then time (rows_1hz gives each flight's rows)'''
+        if self._sec is None:
+            self._build_1hz()
+        return self._sec
+
+    def rows_1hz(self, i):
+        '''(first, end) rows of flight i in table_1hz()'''
+        if self._sec is None:
+            self._build_1hz()
+        return self._secranges[i]
+
+    def _build_1hz(self):
+        '''1 Hz means of every flight in one groupby (rows sorted by flight are runs of equal flight and dt)'''
+        if self._byflight is None:
+            self._byflight = self.gpxdf.iloc[self._rows]
+        df = self._byflight
+        ns = to_ns(df['dt'])
+        new = np.r_[True, (np.diff(self._codes) != 0) | (np.diff(ns) != 0)] if len(ns) else np.zeros(0, dtype=bool)
+        starts = np.flatnonzero(new)
+        #groups in order of appearance, i.e. by flight then time
+        run = pd.Series(np.cumsum(new) - 1, index=df.index)
+        secdf = df.drop(columns='dt').groupby(run, sort=False).mean(numeric_only=True).reset_index(drop=True)
+        secdf.insert(0, 'dt', df['dt'].iloc[starts].reset_index(drop=True))
+        self._sec = secdf
+        #rows of each flight (start order) in the 1 Hz table
+        self._secranges = np.c_[np.searchsorted(starts, self._bounds), np.searchsorted(starts, self._bounds + self.nfix)]
+
+    def summary(self):
+        '''DataFrame of the flights: name, start, end, fixes'''
+        return pd.DataFrame({'Flight': self.names,
+                             'Start': pd.to_datetime(self.starts, unit='ns', utc=True),
+                             'End': pd.to_datetime(self.ends, unit='ns', utc=True),
+                             'Fixes': self.nfix})
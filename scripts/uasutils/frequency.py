@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Image capture frequency check (from notebooks/image_frequency_checker).
+
+The notebook read the full EXIF of every file, appended one row per image
+and called diff() on the unsorted rows, so gaps were wrong whenever files
+were not in time order.  FrequencyReport takes the timestamps from the fast
+metadata path (image index / header reader), sorts them once, groups the
+files of one capture (same name and timestamp, e.g. IMG_0001.JPG and
+IMG_0001.DNG, also once renameUASimages.py -sepdir has moved them into jpg/
+and dng/) and finds, with NumPy on the sorted capture times:
+
+    - gaps: captures taken more than expected_freq_seconds after the previous one
+    - duplicates: different captures with the same timestamp
+    - bursts: runs of captures closer together than burst_seconds
+
+gpx_coverage() cross-checks the image times against a track, so images
+without a fix nearby and gaps in the track during the flight show up too.
+
+example:
+    report = FrequencyReport(imgfiles, indexed_dt_tags(imgdir, imgfiles), expected_freq_seconds=2)
+    report.gpx_coverage(gpxdf['dt'], cam_to_utc_adjust_sec=5)
+    report.print_summary()
+"""
+
+import numpy as np
+import pandas as pd
+from uasutils.exif import subsec_to_microseconds, EXIF_DT_FORMAT
+from uasutils.match import to_ns, nearest_indices
+
+#max rows of each list printed by print_summary (all are in the csv)
+MAX_PRINT = 20
+
+
+def image_times_ns(dttags):
+    '''
+    Returns (int64 ns since epoch of camera time, valid mask) for EXIF
+    (DateTimeOriginal, SubSecTimeOriginal) tuples.  Invalid/missing
+    timestamps are 0 in the times array and False in the mask.
+    '''
+    dts = pd.to_datetime(pd.Series([d for d, s in dttags], dtype=object), format=EXIF_DT_FORMAT, errors='coerce')
+    valid = dts.notna().to_numpy()
+    ns = np.where(valid, dts.to_numpy(dtype='datetime64[ns]').view(np.int64), 0)
+    us = np.fromiter((subsec_to_microseconds(s) for d, s in dttags), dtype=np.int64, count=len(dttags))
+    return ns + us * 1000, valid
+
+
+def capture_key(path):
+    '''
+    Name of the capture of image path: path without extension, and without
+    the jpg/dng level added by renameUASimages.py -sepdir, so .../IMG_0001.JPG
+    and .../dng/IMG_0001.DNG get the same key
+    '''
+    path = path.replace('\\', '/')
+    folder, _, name = path.rpartition('/')
+    stem, dot, ext = name.rpartition('.')
+    if not dot:
+        stem, ext = name, ''
+    head, _, parent = folder.rpartition('/')
+    if ext and parent.lower() == ext.lower():
+        folder = head
+    return folder + '/' + stem
+
+
+def _runs(mask):
+    '''Returns (starts, ends) index arrays of runs of True in bool array mask (ends inclusive)'''
+    edges = np.diff(np.r_[0, mask.astype(np.int8), 0])
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1) - 1
+
+
+class FrequencyReport:
+    '''Gaps, duplicates and bursts of image capture times (files of one capture counted once)'''
+    def __init__(self, imgfiles, dttags, expected_freq_seconds=1, burst_seconds=None):
+        self.expected_freq_seconds = expected_freq_seconds
+        self.burst_seconds = expected_freq_seconds / 2 if burst_seconds is None else burst_seconds
+        imgfiles = np.array([str(fn) for fn in imgfiles], dtype=object)
+        ns, valid = image_times_ns(dttags)
+        self.no_timestamp = list(imgfiles[~valid])
+
+        #sort by time, then capture_key() so the files of a capture are adjacent
+        paths = imgfiles[valid]
+        stems = pd.factorize(np.array([capture_key(p) for p in paths], dtype=object), sort=True)[0]
+        order = np.lexsort((stems, ns[valid]))
+        self.ns = ns[valid][order]
+        paths, stems = paths[order], stems[order]
+        #first file of each capture and capture number of every file
+        first = np.r_[True, (np.diff(self.ns) != 0) | (np.diff(stems) != 0)] if len(paths) else np.zeros(0, dtype=bool)
+        capture = np.cumsum(first) - 1
+        self.ncaptures = int(first.sum())
+        firstrow = np.flatnonzero(first)
+        diff_s = np.diff(self.ns[first]) / 1e9
+
+        names = np.array([p.replace('\\', '/').rsplit('/', 1)[-1] for p in paths], dtype=object)
+        self.images = pd.DataFrame({'ImagePath': paths,
+                                    'ImageName': names,
+                                    'ImageDateTime': pd.to_datetime(self.ns, unit='ns'),
+                                    'TimeDiff': np.r_[np.nan, diff_s][capture]})
+        #flags of each capture, set on all its files
+        gap = np.r_[False, diff_s > expected_freq_seconds]
+        dup = np.r_[False, diff_s == 0] | np.r_[diff_s == 0, False]
+        close = (diff_s > 0) & (diff_s < self.burst_seconds)
+        burst = np.r_[False, close] | np.r_[close, False]
+        self.images['Gap'] = gap[capture]
+        self.images['Duplicate'] = dup[capture]
+        self.images['Burst'] = burst[capture]
+
+        #captures are listed by their first file
+        capnames = names[first]
+        captimes = self.images['ImageDateTime'].to_numpy()[first]
+        gaps = np.flatnonzero(gap)
+        self.gaps = pd.DataFrame({'PreviousImage': capnames[gaps - 1], 'ImageName': capnames[gaps],
+                                  'ImageDateTime': captimes[gaps], 'TimeDiff': diff_s[gaps - 1]})
+
+        #groups of different captures with identical timestamps (runs of zero differences)
+        starts, ends = _runs(diff_s == 0)
+        self.duplicates = pd.DataFrame({'ImageDateTime': captimes[starts],
+                                        'Captures': ends - starts + 2,
+                                        'FirstImage': capnames[starts],
+                                        'LastImage': capnames[ends + 1]})
+        #runs of captures closer than burst_seconds
+        starts, ends = _runs(close)
+        self.bursts = pd.DataFrame({'Start': captimes[starts],
+                                    'Seconds': (self.ns[firstrow[ends + 1]] - self.ns[firstrow[starts]]) / 1e9,
+                                    'Captures': ends - starts + 2,
+                                    'FirstImage': capnames[starts],
+                                    'LastImage': capnames[ends + 1]})
+        self.uncovered = None
+        self.track_gaps = None
+
+    def gpx_coverage(self, track_dt, cam_to_utc_adjust_sec=0, max_time_offset=10, max_track_gap=None):
+        '''
+        Cross-checks image times (+ cam_to_utc_adjust_sec) against track times
+        track_dt (UTC).  Sets NoGPS in images for images with no fix within
+        max_time_offset seconds, and track_gaps to the gaps between fixes
+        longer than max_track_gap (default max_time_offset) while images were
+        taken, with the number of images in each.
+        '''
+        max_track_gap = max_time_offset if max_track_gap is None else max_track_gap
+        track = np.unique(to_ns(track_dt))
+        adj = self.ns + int(round(cam_to_utc_adjust_sec * 1e9))
+        if len(track) == 0 or len(adj) == 0:
+            self.images['NoGPS'] = len(track) == 0
+            self.uncovered = self.images.loc[self.images['NoGPS'], ['ImageName', 'ImageDateTime']].reset_index(drop=True)
+            self.track_gaps = pd.DataFrame(columns=['Start', 'End', 'Seconds', 'Images'])
+            return
+        nearest = np.abs(adj - track[nearest_indices(track, adj)])
+        self.images['NoGPS'] = nearest > max_time_offset * 1e9
+        self.uncovered = self.images.loc[self.images['NoGPS'], ['ImageName', 'ImageDateTime']].reset_index(drop=True)
+
+        #gaps between fixes that contain images
+        long = np.flatnonzero(np.diff(track) > max_track_gap * 1e9)
+        start, end = track[long], track[long + 1]
+        nimg = np.searchsorted(adj, end, side='left') - np.searchsorted(adj, start, side='right')
+        #images taken before the first / after the last fix (not counting those within max_time_offset)
+        tol = int(max_time_offset * 1e9)
+        nbefore = np.searchsorted(adj, track[0] - tol, side='left')
+        nafter = len(adj) - np.searchsorted(adj, track[-1] + tol, side='right')
+        start = np.r_[adj[0], start, track[-1]]
+        end = np.r_[track[0], end, adj[-1]]
+        nimg = np.r_[nbefore, nimg, nafter]
+        keep = nimg > 0
+        self.track_gaps = pd.DataFrame({'Start': pd.to_datetime(start[keep], unit='ns', utc=True),
+                                        'End': pd.to_datetime(end[keep], unit='ns', utc=True),
+                                        'Seconds': (end[keep] - start[keep]) / 1e9,
+                                        'Images': nimg[keep]})
+
+    def print_summary(self, max_print=MAX_PRINT):
+        '''Prints the report (like the notebook), lists are cut to max_print rows'''
+        def show(df):
+            if len(df):
+                print(df.head(max_print).to_string(index=False))
+            if len(df) > max_print:
+                print(f'... {len(df) - max_print} more')
+
+        if len(self.ns) == 0:
+            print(f'No images with timestamps ({len(self.no_timestamp)} without).')
+            return
+        print(f'First image time:              {self.images["ImageDateTime"].iloc[0]}')
+        print(f'Last image time:               {self.images["ImageDateTime"].iloc[-1]}')
+        print(f'Elapsed time in seconds:       {(self.ns[-1] - self.ns[0]) / 1e9:g}')
+        print(f'Number of images in directory: {len(self.ns)} ({self.ncaptures} captures)')
+        if self.no_timestamp:
+            print(f'Images without timestamp:      {len(self.no_timestamp)}')
+        print(f'\nCaptures preceeded by gaps greater than {self.expected_freq_seconds} s: {len(self.gaps)}')
+        show(self.gaps)
+        print(f'\nDuplicate timestamps: {len(self.duplicates)} ({int(self.duplicates["Captures"].sum())} captures)')
+        show(self.duplicates)
+        print(f'\nBursts (captures less than {self.burst_seconds:g} s apart): {len(self.bursts)}')
+        show(self.bursts)
+        if self.uncovered is not None:
+            print(f'\nImages without a GPS fix nearby: {len(self.uncovered)}')
+            show(self.uncovered)
+            print(f'\nGaps in the GPS track while images were taken: {len(self.track_gaps)}')
+            show(self.track_gaps)
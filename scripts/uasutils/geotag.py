@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Geotagging steps shared by geotag-with-gpx.py and the uas-utils pipeline:
+track QC, matching/interpolating image times to the track (per image
+directory, against the flights overlapping it) and writing GPS tags
+(built-in writer with exiftool fallback).
+"""
+
+import os
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from uasutils.match import match_images_to_track, interpolate_images_to_track, to_ns, nearest_indices, GPS_COLUMNS
+from uasutils.flights import FlightIndex
+from uasutils.trackqc import track_qc, SPREAD
+from uasutils.exif import subsec_to_microseconds, EXIF_DT_FORMAT
+from uasutils.exifwrite import write_gps_batch
+from uasutils.exiftool import ExifToolPool, find_exiftool
+
+
+def screen_track(gpxdf, max_gps_err_per_sec_meters, qcfile=None, verbose=True):
+    '''
+    Runs track_qc() on gpxdf and prints the suspect intervals (optionally
+    written to csv qcfile).  Instead of stopping, fixes in seconds whose
+    spread exceeds max_gps_err_per_sec_meters (e.g. overlapping gpx files
+    from two GPS units) are dropped.  Returns (cleaned gpxdf, int64 array of
+    the dropped UTC seconds since epoch).
+    '''
+    secdf, intervals, fixflags = track_qc(gpxdf, max_spread_m=max_gps_err_per_sec_meters)
+    if verbose:
+        print(f'Track QC: {len(intervals)} suspect intervals in {len(secdf)} seconds of track.')
+        for row in intervals.itertuples():
+            print(f'    {row.start} - {row.end} ({row.seconds} s, {row.nfix} fixes): {row.reasons} [{row.sources}]')
+    if qcfile is not None and len(intervals):
+        intervals.to_csv(qcfile, index=False)
+    bad = (secdf['flags'].to_numpy() & SPREAD) > 0
+    dropped = to_ns(secdf['dt'][bad]) // 1_000_000_000
+    if verbose and len(dropped):
+        print(f'Coordinates varied by more than {max_gps_err_per_sec_meters} meters within {len(dropped)} seconds, '
+              f'fixes in those seconds are not used and images taken then are not geotagged.')
+    return gpxdf[(fixflags & SPREAD) == 0].reset_index(drop=True), dropped
+
+
+def geotag_images(gpxdf, imgfiles, dttags, cam_to_utc_adjust_sec, max_time_offset, interp=False, dropped=None):
+    '''
+    Returns (geotagdf, nomatch) for images imgfiles with EXIF
+    (DateTimeOriginal, SubSecTimeOriginal) dttags.  Images are matched to the
+    1 Hz mean of gpxdf, or with interp=True the full rate track is
+    interpolated at the sub-second image time.  Images whose adjusted time
+    falls in one of the UTC seconds (since epoch) in dropped get no position.
+
+    The images of each directory are only matched against the flights
+    (gpxdf 'source') overlapping their time span (FlightIndex), and the
+    flight of the nearest fix is added in column Flight.
+    '''
+    imgfiles = list(imgfiles)
+    imgdts = pd.to_datetime(pd.Series([dt_orig for dt_orig, subsec in dttags], dtype=object),
+                            format=EXIF_DT_FORMAT).to_numpy(dtype='datetime64[ns]')
+    if np.isnat(imgdts).any():
+        raise ValueError(f'No DateTimeOriginal in {imgfiles[int(np.argmax(np.isnat(imgdts)))]}')
+    if interp:
+        #interpolation uses the full rate track, which is already sorted by time
+        imgdts = imgdts + np.array([subsec_to_microseconds(subsec) for dt_orig, subsec in dttags], dtype='timedelta64[us]')
+    adj_ns = imgdts.astype(np.int64) + int(round(cam_to_utc_adjust_sec * 1e9))
+    flights = FlightIndex(gpxdf)
+    #fixes further than this from the adjusted image times can't pass the max_time_offset check
+    margin_ns = int((max_time_offset + abs(cam_to_utc_adjust_sec)) * 1e9)
+
+    #flights overlapping each directory, directories with the same flights are matched together
+    dirs, dirnames = pd.factorize(pd.Series([os.path.dirname(fn) for fn in imgfiles], dtype=object))
+    groups = {}
+    for d in range(len(dirnames)):
+        idx = np.flatnonzero(dirs == d)
+        ids = flights.overlapping(adj_ns[idx].min(), adj_ns[idx].max(), margin_ns)
+        if len(ids) == 0:
+            #no flight near these images, the closest one gives the time differences
+            ids = [flights.nearest(adj_ns[idx].min(), adj_ns[idx].max())]
+        groups.setdefault(tuple(ids), []).append(idx)
+
+    frames, nomatches, order = [], [], []
+    #1 Hz matching of directories within one flight (the usual case): nearest row of the 1 Hz
+    #table of all flights (built once) searched within the flight, then one match for all of them
+    single = [] if interp else [(ids, idxs) for ids, idxs in groups.items() if len(ids) == 1]
+    if single:
+        secdf = flights.table_1hz()
+        secns = to_ns(secdf['dt'])
+        idx = np.concatenate([np.concatenate(idxs) for ids, idxs in single])
+        rows, names = [], []
+        for ids, idxs in single:
+            first, end = flights.rows_1hz(ids[0])
+            nimg = sum(len(i) for i in idxs)
+            rows.append(first + nearest_indices(secns[first:end], adj_ns[np.concatenate(idxs)]))
+            names.append(np.full(nimg, flights.names[ids[0]], dtype=object))
+        geotagdf, nomatch = match_images_to_track(secdf, [imgfiles[i] for i in idx], imgdts[idx],
+                                                  cam_to_utc_adjust_sec, max_time_offset, idx=np.concatenate(rows))
+        geotagdf['Flight'] = np.where(nomatch, None, np.concatenate(names)) if 'source' in gpxdf else None
+        frames.append(geotagdf)
+        nomatches.append(nomatch)
+        order.append(idx)
+        groups = {ids: idxs for ids, idxs in groups.items() if len(ids) > 1}
+
+    for ids, idxs in groups.items():
+        idx = np.concatenate(idxs)
+        files, dts = [imgfiles[i] for i in idx], imgdts[idx]
+        if len(ids) == 1:
+            #one flight: a slice of the track sorted by flight (built once)
+            trackdf = flights.flight_track(ids[0])
+        else:
+            #flights overlapping in time (several aircraft): fixes of the same second are averaged across them
+            trackdf = flights.track(ids)
+            if not interp:
+                trackdf = trackdf.groupby('dt', as_index=False).mean(numeric_only=True)
+        if interp:
+            geotagdf, nomatch = interpolate_images_to_track(trackdf, files, dts, cam_to_utc_adjust_sec, max_time_offset)
+        else:
+            geotagdf, nomatch = match_images_to_track(trackdf, files, dts, cam_to_utc_adjust_sec, max_time_offset)
+        #flight of the nearest fix
+        if 'source' not in gpxdf:
+            geotagdf['Flight'] = None
+        elif len(ids) == 1:
+            geotagdf['Flight'] = np.where(nomatch, None, flights.names[ids[0]])
+        else:
+            rawdf = flights.track(ids)
+            nearest = nearest_indices(to_ns(rawdf['dt']), adj_ns[idx])
+            geotagdf['Flight'] = np.where(nomatch, None, rawdf['source'].astype(object).to_numpy()[nearest])
+        frames.append(geotagdf)
+        nomatches.append(nomatch)
+        order.append(idx)
+
+    #back to imgfiles order
+    restore = np.argsort(np.concatenate(order), kind='stable')
+    geotagdf = pd.concat(frames, ignore_index=True).iloc[restore].reset_index(drop=True)
+    nomatch = np.concatenate(nomatches)[restore]
+    if dropped is not None and len(dropped):
+        suspect = np.isin(to_ns(geotagdf['ImageDateTime_Adj']) // 1_000_000_000, dropped)
+        geotagdf.loc[suspect, list(GPS_COLUMNS)] = np.nan
+        geotagdf.loc[suspect, 'Flight'] = None
+        nomatch = nomatch | suspect
+    return geotagdf, nomatch
+
+
+def print_flight_assignment(geotagdf):
+    '''Prints the number of images of each directory geotagged from each flight (Flight column of geotag_images())'''
+    df = pd.DataFrame({'Directory': [os.path.dirname(fn) for fn in geotagdf['ImagePath']],
+                       'Flight': geotagdf['Flight'].fillna('(no position)')})
+    counts = df.groupby(['Directory', 'Flight'], sort=False).size()
+    print('Images per directory and flight:')
+    for (directory, flight), n in counts.items():
+        print(f'    {directory}: {flight} {n}')
+
+
+def write_geotags(geotagdf, nomatch, workers=4, atomic=False, use_exiftool=False, exiftoolpath=None, exiftool_procs=4):
+    '''
+    Writes GPS tags to the images of geotagdf with a position (~nomatch),
+    keeping file modification dates.  Images the built-in writer can't
+    handle (all images if use_exiftool) are written by a pool of exiftool
+    processes, which keeps *_original copies.  Failures are printed.
+    Returns 'native', 'exiftool' or None (failed) for each image written.
+    '''
+    matched = geotagdf[~nomatch]
+    records = list(zip(matched['ImagePath'], matched['GPSLatitude'], matched['GPSLongitude'],
+                       matched['GPSAltitude'], matched['GPSHeading']))
+    if use_exiftool:
+        errors = ['not written'] * len(records)
+    else:
+        errors = write_gps_batch(records, workers=workers, atomic=atomic)
+    written = ['native' if err is None else None for err in errors]
+
+    #fall back to exiftool (persistent processes) for the rest
+    retry = [i for i, err in enumerate(errors) if err is not None]
+    if retry:
+        try:
+            find_exiftool(exiftoolpath)
+            with ExifToolPool(min(exiftool_procs, len(retry)), exiftoolpath) as exiftool:
+                for i, err in zip(retry, exiftool.write_gps_batch([records[i] for i in retry])):
+                    errors[i] = err
+                    written[i] = 'exiftool' if err is None else None
+        except OSError as e:
+            print(f'Could not run exiftool for {len(retry)} images ({e}).')
+    for fn, err in zip(matched['ImagePath'], errors):
+        if err is not None:
+            print(f'Could not write GPS tags to {fn}: {err}')
+    return written
+
+
+def written_files(geotagdf, nomatch, written):
+    '''Paths of the images write_geotags() wrote (written is its result)'''
+    return [Path(fn) for fn, how in zip(geotagdf['ImagePath'][~nomatch], written) if how is not None]
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming reader for GPX files exported by Mission Planner.
+
+The original mp_gpx_to_df() loaded the whole file with etree.parse and then
+walked the tree seven times with XPath (once for trkpt attributes and once
+per child tag), joining a Series per tag.  read_mp_gpx() makes a single
+iterparse pass, fills one NumPy array per field and clears each element as
+soon as it has been read, so memory stays bounded for all-day logs.
+
+load_gpx_dir() also reads DataFlash .BIN logs directly (uasutils/dataflash.py),
+so the Mission Planner gpx export can be skipped.
+
+Original reader adapted from:
+https://github.com/sackerman-usgs/UAS_processing/blob/master/UAS_GPXandJPG_processing.ipynb
+"""
+
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from lxml import etree
+from uasutils.records import grow_arrays
+from uasutils.dataflash import read_bin_track
+
+GPX_NAMESPACE = 'http://www.topografix.com/GPX/1/1'
+
+#trkpt child tags read as floats (time and mode are kept as text)
+TRKPT_FLOAT_TAGS = ['ele', 'course', 'roll', 'pitch']
+
+#column order returned by read_mp_gpx (same as the old mp_gpx_to_df)
+TRKPT_COLUMNS = ['lat', 'lon', 'time', 'ele', 'course', 'roll', 'pitch', 'mode']
+
+#an XML error at most this many bytes before the end of the file is a truncated file
+TRUNCATED_TAIL_BYTES = 16
+
+
+def _error_offset(gpxfile, error, blocksize=1024 * 1024):
+    '''Byte offset in gpxfile of the (line, column) position of XMLSyntaxError error'''
+    lineno, column = error.position
+    offset = 0
+    newlines = 0
+    with open(gpxfile, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            count = block.count(b'\n')
+            if newlines + count >= lineno - 1:
+                #start of the error line is in this block
+                pos = -1
+                for _ in range(lineno - 1 - newlines):
+                    pos = block.index(b'\n', pos + 1)
+                return offset + pos + column
+            newlines += count
+            offset += len(block)
+    return offset + column
+
+
+def read_mp_gpx(gpxfile, namespace=GPX_NAMESPACE, initial_size=4096):
+    '''
+    Reads the trkpt records of a Mission Planner gpx file into a DataFrame
+    with columns TRKPT_COLUMNS ('time' is the text from the file).  Empty
+    files or files without track points return an empty DataFrame.  A file
+    cut off after some track points (logger stopped mid-write, so the XML
+    error is at the end of the file) keeps those points with a warning; any
+    other XML error, e.g. corruption within the file, raises ValueError.
+    The warning of a truncated file is kept in the frame's attrs['partial'].
+    '''
+    ns = '{' + namespace + '}'
+    trkpt_tag = ns + 'trkpt'
+    float_tags = {ns + tag: tag for tag in TRKPT_FLOAT_TAGS}
+    time_tag = ns + 'time'
+    mode_tag = ns + 'mode'
+
+    arrays = {'lat': np.full(initial_size, np.nan),
+              'lon': np.full(initial_size, np.nan),
+              'time': np.empty(initial_size, dtype=object),
+              'mode': np.empty(initial_size, dtype=object)}
+    for tag in TRKPT_FLOAT_TAGS:
+        arrays[tag] = np.full(initial_size, np.nan)
+
+    n = 0
+    size = initial_size
+    partial = None
+    try:
+        #wpt elements are only listened for so they can be cleared as well
+        for event, elem in etree.iterparse(gpxfile, events=('end',), tag=(trkpt_tag, ns + 'wpt')):
+            if elem.tag == trkpt_tag:
+                if n == size:
+                    size *= 2
+                    grow_arrays(arrays, size)
+                arrays['lat'][n] = float(elem.get('lat'))
+                arrays['lon'][n] = float(elem.get('lon'))
+                for child in elem:
+                    if child.tag in float_tags:
+                        if child.text:
+                            arrays[float_tags[child.tag]][n] = float(child.text)
+                    elif child.tag == time_tag:
+                        arrays['time'][n] = child.text
+                    elif child.tag == mode_tag:
+                        arrays['mode'][n] = child.text
+                n += 1
+            #free the element and any already processed siblings
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+    except etree.XMLSyntaxError as e:
+        filesize = Path(gpxfile).stat().st_size
+        if n and _error_offset(gpxfile, e) >= filesize - TRUNCATED_TAIL_BYTES:
+            partial = f'Warning: {gpxfile} is truncated after {n} track points ({e})'
+            print(partial)
+        elif filesize:
+            raise ValueError(f'{gpxfile} is not a readable gpx file: {e}') from e
+        #else empty file (no root element)
+
+    df = pd.DataFrame({col: arrays[col][:n] for col in TRKPT_COLUMNS})
+    if partial is not None:
+        df.attrs['partial'] = partial
+    return df
+
+
+def parse_gpx_track(gpxfile):
+    '''read_mp_gpx() with the 'time' text converted to UTC datetime column 'dt' '''
+    gpxdf = read_mp_gpx(gpxfile)
+    #times in file have utc offset (e.g. -07:00), so let pandas parse ISO 8601
+    gpxdf['dt'] = pd.to_datetime(gpxdf.pop('time'), utc=True).astype('datetime64[ns, UTC]')
+    return gpxdf
+
+
+def parse_track(path):
+    '''parse_gpx_track() for gpx files, read_bin_track() for DataFlash .BIN logs'''
+    if Path(path).suffix.lower() == '.bin':
+        return read_bin_track(path)
+    return parse_gpx_track(path)
+
+
+def track_files(gpxdir):
+    '''
+    Returns the sorted *.gpx and DataFlash *.BIN files in gpxdir.  A gpx
+    exported from a log in the directory (76.BIN.gpx next to 76.BIN) is
+    left out, the log has the full time resolution.
+    '''
+    files = [fn for fn in Path(gpxdir).iterdir() if fn.is_file() and fn.suffix.lower() in ('.gpx', '.bin')]
+    logs = {fn.name.lower() for fn in files if fn.suffix.lower() == '.bin'}
+    return sorted(fn for fn in files if fn.suffix.lower() == '.bin' or fn.stem.lower() not in logs)
+
+
+def load_gpx_dir(gpxdir, workers=None, verbose=True, cache=None):
+    '''
+    Reads every *.gpx (parse_gpx_track) and DataFlash *.BIN log
+    (read_bin_track) in gpxdir, see track_files(), in a process pool unless
+    workers == 1, and concatenates them once.  Returns a DataFrame sorted by
+    UTC time 'dt' with the file name in column 'source'.  If cache (a
+    uasutils.trackcache.TrackCache) is given, unchanged files are loaded
+    from it instead of being parsed.  Truncated gpx files (read_mp_gpx) are
+    not cached, so they are parsed and warned about on every run.
+    '''
+    files = track_files(gpxdir)
+    if not files:
+        raise ValueError(f'No gpx or BIN files found in {Path(gpxdir).absolute()}')
+
+    paths = [str(fn.resolve()) for fn in files]
+    dfs = [cache.get(fn) if cache is not None else None for fn in paths]
+    todo = [i for i, df in enumerate(dfs) if df is None]
+    if verbose:
+        for i, fn in enumerate(paths):
+            print(('Loading ' if dfs[i] is None else 'Loading (cached) ') + fn + ' ...')
+
+    if workers == 1 or len(todo) <= 1:
+        parsed = [parse_track(paths[i]) for i in todo]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parsed = list(pool.map(parse_track, [paths[i] for i in todo]))
+    for i, df in zip(todo, parsed):
+        dfs[i] = df
+        if cache is not None and 'partial' not in df.attrs:
+            cache.put(paths[i], df)
+    if cache is not None:
+        cache.save()
+
+    for fn, df in zip(files, dfs):
+        df['source'] = fn.name
+    gpxdf = pd.concat(dfs, ignore_index=True)
+    gpxdf['source'] = gpxdf['source'].astype('category')
+    return gpxdf.sort_values('dt', kind='stable').reset_index(drop=True)
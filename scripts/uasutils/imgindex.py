@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental image metadata index (SQLite sidecar file per campaign).
+
+Renaming, time sync, geotagging and the frequency checker all need the same
+few EXIF values for every image.  ImageIndex stores them in
+<root>/.uasutils_index.sqlite along with each file's size and mtime, so
+later runs only read EXIF from files that are new or changed.  The GPS
+writer keeps file size and mtime, so writers call refresh() for the files
+they changed.  Paths are
+stored relative to the index directory.  open_index() uses the index of the
+highest directory above the scanned one that has an index, so once the
+campaign directory has one (any recursive scan of it, e.g. geotag or the
+pipeline, creates it) single flight directory scans (rename, time sync) use
+and update it too.  A new index adopts the entries of the indexes already in
+the flight directories it scans, so images aren't read again.
+
+example:
+    with ImageIndex(imgdir) as idx:
+        metas = idx.update(find_images(imgdir, ['JPG', 'DNG']))
+"""
+
+import os
+import sqlite3
+from pathlib import Path
+from uasutils.exif import read_image_meta, IMAGE_META_KEYS
+from uasutils.scan import scan_files, scan_dt_tags
+
+INDEX_NAME = '.uasutils_index.sqlite'
+
+#table columns (path/size/mtime_ns + metadata from read_image_meta)
+INDEX_COLUMNS = ['path', 'size', 'mtime_ns'] + IMAGE_META_KEYS
+
+_SCHEMA = '''CREATE TABLE IF NOT EXISTS images (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime_ns INTEGER,
+                dt_original TEXT,
+                subsec TEXT,
+                model TEXT,
+                gps_lat REAL,
+                gps_lon REAL,
+                gps_alt REAL)'''
+
+
+def relative_key(root, fn):
+    '''Posix path of fn relative to root if below it, otherwise absolute'''
+    #string prefix test, Path.relative_to parses both paths and is slow for 10,000s of files
+    root, fn = str(root), str(fn)
+    if root == '.':
+        if not os.path.isabs(fn):
+            return Path(fn).as_posix()
+    elif fn.startswith(os.path.join(root, '')):
+        return fn[len(os.path.join(root, '')):].replace(os.sep, '/')
+    return Path(fn).resolve().as_posix()
+
+
+class ImageIndex:
+    '''Metadata index for images under root'''
+    def __init__(self, root):
+        self.root = Path(root)
+        self.con = sqlite3.connect(str(self.root / INDEX_NAME))
+        self.con.execute(_SCHEMA)
+        self.nread = 0
+        #an empty index adopts the entries of indexes below it on the first update
+        self.new = self.con.execute('SELECT COUNT(*) FROM images').fetchone()[0] == 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.con.commit()
+        self.con.close()
+
+    def key(self, fn):
+        '''Index key for file path fn (posix path relative to root if below it)'''
+        return relative_key(self.root, fn)
+
+    def update(self, files, workers=1, processes=False, verbose=True):
+        '''
+        Returns metadata dict (INDEX_COLUMNS) for each file in files, in order.
+        Only files that are not in the index, or whose size/mtime changed, are
+        read (using scan_files with workers/processes).
+        '''
+        files = list(files)
+        if self.new:
+            self._adopt(files)
+            self.new = False
+        keys = [self.key(fn) for fn in files]
+        stats = [fn.stat() for fn in files]
+        cached = {row[0]: dict(zip(INDEX_COLUMNS, row))
+                  for row in self.con.execute(f'SELECT {", ".join(INDEX_COLUMNS)} FROM images')}
+
+        todo = [i for i, (k, st) in enumerate(zip(keys, stats))
+                if k not in cached or cached[k]['size'] != st.st_size or cached[k]['mtime_ns'] != st.st_mtime_ns]
+        metas = scan_files(read_image_meta, [files[i] for i in todo], workers, processes, verbose,
+                           what='EXIF (new or changed)')
+        cached.update(self._store([keys[i] for i in todo], [stats[i] for i in todo], metas))
+        if verbose:
+            print(f'Image index: {len(files) - len(todo)} of {len(files)} images unchanged since last scan')
+        return [cached[k] for k in keys]
+
+    def _adopt(self, files):
+        '''Copies the entries of indexes in the directories of files (below root) into this index'''
+        dirs = set()
+        for d in {fn.parent for fn in files}:
+            while d != self.root and d not in dirs and d != d.parent:
+                dirs.add(d)
+                d = d.parent
+        for d in sorted(dirs):
+            child = d / INDEX_NAME
+            if not child.exists():
+                continue
+            prefix = relative_key(self.root, d) + '/'
+            if os.path.isabs(prefix):
+                continue
+            try:
+                self.con.execute('ATTACH DATABASE ? AS child', (str(child),))
+                #only entries relative to the child index (absolute paths are outside it)
+                self.con.execute(f'INSERT OR IGNORE INTO images ({", ".join(INDEX_COLUMNS)}) '
+                                 f'SELECT ? || path, {", ".join(INDEX_COLUMNS[1:])} FROM child.images '
+                                 f"WHERE path NOT LIKE '/%' AND path NOT LIKE '_:%'", (prefix,))
+                self.con.commit()
+                self.con.execute('DETACH DATABASE child')
+            except sqlite3.Error as e:
+                print(f'Could not read image index {child} ({e}).')
+
+    def refresh(self, files, workers=1, processes=False, verbose=False):
+        '''
+        Reads and stores the metadata of files even if size/mtime are
+        unchanged (files changed in place keeping their mtime, e.g. by
+        write_gps).  Returns metadata dict for each file, in order.
+        '''
+        files = list(files)
+        metas = scan_files(read_image_meta, files, workers, processes, verbose, what='EXIF (written)')
+        rows = self._store([self.key(fn) for fn in files], [fn.stat() for fn in files], metas)
+        return [rows[self.key(fn)] for fn in files]
+
+    def _store(self, keys, stats, metas):
+        '''Inserts/replaces entries of keys, returns dict key -> row'''
+        rows = {}
+        for k, st, meta in zip(keys, stats, metas):
+            rows[k] = dict(meta, path=k, size=st.st_size, mtime_ns=st.st_mtime_ns)
+        self.con.executemany(f'INSERT OR REPLACE INTO images ({", ".join(INDEX_COLUMNS)}) '
+                             f'VALUES ({", ".join("?" * len(INDEX_COLUMNS))})',
+                             [[row[c] for c in INDEX_COLUMNS] for row in rows.values()])
+        self.con.commit()
+        self.nread += len(keys)
+        return rows
+
+    def rename(self, old, new):
+        '''Updates the entry for a renamed/moved file in place'''
+        self.rename_many([(old, new)])
+
+    def rename_many(self, moves):
+        '''Updates the entries for renamed/moved files, moves are (old, new) paths'''
+        self.con.executemany('UPDATE OR REPLACE images SET path = ?, mtime_ns = ? WHERE path = ?',
+                             [(self.key(new), os.stat(new).st_mtime_ns, self.key(old)) for old, new in moves])
+
+    def forget(self, files):
+        '''Removes entries for files (e.g. deleted images)'''
+        self.con.executemany('DELETE FROM images WHERE path = ?', [(self.key(fn),) for fn in files])
+
+
+def find_index_root(root):
+    '''Highest of root and its parents (as given, not resolved) with an index, root if none has one'''
+    root = Path(root)
+    found = root
+    for d in [root] + list(root.parents):
+        if (d / INDEX_NAME).exists():
+            found = d
+    return found
+
+
+def open_index(root, use_index=True):
+    '''
+    Returns ImageIndex for images under root (stored in the highest directory
+    above it with an index, see find_index_root), or None if use_index is
+    False or it can't be opened (e.g. read only)
+    '''
+    if not use_index:
+        return None
+    root = find_index_root(root)
+    try:
+        return ImageIndex(root)
+    except sqlite3.Error as e:
+        print(f'Could not use image index in {root} ({e}), reading all images.')
+        return None
+
+
+def refresh_index(root, files, workers=1, use_index=True):
+    '''Re-reads files (changed in place) into the index in root, if it is used'''
+    idx = open_index(root, use_index)
+    if idx is not None:
+        with idx:
+            idx.refresh(files, workers)
+
+
+def indexed_dt_tags(root, files, workers=1, processes=False, use_index=True, verbose=True):
+    '''
+    Returns (DateTimeOriginal, SubSecTimeOriginal) for each file in files,
+    from the index in root (updated for new/changed files).  Reads every
+    file if use_index is False or the index can't be opened.
+    '''
+    idx = open_index(root, use_index)
+    if idx is None:
+        return scan_dt_tags(files, workers, processes, verbose)
+    with idx:
+        metas = idx.update(files, workers, processes, verbose)
+    return [(m['dt_original'], m['subsec']) for m in metas]
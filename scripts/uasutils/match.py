@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Batched matching of image times to GPS track times.
+
+Replaces the per-image linear scan (nearest_ind) in geotag-with-gpx.py.  The
+1 Hz track is already sorted by time, so every image is matched with one
+np.searchsorted call and all GPS columns are filled with a single take.
+
+interpolate_images_to_track() is the alternative to 1 Hz averaging: it
+interpolates the full rate track at the (sub-second) image time.
+"""
+
+import numpy as np
+import pandas as pd
+from uasutils.records import RecordStore, UTC_DATETIME
+
+#output columns of the geotag csv (order matters, exiftool reads SourceFile).
+#UTCTime is the fix nearest ImageDateTime_Adj and TimeDiff is |ImageDateTime - UTCTime|
+#in seconds, i.e. measured from the camera time, so it includes the camera to UTC
+#offset (same rule with or without -interp; max_time_offset is checked against it)
+GEOTAG_COLUMNS = ['ImagePath', 'SourceFile', 'ImageDateTime', 'ImageDateTime_Adj', 'UTCTime', 'TimeDiff',
+                  'GPSLatitude', 'GPSLongitude', 'GPSAltitude', 'GPSHeading', 'GPSRoll', 'GPSPitch']
+
+#RecordStore dtypes of the geotag columns
+GEOTAG_DTYPES = {'ImagePath': object,
+                 'SourceFile': object,
+                 'ImageDateTime': 'datetime64[ns]',
+                 'ImageDateTime_Adj': UTC_DATETIME,
+                 'UTCTime': UTC_DATETIME,
+                 'TimeDiff': float,
+                 'GPSLatitude': float,
+                 'GPSLongitude': float,
+                 'GPSAltitude': float,
+                 'GPSHeading': float,
+                 'GPSRoll': float,
+                 'GPSPitch': float}
+
+#geotag csv column -> track column
+GPS_COLUMNS = {'GPSLatitude': 'lat',
+               'GPSLongitude': 'lon',
+               'GPSAltitude': 'ele',
+               'GPSHeading': 'course',
+               'GPSRoll': 'roll',
+               'GPSPitch': 'pitch'}
+
+
+def to_ns(dt):
+    '''Converts a datetime Series/array (naive or UTC aware) to int64 ns since epoch'''
+    dt = pd.Series(dt)
+    if dt.dt.tz is not None:
+        dt = dt.dt.tz_convert('UTC').dt.tz_localize(None)
+    return dt.to_numpy(dtype='datetime64[ns]').astype(np.int64)
+
+
+def nearest_indices(sorted_ns, query_ns):
+    '''
+    Returns index into sorted_ns of the nearest value for each of query_ns.
+    Ties go to the earlier value (same as argmin over absolute differences).
+    '''
+    sorted_ns = np.asarray(sorted_ns)
+    query_ns = np.asarray(query_ns)
+    if len(sorted_ns) == 0:
+        raise ValueError('no track times to match against')
+    if len(sorted_ns) == 1:
+        return np.zeros(len(query_ns), dtype=np.intp)
+    idx = np.clip(np.searchsorted(sorted_ns, query_ns, side='left'), 1, len(sorted_ns) - 1)
+    use_left = (query_ns - sorted_ns[idx - 1]) <= (sorted_ns[idx] - query_ns)
+    return idx - use_left
+
+
+def _geotag_frame(imgfiles, imgdt, adjimgdt, gpxtime, timediff, gps):
+    '''Geotag DataFrame (GEOTAG_COLUMNS) from per-image columns, gps has one column per GPS_COLUMNS'''
+    imgfiles = list(imgfiles)
+    store = RecordStore(GEOTAG_DTYPES, capacity=len(imgfiles))
+    store.extend(ImagePath=imgfiles, SourceFile=imgfiles, ImageDateTime=imgdt,
+                 ImageDateTime_Adj=adjimgdt, UTCTime=gpxtime, TimeDiff=timediff,
+                 **{col: gps[:, i] for i, col in enumerate(GPS_COLUMNS)})
+    return store.to_frame(GEOTAG_COLUMNS)
+
+
+def match_images_to_track(trackdf, imgfiles, imgdts, cam_to_utc_adjust_sec, max_time_offset, idx=None):
+    '''
+    Builds the geotag dataframe for all images at once.
+
+    trackdf must be sorted by 'dt' (UTC aware) and have the GPS_COLUMNS track
+    columns.  imgdts are the camera (unadjusted) image times.  Images whose
+    time difference to the nearest fix exceeds max_time_offset get NaN
+    positions.  idx is the row of trackdf nearest each image if already
+    known (e.g. searched within each image's flight, trackdf then only has
+    to be sorted within those blocks).
+    '''
+    imgdt = pd.Series(pd.to_datetime(pd.Series(imgdts)).to_numpy(dtype='datetime64[ns]'))
+    adjimgdt = (imgdt + pd.Timedelta(seconds=cam_to_utc_adjust_sec)).dt.tz_localize('UTC')
+
+    if idx is None:
+        idx = nearest_indices(to_ns(trackdf['dt']), to_ns(adjimgdt))
+    gpxtime = trackdf['dt'].iloc[idx].reset_index(drop=True)
+
+    #time difference is between camera time and matched gps time
+    abs_actual_offset = np.abs(to_ns(imgdt) - to_ns(gpxtime)) / 1e9
+    nomatch = abs_actual_offset > max_time_offset
+
+    gps = trackdf[list(GPS_COLUMNS.values())].to_numpy(dtype=float)[idx]
+    gps[nomatch] = np.nan
+    return _geotag_frame(imgfiles, imgdt, adjimgdt, gpxtime, abs_actual_offset, gps), nomatch
+
+
+#track columns that are angles in degrees -> True if wrapped to [-180, 180), False for [0, 360)
+CIRCULAR_COLUMNS = {'course': False, 'roll': True, 'pitch': True}
+
+
+def spread_subsecond(track_ns):
+    '''
+    Mission Planner gpx times only have 1 s precision but several fixes per
+    second.  Spreads the fixes within each whole second evenly over that
+    second (k/n for the k-th of n fixes).  track_ns must be sorted.  Times
+    that already have sub-second precision are returned unchanged.
+    '''
+    track_ns = np.asarray(track_ns, dtype=np.int64)
+    if len(track_ns) == 0 or np.any(track_ns % 1_000_000_000):
+        return track_ns
+    change = np.r_[True, track_ns[1:] != track_ns[:-1]]
+    starts = np.flatnonzero(change)
+    run = np.cumsum(change) - 1
+    counts = np.diff(np.r_[starts, len(track_ns)])
+    k = np.arange(len(track_ns)) - starts[run]
+    return track_ns + k * 1_000_000_000 // counts[run]
+
+
+def interpolate_images_to_track(trackdf, imgfiles, imgdts, cam_to_utc_adjust_sec, max_time_offset):
+    '''
+    Builds the geotag dataframe by interpolating the full rate track at each
+    adjusted image time (imgdts may include sub-second precision).
+
+    trackdf is the raw (not 1 Hz averaged) track, sorted by 'dt'.  lat/lon/ele
+    are interpolated linearly, course/roll/pitch along the shortest arc.
+    UTCTime is the logged time of the fix nearest the adjusted image time
+    and TimeDiff its distance from the camera time, as in
+    match_images_to_track().  Images
+    whose TimeDiff exceeds max_time_offset, or that fall in a gap between
+    fixes longer than max_time_offset, get NaN positions.
+    '''
+    imgdt = pd.Series(pd.to_datetime(pd.Series(imgdts)).to_numpy(dtype='datetime64[ns]'))
+    adjimgdt = (imgdt + pd.Timedelta(seconds=cam_to_utc_adjust_sec)).dt.tz_localize('UTC')
+
+    track_ns = spread_subsecond(to_ns(trackdf['dt']))
+    query_ns = to_ns(adjimgdt)
+    n = len(track_ns)
+    if n == 0:
+        raise ValueError('no track times to match against')
+
+    #bracketing fixes and interpolation weight (clamped at the track ends)
+    hi = np.clip(np.searchsorted(track_ns, query_ns, side='right'), 1, max(n - 1, 1))
+    lo = np.minimum(hi - 1, n - 1)
+    hi = np.minimum(hi, n - 1)
+    span = track_ns[hi] - track_ns[lo]
+    w = np.divide(query_ns - track_ns[lo], span, out=np.zeros(len(query_ns)), where=span > 0)
+    w = np.clip(w, 0.0, 1.0)[:, None]
+
+    cols = list(GPS_COLUMNS.values())
+    vals = trackdf[cols].to_numpy(dtype=float)
+    delta = vals[hi] - vals[lo]
+    circ = [cols.index(c) for c in CIRCULAR_COLUMNS]
+    delta[:, circ] = (delta[:, circ] + 180.0) % 360.0 - 180.0
+    gps = vals[lo] + w * delta
+    for c, signed in CIRCULAR_COLUMNS.items():
+        i = cols.index(c)
+        gps[:, i] = (gps[:, i] + 180.0) % 360.0 - 180.0 if signed else gps[:, i] % 360.0
+
+    #nearest fix by spread time, but UTCTime and TimeDiff use its logged time (as written to the csv)
+    nearest = np.where(np.abs(query_ns - track_ns[lo]) <= np.abs(track_ns[hi] - query_ns), lo, hi)
+    gpxtime = trackdf['dt'].iloc[nearest].reset_index(drop=True)
+    #time difference is between camera time and matched gps time (as in match_images_to_track)
+    abs_actual_offset = np.abs(to_ns(imgdt) - to_ns(gpxtime)) / 1e9
+    nomatch = (abs_actual_offset > max_time_offset) | (span / 1e9 > max_time_offset)
+    gps[nomatch] = np.nan
+
+    return _geotag_frame(imgfiles, imgdt, adjimgdt, gpxtime, abs_actual_offset, gps), nomatch
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+Declarative processing pipeline over one traversal of an image directory.
+
+The field workflow (renameUASimages.py, geotag-with-gpx.py,
+remove-original-after-geotag.py, frequency notebook) walked and opened every
+image once per step.  run_pipeline() walks the tree once (walk_images), reads
+the metadata of every image once (through the image index) and passes both
+to each stage in turn in a Context.  A stage reports why it doesn't apply
+(e.g. no -gpxdir given) and is skipped, and a timing summary of every stage
+is printed at the end.  Given a uasutils.profiling.Profiler, every stage
+that runs is also recorded with its CPU time, reads and peak memory.
+
+Stages are classes with a name, applies(ctx) returning None or the reason to
+skip, and run(ctx) returning the number of images processed.  STAGES maps
+stage names to classes, DEFAULT_STAGES is the field workflow order.
+"""
+
+import time
+from abc import ABC, abstractmethod
+from contextlib import nullcontext
+from datetime import datetime
+from pathlib import Path
+from uasutils.exif import read_image_meta, EXIF_DT_FORMAT
+from uasutils.scan import walk_images, scan_files
+from uasutils.imgindex import open_index
+from uasutils.rename import is_renamed, flight_dir, plan_renames, with_backup_moves, find_collisions, RenameJournal, user_prompt
+from uasutils.gpx import load_gpx_dir
+from uasutils.trackcache import TrackCache
+from uasutils.geotag import screen_track, geotag_images, print_flight_assignment, write_geotags, written_files
+from uasutils.exiftool import find_exiftool
+from uasutils.frequency import FrequencyReport
+from uasutils.cleanup import remove_backups
+
+
+class Context:
+    '''State shared by the stages: image list, metadata (one dict per image), backups, index, gpx track and args'''
+    def __init__(self, imgdir, args):
+        self.imgdir = Path(imgdir)
+        self.args = args
+        self.images = []
+        self.metas = []
+        self.backups = []
+        self.index = None
+        self.track = None
+
+    def dttags(self):
+        '''(DateTimeOriginal, SubSecTimeOriginal) of each image'''
+        return [(m['dt_original'], m['subsec']) for m in self.metas]
+
+    def sort_images(self):
+        '''Restores walk_images() order (by file type, then path) after images were renamed/moved'''
+        rank = {'.' + ftype: i for i, ftype in enumerate(self.args.ftypes)}
+        order = sorted(range(len(self.images)), key=lambda i: (rank.get(self.images[i].suffix, len(rank)), self.images[i]))
+        self.images = [self.images[i] for i in order]
+        self.metas = [self.metas[i] for i in order]
+
+
+class Stage(ABC):
+    '''Pipeline stage (subclasses set name and implement run, and applies if it can be skipped)'''
+    name = ''
+
+    def applies(self, ctx):
+        '''Returns None if the stage should run, otherwise the reason it is skipped'''
+        return None
+
+    @abstractmethod
+    def run(self, ctx):
+        '''Runs the stage, returns number of images processed'''
+
+
+class ScanStage(Stage):
+    '''Walks the image directory once and reads metadata of new/changed images'''
+    name = 'scan'
+
+    def run(self, ctx):
+        args = ctx.args
+        ctx.images, ctx.backups = walk_images(ctx.imgdir, args.ftypes)
+        ctx.index = open_index(ctx.imgdir, use_index=not args.noindex)
+        if ctx.index is not None:
+            ctx.metas = ctx.index.update(ctx.images, args.workers, args.use_processes)
+        else:
+            ctx.metas = scan_files(read_image_meta, ctx.images, args.workers, args.use_processes, what='EXIF')
+        return len(ctx.images)
+
+
+class RenameStage(Stage):
+    '''
+    Renames images F<flight>_<UTC time>_<name> (renameUASimages.py),
+    optionally into jpg/dng dirs.  -f is one flight number, so the images to
+    rename must all be in one flight directory.
+    '''
+    name = 'rename'
+
+    def applies(self, ctx):
+        if ctx.args.fltnum is None or ctx.args.utcoffset is None:
+            return 'needs -f and -utc'
+        if all(is_renamed(fn) for fn in ctx.images) and not ctx.args.sepdir:
+            return 'all images already renamed'
+        return None
+
+    def run(self, ctx):
+        args = ctx.args
+        journal = RenameJournal(ctx.imgdir)
+        if journal.exists():
+            raise Exception(f'{journal.path} found: a previous rename was interrupted, finish it with '
+                            f'renameUASimages.py -dir={ctx.imgdir} -resume (or -rollback) first')
+        #every target name up front, checked for collisions before anything is renamed
+        moves, mkdirs = plan_renames(ctx.images, [m['dt_original'] for m in ctx.metas], args.utcoffset, args.fltnum, args.sepdir)
+        flightdirs = sorted({flight_dir(old) for old, new in moves})
+        if len(flightdirs) > 1:
+            raise Exception(f'Images to rename are in {len(flightdirs)} directories, but -f={args.fltnum} is a single '
+                            f'flight number; nothing renamed.  Rename each flight directory on its own:\n'
+                            + '\n'.join(str(d) for d in flightdirs[:20]))
+        #exiftool backups follow their images, so the cleanup stage can still pair them
+        allmoves = with_backup_moves(moves, ctx.backups)
+        collisions = find_collisions(allmoves)
+        if collisions:
+            raise Exception(f'{len(collisions)} rename collisions, nothing renamed:\n' + '\n'.join(collisions[:20]))
+        if not moves:
+            return 0
+        fsample, newsample = moves[0]
+        if not args.skipconf and not is_renamed(fsample):
+            #Show sample rename to user and get confirmation to continue
+            dt_orig = ctx.metas[ctx.images.index(fsample)]['dt_original']
+            print(f'Image {fsample.name} has time stamp: {datetime.strptime(dt_orig, EXIF_DT_FORMAT)}\n'
+                  f'Image {fsample.name} will be renamed to: {newsample.name}\n')
+            if not user_prompt('Do you want to rename this and all images following this pattern?'):
+                raise SystemExit('Terminating pipeline.')
+        #journal, then all renames and moves in one pass
+        journal.write(allmoves, mkdirs)
+        journal.apply(args.workers)
+        if ctx.index is not None:
+            ctx.index.rename_many(moves)
+        renamed = dict(allmoves)
+        ctx.images = [renamed.get(fn, fn) for fn in ctx.images]
+        ctx.backups = [renamed.get(fn, fn) for fn in ctx.backups]
+        ctx.sort_images()
+        return len(moves)
+
+
+class GeotagStage(Stage):
+    '''Geotags images from the gpx files in -gpxdir (geotag-with-gpx.py)'''
+    name = 'geotag'
+
+    def applies(self, ctx):
+        if ctx.args.gpxdir is None:
+            return 'needs -gpxdir'
+        if not ctx.images:
+            return 'no images'
+        return None
+
+    def run(self, ctx):
+        args = ctx.args
+        gpxdir = Path(args.gpxdir)
+        gpxcache = None
+        if not args.nocache:
+            gpxcache = TrackCache(args.gpxcache or gpxdir.joinpath('.gpxcache'), max_bytes=args.gpx_cache_max_mb * 1024 * 1024)
+        gpxdf = load_gpx_dir(gpxdir, workers=args.gpxworkers, cache=gpxcache)
+        gpxdf, dropped = screen_track(gpxdf, args.max_gps_err_per_sec_meters,
+                                      qcfile=ctx.imgdir.joinpath(f'{str(ctx.imgdir.name)}_{args.trackqcfn}.csv'))
+        ctx.track = gpxdf
+
+        geotagdf, nomatch = geotag_images(gpxdf, ctx.images, ctx.dttags(), args.imgoffset, args.max_time_offset,
+                                          interp=args.interp, dropped=dropped)
+        for fn in geotagdf['ImagePath'][nomatch]:
+            print(f'No GPS data found within {args.max_time_offset} seconds of adjusted image time for image {fn}, skipping geotag operation.')
+        print_flight_assignment(geotagdf)
+        print(f'GPS positions found for {geotagdf["GPSLatitude"].notna().sum()} of {len(geotagdf)} images.')
+        geotagdf.to_csv(ctx.imgdir.joinpath(f'{str(ctx.imgdir.name)}_{args.geotagfn}.csv'), index=False)
+
+        written = write_geotags(geotagdf, nomatch, workers=max(args.workers, 4), atomic=args.atomic,
+                                use_exiftool=args.use_exiftool, exiftoolpath=args.exiftoolpath,
+                                exiftool_procs=args.exiftool_procs)
+        #sizes and mtimes are kept, so the index (and metas) have to be told about the new positions
+        if ctx.index is not None:
+            files = written_files(geotagdf, nomatch, written)
+            position = {fn: i for i, fn in enumerate(ctx.images)}
+            for fn, meta in zip(files, ctx.index.refresh(files, args.workers)):
+                if fn in position:
+                    ctx.metas[position[fn]] = meta
+        #exiftool keeps *_original copies (removed by the cleanup stage)
+        for fn, how in zip(geotagdf['ImagePath'][~nomatch], written):
+            backup = Path(str(fn) + '_original')
+            if how == 'exiftool' and backup.exists():
+                ctx.backups.append(backup)
+        if 'exiftool' in written and not args.cleanup:
+            print(f'To undo geotagging of images written by exiftool: '
+                  f'{" ".join(find_exiftool(args.exiftoolpath))} -restore_original -r {ctx.imgdir}')
+        return sum(how is not None for how in written)
+
+
+class CleanupStage(Stage):
+    '''Removes exiftool *_original copies (remove-original-after-geotag.py)'''
+    name = 'cleanup'
+
+    def applies(self, ctx):
+        if not ctx.backups:
+            return 'no *_original files'
+        if not ctx.args.cleanup and not ctx.args.dryrun:
+            return f'{len(ctx.backups)} *_original files, use -cleanup to remove them'
+        return None
+
+    def run(self, ctx):
+        args = ctx.args
+        report = remove_backups(ctx.backups, args.cleanup_workers, dry_run=args.dryrun, check_geotag=args.checkgps)
+        report.print_summary()
+        if not args.dryrun:
+            kept = {fn for fn, reason in report.skipped + report.failures}
+            ctx.backups = [fn for fn in ctx.backups if fn in kept]
+        return report.deleted
+
+
+class FrequencyStage(Stage):
+    '''Reports gaps, duplicates and bursts of image times and gpx coverage (image-frequency-checker.py)'''
+    name = 'frequency'
+
+    def applies(self, ctx):
+        if sum(m['dt_original'] is not None for m in ctx.metas) < 2:
+            return 'fewer than 2 images with timestamps'
+        return None
+
+    def run(self, ctx):
+        args = ctx.args
+        report = FrequencyReport(ctx.images, ctx.dttags(), args.freq)
+        #track loaded (and screened) by the geotag stage
+        if ctx.track is not None:
+            report.gpx_coverage(ctx.track['dt'], args.imgoffset, args.max_time_offset)
+        report.print_summary()
+        report.images.to_csv(ctx.imgdir.joinpath(f'{str(ctx.imgdir.name)}_{args.frequencyfn}.csv'), index=False)
+        return len(report.ns)
+
+
+#stage name -> class (scan always runs first)
+STAGES = {'rename': RenameStage,
+          'geotag': GeotagStage,
+          'cleanup': CleanupStage,
+          'frequency': FrequencyStage}
+
+#field workflow order
+DEFAULT_STAGES = ['rename', 'geotag', 'cleanup', 'frequency']
+
+
+def run_pipeline(ctx, stage_names=DEFAULT_STAGES, verbose=True, profiler=None):
+    '''
+    Runs the scan stage and then stage_names (in order) on ctx.  Returns a
+    list of (stage, status, images, seconds) with status 'ran' or
+    'skipped: <reason>', which print_summary() formats.  Stages that run
+    are recorded in profiler (uasutils.profiling.Profiler) if given.
+    '''
+    unknown = [name for name in stage_names if name not in STAGES]
+    if unknown:
+        raise ValueError(f'Unknown stages: {", ".join(unknown)} (available: {", ".join(STAGES)})')
+    summary = []
+    try:
+        for stage in [ScanStage()] + [STAGES[name]() for name in stage_names]:
+            reason = stage.applies(ctx)
+            if reason is not None:
+                summary.append((stage.name, f'skipped: {reason}', 0, 0.0))
+                continue
+            if verbose:
+                print(f'--- {stage.name} ---')
+            t0 = time.perf_counter()
+            with profiler.stage(stage.name) if profiler is not None else nullcontext({}) as record:
+                n = stage.run(ctx)
+                record['items'] = n
+            summary.append((stage.name, 'ran', n, time.perf_counter() - t0))
+    finally:
+        if ctx.index is not None:
+            ctx.index.close()
+    return summary
+
+
+def print_summary(summary):
+    '''Prints per-stage timing table from run_pipeline()'''
+    print(f'\n{"stage":10s} {"images":>8s} {"seconds":>9s} {"images/sec":>11s}  status')
+    for name, status, n, seconds in summary:
+        rate = f'{n / seconds:11.0f}' if seconds > 0 and n else f'{"":11s}'
+        print(f'{name:10s} {n:8d} {seconds:9.3f} {rate}  {status}')
+    print(f'{"total":10s} {"":8s} {sum(s[3] for s in summary):9.3f}')
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+Per-stage timing, CPU, I/O and memory instrumentation shared by the scripts.
+
+A script wraps each step in Profiler.stage() and with -profile writes the
+records to <prefix>_profile.json and <prefix>_profile.csv:
+
+    stage           name of the step
+    wall_s, cpu_s   elapsed and CPU seconds (user + system, this process and
+                    worker processes that finished during the stage)
+    cpu_pct         cpu_s / wall_s, well below 100 means the step waited on
+                    I/O (EXIF reads on a share, exiftool), several hundred
+                    means it ran on several cores
+    items, per_sec  images (or fixes) processed and the rate
+    files           files opened by the step, if the script counts them
+    read_mb, read_calls
+                    bytes and read calls of this process (linux
+                    /proc/self/io, or psutil if installed; not worker
+                    processes)
+    peak_rss_mb     peak resident memory of the process so far
+
+With -cprofile=<stage>[,<stage>] (implies -profile) those stages run under
+cProfile, the stats are saved to <prefix>_<stage>.prof (open with pstats or snakeviz) and the
+top functions are printed.
+
+example:
+    prof = Profiler(cprofile_stages=['geotag'])
+    with prof.stage('exif_scan', items=len(files), files=len(files)):
+        dttags = scan_dt_tags(files)
+    prof.print_summary()
+    prof.write('D:/temp/images/images')
+"""
+
+import cProfile
+import csv
+import io
+import json
+import os
+import pstats
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    #windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+#columns of the csv report (and keys of each stage record)
+PROFILE_COLUMNS = ['stage', 'wall_s', 'cpu_s', 'cpu_pct', 'items', 'per_sec', 'files',
+                   'read_mb', 'read_calls', 'peak_rss_mb']
+
+#functions printed for a cProfiled stage
+CPROFILE_PRINT = 20
+
+
+def _cpu_seconds():
+    '''User + system CPU seconds of this process and its finished child processes'''
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def _io_counters():
+    '''(bytes, calls) read by this process so far, (None, None) if not available'''
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['rchar']), int(counters['syscr'])
+    except (OSError, KeyError, ValueError):
+        pass
+    if psutil is not None:
+        try:
+            counters = psutil.Process().io_counters()
+            return counters.read_bytes, counters.read_count
+        except (psutil.Error, AttributeError):
+            pass
+    return None, None
+
+
+def _peak_rss_mb():
+    '''Peak resident memory (MB) of this process, None if not available'''
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        #kilobytes on linux, bytes on macos
+        return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / 1e6
+    return None
+
+
+class Profiler:
+    '''Records of the stages run with stage(), cProfile for the stages in cprofile_stages'''
+    def __init__(self, cprofile_stages=()):
+        self.records = []
+        self.cprofile_stages = set(cprofile_stages)
+        self.stats = {}
+        self.created = datetime.now()
+        self.t0 = time.perf_counter()
+        self.cpu0 = _cpu_seconds()
+
+    @contextmanager
+    def stage(self, name, items=0, files=None):
+        '''
+        Times the block as stage name.  Yields the record (dict with
+        PROFILE_COLUMNS), so items/files can be set when known at the end.
+        '''
+        record = {'stage': name, 'items': items, 'files': files}
+        profile = cProfile.Profile() if name in self.cprofile_stages else None
+        read0, calls0 = _io_counters()
+        cpu0 = _cpu_seconds()
+        t0 = time.perf_counter()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield record
+        finally:
+            if profile is not None:
+                profile.disable()
+                self.stats[name] = profile
+            wall = time.perf_counter() - t0
+            cpu = _cpu_seconds() - cpu0
+            read1, calls1 = _io_counters()
+            record.update(wall_s=round(wall, 6), cpu_s=round(cpu, 6),
+                          cpu_pct=round(100 * cpu / wall, 1) if wall > 0 else None,
+                          per_sec=round(record['items'] / wall, 1) if wall > 0 and record['items'] else None,
+                          read_mb=round((read1 - read0) / 1e6, 3) if read0 is not None else None,
+                          read_calls=calls1 - calls0 if calls0 is not None else None,
+                          peak_rss_mb=_peak_rss_mb())
+            self.records.append({col: record.get(col) for col in PROFILE_COLUMNS})
+
+    def total(self):
+        '''Record of the whole run (since the Profiler was created)'''
+        wall = time.perf_counter() - self.t0
+        cpu = _cpu_seconds() - self.cpu0
+        return {'stage': 'total', 'wall_s': round(wall, 6), 'cpu_s': round(cpu, 6),
+                'cpu_pct': round(100 * cpu / wall, 1) if wall > 0 else None,
+                'read_mb': round(sum(r['read_mb'] or 0 for r in self.records), 3),
+                'peak_rss_mb': _peak_rss_mb()}
+
+    def print_summary(self):
+        '''Prints a table of the stage records (and the top functions of cProfiled stages)'''
+        def fmt(value, width, decimals=0):
+            return f'{value:{width}.{decimals}f}' if value is not None else ' ' * width
+        print(f'\n{"stage":16s} {"wall s":>8s} {"cpu s":>8s} {"cpu %":>6s} {"items":>8s} {"items/s":>9s} '
+              f'{"read MB":>9s} {"peak MB":>8s}')
+        for r in self.records + [self.total()]:
+            print(f'{r["stage"]:16s} {fmt(r["wall_s"], 8, 3)} {fmt(r["cpu_s"], 8, 3)} {fmt(r["cpu_pct"], 6)} '
+                  f'{fmt(r.get("items") or None, 8)} {fmt(r.get("per_sec"), 9)} '
+                  f'{fmt(r["read_mb"], 9, 1)} {fmt(r["peak_rss_mb"], 8)}')
+        for name, profile in self.stats.items():
+            out = io.StringIO()
+            pstats.Stats(profile, stream=out).sort_stats('cumulative').print_stats(CPROFILE_PRINT)
+            print(f'\ncProfile of stage {name} (top {CPROFILE_PRINT} by cumulative time):')
+            print(out.getvalue())
+
+    def write(self, prefix, script=None):
+        '''Writes <prefix>_profile.json and .csv, and <prefix>_<stage>.prof for cProfiled stages'''
+        prefix = str(prefix)
+        report = {'script': script or os.path.basename(sys.argv[0]), 'argv': sys.argv[1:],
+                  'created': self.created.isoformat(timespec='seconds'),
+                  'stages': self.records, 'total': self.total()}
+        with open(prefix + '_profile.json', 'w') as f:
+            json.dump(report, f, indent=1)
+        with open(prefix + '_profile.csv', 'w', newline='') as f:
+            writer = csv.DictWriter(f, PROFILE_COLUMNS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(self.records + [report['total']])
+        for name, profile in self.stats.items():
+            profile.dump_stats(f'{prefix}_{name}.prof')
+        print(f'Profile written to {prefix}_profile.json/.csv'
+              + (f' and cProfile stats to {prefix}_<stage>.prof' if self.stats else ''))
+
+
+def add_profile_args(parser):
+    '''Adds -profile and -cprofile arguments shared by the scripts'''
+    parser.add_argument('-profile', '--profile', dest='profile',
+                        nargs='?', const='', default=None,
+                        help='print per-stage wall/CPU time, reads and memory and write them to '
+                             '<prefix>_profile.json/.csv [default: written to the image directory]')
+    parser.add_argument('-cprofile', '--cprofile_stages', dest='cprofile',
+                        required=False, default='',
+                        help='comma separated stages to run under cProfile (implies -profile)')
+
+
+def profiler_from_args(args):
+    '''Profiler for the -cprofile stages of args, -cprofile turns on -profile'''
+    if args.cprofile and args.profile is None:
+        args.profile = ''
+    return Profiler([name.strip() for name in args.cprofile.split(',') if name.strip()])
+
+
+def finish_profile(prof, args, default_prefix):
+    '''With -profile prints the summary and writes the report (prefix from -profile or default_prefix)'''
+    if args.profile is None:
+        return
+    prof.print_summary()
+    prof.write(args.profile or default_prefix)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar per-image record store.
+
+The scripts used to build their output one row at a time with
+df.append(..., ignore_index=True), which copies the whole frame for every
+image (quadratic) and no longer exists in pandas 2+.  RecordStore keeps one
+preallocated, typed NumPy array per column, doubles them when full and
+builds the DataFrame once at the end.
+
+Column dtypes are NumPy dtypes, plus 'datetime64[ns, UTC]' for UTC aware
+times (stored naive, localized in to_frame()).  Values that are not set
+are NaN (float), NaT (datetime) or None (object).
+
+example:
+    store = RecordStore({'ImageName': object, 'ImageDateTime': 'datetime64[ns]'})
+    for fn, dt in ...:
+        store.append(ImageName=fn.name, ImageDateTime=dt)
+    df = store.to_frame()
+"""
+
+import numpy as np
+import pandas as pd
+
+#dtype string for UTC aware datetime columns
+UTC_DATETIME = 'datetime64[ns, UTC]'
+
+
+def _empty(size, dtype):
+    '''Array of size with missing values (NaN/NaT/None) for dtype'''
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'f':
+        return np.full(size, np.nan, dtype=dtype)
+    if dtype.kind == 'M':
+        return np.full(size, np.datetime64('NaT'), dtype=dtype)
+    if dtype.kind == 'O':
+        return np.full(size, None, dtype=dtype)
+    return np.zeros(size, dtype=dtype)
+
+
+def grow_arrays(arrays, size):
+    '''Resizes every array in dict arrays to size, keeping contents (new entries are missing values)'''
+    for key, arr in arrays.items():
+        new = _empty(size, arr.dtype)
+        new[:len(arr)] = arr
+        arrays[key] = new
+
+
+class RecordStore:
+    '''Growable typed columns (dict of column name -> dtype), one row per image'''
+    def __init__(self, dtypes, capacity=1024):
+        self.utc = [col for col, dtype in dtypes.items() if dtype == UTC_DATETIME]
+        self.arrays = {col: _empty(max(1, capacity), 'datetime64[ns]' if col in self.utc else dtype)
+                       for col, dtype in dtypes.items()}
+        self.n = 0
+
+    def __len__(self):
+        return self.n
+
+    def _reserve(self, n):
+        '''Makes room for n more rows'''
+        size = len(next(iter(self.arrays.values())))
+        if self.n + n > size:
+            grow_arrays(self.arrays, max(size * 2, self.n + n))
+
+    def append(self, **values):
+        '''Adds one row (columns not given are missing)'''
+        self._reserve(1)
+        for col, value in values.items():
+            self.arrays[col][self.n] = value
+        self.n += 1
+
+    def extend(self, **columns):
+        '''Adds len(column) rows from equal length sequences/arrays (columns not given are missing)'''
+        lengths = {len(c) for c in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError(f'columns have different lengths: {sorted(lengths)}')
+        n = lengths.pop() if lengths else 0
+        self._reserve(n)
+        for col, values in columns.items():
+            if col in self.utc:
+                values = pd.Series(values).dt.tz_convert('UTC').dt.tz_localize(None)
+            arr = self.arrays[col]
+            if arr.dtype.kind == 'O':
+                #assign element wise so sequences of Paths etc. are not broadcast
+                arr[self.n:self.n + n] = np.fromiter(values, dtype=object, count=n)
+            else:
+                arr[self.n:self.n + n] = np.asarray(values, dtype=arr.dtype)
+        self.n += n
+
+    def column(self, col):
+        '''View of the filled part of column col'''
+        return self.arrays[col][:self.n]
+
+    def to_frame(self, columns=None):
+        '''Returns DataFrame of the records (columns in store order unless columns given)'''
+        columns = list(self.arrays) if columns is None else columns
+        df = pd.DataFrame({col: self.column(col).copy() for col in columns})
+        for col in self.utc:
+            if col in df:
+                df[col] = df[col].dt.tz_localize('UTC')
+        return df
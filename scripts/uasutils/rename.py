@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Image renaming helpers shared by renameUASimages.py and the uas-utils
+pipeline.  Images are renamed F<flight>_<UTC time>_<original name>.
+
+Renaming a directory is done as a transaction: plan_renames() computes every
+target name (and -sepdir move) up front from the metadata scan, skipping
+images that already have a flight prefix, and find_collisions() checks the
+plan before anything is touched.  RenameJournal writes the plan to
+<dir>/.uasutils_rename_journal.json, applies it with os.rename (one pass,
+optionally over a thread pool) and removes the journal when done.  If a run
+is interrupted the journal is left behind, and the same plan can be resumed
+or rolled back: a move whose source is gone and whose target exists is
+already done, so no per-file progress needs to be written.  exiftool
+*_original backups are renamed (or moved) with their images
+(with_backup_moves), so the cleanup can still pair them.
+
+example:
+    moves, mkdirs = plan_renames(files, dt_origs, utcoffset=8, fltnum=2, sepdir=True)
+    moves = with_backup_moves(moves, backups)
+    journal = RenameJournal(imgdir)
+    journal.write(moves, mkdirs)
+    journal.apply(workers=8)
+"""
+
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from uasutils.exif import get_dt_original
+from uasutils.imgindex import relative_key
+from uasutils.cleanup import BACKUP_SUFFIX
+
+#names already produced by new_image_name (e.g. F02_20181023T180900Z_IMG_0001.JPG)
+RENAMED_PATTERN = re.compile(r'^F\d{2,}_\d{8}T\d{6}Z_')
+
+#answers accepted by user_prompt (same as distutils.util.strtobool, removed in python 3.12)
+_YES = {'y', 'yes', 't', 'true', 'on', '1'}
+_NO = {'n', 'no', 'f', 'false', 'off', '0'}
+
+#journal of a rename in progress (in the renamed directory)
+JOURNAL_NAME = '.uasutils_rename_journal.json'
+
+
+def new_image_name(img, utcoffset, fltnum, dt_orig=None):
+    '''Formats new image name. dt_orig (EXIF DateTimeOriginal) is read from img if not given.'''
+    #get image time stamp
+    #PIL doesn't work for DNG
+    #imgdt = datetime.strptime(Image.open(img)._getexif()[36867], '%Y:%m:%d %H:%M:%S')
+    #using header-only EXIF reader (falls back to exifread)
+    if dt_orig is None:
+        dt_orig = get_dt_original(img)
+    imgdt = datetime.strptime(dt_orig, '%Y:%m:%d %H:%M:%S')
+    #add UTC offset to get UTC time
+    imgutcdt = imgdt + timedelta(hours=utcoffset)
+    #format output utc dt, using ISO 8601 format
+    #imgutcdtlabel = datetime.strftime(imgutcdt, '%Y%m%d-%H%M%S')
+    imgutcdtlabel = datetime.strftime(imgutcdt, '%Y%m%dT%H%M%SZ')
+    outname = 'F' + f'{fltnum:02}' + '_' + imgutcdtlabel + '_' + str(img.name)
+    return outname
+
+
+def is_renamed(img):
+    '''True if img already has a new_image_name() style name'''
+    return RENAMED_PATTERN.match(img.name) is not None
+
+
+def sepdir_name(fn):
+    '''Directory for fn with -sepdir (jpg, dng next to the image), None if it is already there'''
+    ftypedir = fn.suffix[1:].lower()
+    return None if fn.parent.name == ftypedir else Path(fn.parent, ftypedir)
+
+
+def flight_dir(fn):
+    '''Directory of image fn without the jpg/dng level added by -sepdir'''
+    return fn.parent if sepdir_name(fn) is not None else fn.parent.parent
+
+
+def plan_renames(files, dt_origs, utcoffset, fltnum, sepdir=False):
+    '''
+    Returns (moves, mkdirs) for renaming files (EXIF DateTimeOriginal
+    dt_origs) with new_image_name(), and with sepdir moving them into jpg/dng
+    directories.  moves are (old, new) paths of files that change, mkdirs the
+    directories to create.  Images that already have a flight prefix keep
+    their name, so a rerun doesn't prefix them twice.
+    '''
+    moves = []
+    #sepdir directory per (directory, file type), created if it doesn't exist
+    newdirs = {}
+    for fn, dt_orig in zip(files, dt_origs):
+        name = fn.name if is_renamed(fn) else new_image_name(fn, utcoffset, fltnum, dt_orig)
+        newdir = None
+        if sepdir:
+            key = (fn.parent, fn.suffix)
+            if key not in newdirs:
+                newdirs[key] = sepdir_name(fn)
+            newdir = newdirs[key]
+        if newdir is not None:
+            moves.append((fn, newdir / name))
+        elif name != fn.name:
+            moves.append((fn, fn.with_name(name)))
+    mkdirs = sorted({d for d in newdirs.values() if d is not None and not d.is_dir()})
+    return moves, mkdirs
+
+
+def with_backup_moves(moves, backups, suffix=BACKUP_SUFFIX):
+    '''moves plus a move of the backup (<image>_original in backups) of each moved image to <new name>_original'''
+    backups = {str(fn) for fn in backups}
+    extra = [(Path(str(old) + suffix), Path(str(new) + suffix)) for old, new in moves if str(old) + suffix in backups]
+    return list(moves) + extra
+
+
+def find_collisions(moves):
+    '''Returns messages for targets of moves that occur twice or already exist (empty list if the plan is safe)'''
+    seen = {}
+    collisions = []
+    for old, new in moves:
+        if new in seen:
+            collisions.append(f'{old.name} and {seen[new].name} would both be renamed to {new}')
+        else:
+            seen[new] = old
+    #os.rename replaces existing files without warning on posix
+    for old, new in moves:
+        if os.path.lexists(new):
+            collisions.append(f'{old.name} would be renamed to existing file {new}')
+    return collisions
+
+
+def _move(pair):
+    '''Renames pair (old, new) and returns 'renamed', 'done' (already renamed) or an error message'''
+    old, new = pair
+    try:
+        os.rename(old, new)
+        return 'renamed'
+    except FileNotFoundError:
+        #interrupted run already moved it
+        if os.path.lexists(new) and not os.path.lexists(old):
+            return 'done'
+        return f'{old}: not found'
+    except OSError as e:
+        return f'{old}: {e}'
+
+
+class RenameJournal:
+    '''Rename plan of directory root written to disk before it is applied, so it can be resumed or rolled back'''
+    def __init__(self, root):
+        self.root = Path(root)
+        self.path = self.root / JOURNAL_NAME
+        self.moves = []
+        self.mkdirs = []
+
+    def exists(self):
+        return self.path.exists()
+
+    def write(self, moves, mkdirs=()):
+        '''Writes plan (moves, mkdirs) to the journal, flushed to disk before any file is renamed'''
+        self.moves, self.mkdirs = list(moves), list(mkdirs)
+        entry = {'created': datetime.now().isoformat(timespec='seconds'),
+                 'mkdirs': [relative_key(self.root, d) for d in self.mkdirs],
+                 'moves': [[relative_key(self.root, old), relative_key(self.root, new)] for old, new in self.moves]}
+        tmp = self.path.with_name(JOURNAL_NAME + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(entry, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def read(self):
+        '''Reads the plan of an interrupted rename'''
+        with open(self.path) as f:
+            entry = json.load(f)
+        self.mkdirs = [self.root / d for d in entry['mkdirs']]
+        self.moves = [(self.root / old, self.root / new) for old, new in entry['moves']]
+        return self
+
+    def _run(self, pairs, workers, what, skipped):
+        '''Applies _move to pairs (thread pool if workers > 1), prints timing, returns (renamed, done, failures)'''
+        t0 = time.perf_counter()
+        if workers is None or workers <= 1 or len(pairs) < 2:
+            results = [_move(pair) for pair in pairs]
+            mode = 'serial'
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(_move, pairs))
+            mode = f'{workers} threads'
+        elapsed = time.perf_counter() - t0
+        renamed = results.count('renamed')
+        done = results.count('done')
+        failures = [r for r in results if r not in ('renamed', 'done')]
+        if pairs:
+            rate = renamed / elapsed if elapsed > 0 else float('inf')
+            print(f'{what} {renamed} of {len(pairs)} images in {elapsed:.2f} s ({rate:.0f} images/sec, {mode})'
+                  + (f', {done} {skipped}' if done else ''))
+        return renamed, done, failures
+
+    def apply(self, workers=1):
+        '''
+        Applies (or resumes) the plan.  Removes the journal and returns
+        (renamed, done, failures) if every file was moved, otherwise keeps
+        it and raises RuntimeError listing the failures.
+        '''
+        for d in self.mkdirs:
+            d.mkdir(parents=True, exist_ok=True)
+        renamed, done, failures = self._run(self.moves, workers, 'Renamed', 'already renamed')
+        if failures:
+            raise RuntimeError(f'{len(failures)} images could not be renamed, journal kept in {self.path} '
+                               f'(fix and resume or roll back):\n' + '\n'.join(failures[:20]))
+        self.path.unlink()
+        return renamed, done, failures
+
+    def rollback(self, workers=1):
+        '''Moves renamed files back to their original names, removes the created directories if empty and the journal'''
+        renamed, done, failures = self._run([(new, old) for old, new in reversed(self.moves)], workers, 'Restored',
+                                              'not renamed')
+        if failures:
+            raise RuntimeError(f'{len(failures)} images could not be restored, journal kept in {self.path}:\n'
+                               + '\n'.join(failures[:20]))
+        for d in reversed(self.mkdirs):
+            try:
+                d.rmdir()
+            except OSError:
+                pass
+        self.path.unlink()
+        return renamed, done, failures
+
+
+def user_prompt(question:str):
+    """ Prompts a Yes/No questions.
+    https://stackoverflow.com/questions/3041986/apt-command-line-interface-like-yes-no-input"""
+    while True:
+        sys.stdout.write(question + " [y/n]: ")
+        user_input = input().lower()
+        if user_input in _YES:
+            return True
+        if user_input in _NO:
+            return False
+        sys.stdout.write("Please use y/n or yes/no.\n")
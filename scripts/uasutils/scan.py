@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Image directory scanning with optional thread/process pool.
+
+Reading EXIF timestamps one file at a time is bound by I/O latency on NAS
+storage.  scan_dt_tags() fans the reads out over a thread pool (or a process
+pool if parsing is the bottleneck) and returns results in the same order as
+the input file list, so output is deterministic regardless of worker count.
+"""
+
+import os
+import time
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from uasutils.exif import read_dt_tags
+
+
+def find_images(imgdir, ftypes, recursive=True):
+    '''Returns sorted list of image paths in imgdir for each file type (in ftypes order)'''
+    pattern = '**/*.' if recursive else '*.'
+    files = []
+    for ftype in ftypes:
+        files.extend(sorted(imgdir.glob(pattern + ftype)))
+    return files
+
+
+def walk_images(imgdir, ftypes, backup_suffix='_original'):
+    '''
+    One os.scandir walk of imgdir returning (images, backups).  images are
+    ordered like find_images() (by file type, then path), backups are files
+    ending in backup_suffix (exiftool *_original copies).
+    '''
+    suffixes = {'.' + ftype: i for i, ftype in enumerate(ftypes)}
+    images = [[] for ftype in ftypes]
+    backups = []
+    stack = [str(imgdir)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(backup_suffix):
+                    backups.append(Path(entry.path))
+                else:
+                    i = suffixes.get(os.path.splitext(entry.name)[1])
+                    if i is not None:
+                        images[i].append(Path(entry.path))
+    return [fn for files in images for fn in sorted(files)], sorted(backups)
+
+
+def scan_files(func, files, workers=1, processes=False, verbose=True, what='EXIF timestamps'):
+    '''
+    Applies func (a picklable module level function) to each file in files.
+    workers <= 1 runs serially, otherwise a thread pool (or process pool if
+    processes=True) of that size is used.  Results are in input order.
+    '''
+    files = list(files)
+    t0 = time.perf_counter()
+    if workers is None or workers <= 1 or len(files) < 2:
+        results = [func(fn) for fn in files]
+        mode = 'serial'
+    elif processes:
+        #larger chunks amortize pickling overhead between processes
+        chunksize = max(1, len(files) // (workers * 8))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(func, files, chunksize=chunksize))
+        mode = f'{workers} processes'
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(func, files))
+        mode = f'{workers} threads'
+    elapsed = time.perf_counter() - t0
+
+    if verbose and files:
+        rate = len(files) / elapsed if elapsed > 0 else float('inf')
+        print(f'Read {what} from {len(files)} images in {elapsed:.2f} s '
+              f'({rate:.0f} images/sec, {mode})')
+    return results
+
+
+def scan_dt_tags(files, workers=1, processes=False, verbose=True):
+    '''Reads (DateTimeOriginal, SubSecTimeOriginal) for each file in files (see scan_files)'''
+    return scan_files(read_dt_tags, files, workers, processes, verbose)
+
+
+def add_scan_args(parser):
+    '''Adds -workers, -procs and -noindex arguments shared by scripts that scan images'''
+    parser.add_argument('-workers', '--workers', dest='workers',
+                        type=int, required=False, default=1,
+                        help='number of parallel workers for reading image EXIF [default 1]')
+    parser.add_argument('-procs', '--use_processes', dest='use_processes',
+                        action='store_true',
+                        help='use a process pool instead of threads for -workers')
+    parser.add_argument('-noindex', '--no_image_index', dest='noindex',
+                        action='store_true',
+                        help='read EXIF from every image instead of using the image metadata index')
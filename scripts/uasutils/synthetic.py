@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic survey missions for benchmarks (bench-mission.py).
+
+The repository only has six Mission Planner gpx files and no images.
+make_mission() writes a mission of any size: one Mission Planner style gpx
+file per flight (several fixes per second, whole second local times like
+Mission Planner writes them) flying lawnmower legs (a different leg length
+each flight, like different survey blocks) with slower crossings between
+them, and one directory of images per flight triggered by distance
+on the survey legs (none on the crossings), so the capture rate follows the
+track like a real survey and derive-time-sync-offset.py -gpxdir can find the
+clock error.  Images are tiny JPG and/or
+DNG files with just the EXIF the scripts read (Make, Model,
+DateTimeOriginal, SubSecTimeOriginal), padded to a chosen size, so the
+native GPS writer, the EXIF readers and exiftool all accept them.  The
+camera clock is UTC off by a known clock error, so the offset to give
+geotag-with-gpx.py -imgoffset is known.
+
+example:
+    mission = make_mission('D:/temp/mission', ncaptures=5000, ftypes=['JPG', 'DNG'])
+    print(mission['imgdir'], mission['gpxdir'], mission['imgoffset'])
+"""
+
+import struct
+from pathlib import Path
+import numpy as np
+from uasutils.exif import TAG_EXIF_IFD, TAG_DT_ORIGINAL, TAG_SUBSEC_ORIGINAL, TAG_MODEL
+from uasutils.trackqc import m_per_deg_lat, m_per_deg_lon
+
+#mission defaults
+START_UTC = '2018-10-23T18:08:00'
+UTC_OFFSET_HOURS = -7 #gpx times are local (PDT) with the utc offset, like Mission Planner writes them
+CLOCK_ERROR_S = 2.5 #camera clock (UTC) behind by this many seconds
+LAT0, LON0 = 38.3304, -121.6690
+
+#flight pattern
+SPEED_MS = 8
+TURN_SPEED_MS = 3 #crossing to the next leg
+LEG_M = 300 #mean leg length, each flight is LEG_M +- LEG_VARY_M
+LEG_VARY_M = 100
+LEG_SPACING_M = 30
+GROUND_S = 30 #seconds on the ground (no images) before take-off and after landing
+CLIMB_S = 5 #seconds climbing (hovering) after take-off and descending before landing
+FLIGHT_GAP_S = 1200 #seconds between flights (battery change)
+
+#tiff field types and tags
+ASCII, SHORT, LONG, BYTE, UNDEFINED = 2, 3, 4, 1, 7
+TAG_MAKE = 0x010F
+TAG_DNG_VERSION = 0xC612
+TAG_NEW_SUBFILE_TYPE = 0x00FE
+TAG_STRIP_OFFSETS = 0x0111
+TAG_STRIP_BYTE_COUNTS = 0x0117
+TYPE_SIZE = {BYTE: 1, ASCII: 1, SHORT: 2, LONG: 4, UNDEFINED: 1}
+
+
+def _ifd(entries, offset, endian, nextifd=0):
+    '''
+    IFD at file offset offset followed by its out of line values.  entries
+    are (tag, type, values), values is bytes for ASCII/BYTE/UNDEFINED and a
+    tuple of ints otherwise.
+    '''
+    codes = {SHORT: 'H', LONG: 'I'}
+    entries = sorted(entries)
+    data_offset = offset + 2 + 12 * len(entries) + 4
+    table, data = b'', b''
+    for tag, typ, values in entries:
+        if isinstance(values, bytes):
+            raw, count = values, len(values)
+        else:
+            raw, count = struct.pack(endian + codes[typ] * len(values), *values), len(values)
+        if len(raw) <= 4:
+            table += struct.pack(endian + 'HHI', tag, typ, count) + raw.ljust(4, b'\x00')
+        else:
+            table += struct.pack(endian + 'HHII', tag, typ, count, data_offset + len(data))
+            data += raw + b'\x00' * (len(raw) % 2)
+    return struct.pack(endian + 'H', len(entries)) + table + struct.pack(endian + 'I', nextifd) + data
+
+
+def _ifd_size(entries):
+    '''Size of _ifd(entries) without building it'''
+    size = 2 + 12 * len(entries) + 4
+    for tag, typ, values in entries:
+        n = len(values) * TYPE_SIZE[typ]
+        if n > 4:
+            size += n + n % 2
+    return size
+
+
+def exif_tiff(dt_original, subsec, model, endian='<', dng=False, image_bytes=0):
+    '''
+    TIFF structure with IFD0 (Make, Model, Exif IFD pointer and for dng
+    DNGVersion and a strip of image_bytes zero bytes) and an Exif IFD with
+    DateTimeOriginal and SubSecTimeOriginal.
+    '''
+    ifd0 = [(TAG_MAKE, ASCII, b'Synthetic\x00'),
+            (TAG_MODEL, ASCII, model.encode() + b'\x00'),
+            (TAG_EXIF_IFD, LONG, (0,))]
+    if dng:
+        ifd0 += [(TAG_NEW_SUBFILE_TYPE, LONG, (0,)),
+                 (TAG_DNG_VERSION, BYTE, bytes([1, 4, 0, 0])),
+                 (TAG_STRIP_OFFSETS, LONG, (0,)),
+                 (TAG_STRIP_BYTE_COUNTS, LONG, (image_bytes,))]
+    exif = [(TAG_DT_ORIGINAL, ASCII, dt_original.encode() + b'\x00'),
+            (TAG_SUBSEC_ORIGINAL, ASCII, subsec.encode() + b'\x00')]
+    exif_offset = 8 + _ifd_size(ifd0)
+    strip_offset = exif_offset + _ifd_size(exif)
+    ifd0 = [(tag, typ, (exif_offset,) if tag == TAG_EXIF_IFD else (strip_offset,) if tag == TAG_STRIP_OFFSETS else values)
+            for tag, typ, values in ifd0]
+    header = (b'II' if endian == '<' else b'MM') + struct.pack(endian + 'HI', 42, 8)
+    tiff = header + _ifd(ifd0, 8, endian) + _ifd(exif, exif_offset, endian)
+    return tiff + (b'\x00' * image_bytes if dng else b'')
+
+
+def tiny_jpg(dt_original, subsec, model='SyntheticCam', nbytes=8192):
+    '''JPG bytes with an Exif APP1 segment (big endian like most cameras), padded to about nbytes'''
+    tiff = exif_tiff(dt_original, subsec, model, endian='>')
+    app1 = b'\xff\xe1' + struct.pack('>H', 2 + 6 + len(tiff)) + b'Exif\x00\x00' + tiff
+    head = b'\xff\xd8' + app1 + b'\xff\xda\x00\x02'
+    return head + b'\x00' * max(nbytes - len(head) - 2, 0) + b'\xff\xd9'
+
+
+def tiny_dng(dt_original, subsec, model='SyntheticCam', nbytes=32768):
+    '''DNG (little endian TIFF) bytes, padded to about nbytes with an image strip'''
+    return exif_tiff(dt_original, subsec, model, endian='<', dng=True, image_bytes=max(nbytes - 256, 0))
+
+
+def _cycle_s(leg_m):
+    '''Seconds flying a leg of leg_m and a whole leg + crossing cycle'''
+    leg_s = leg_m / SPEED_MS
+    return leg_s, leg_s + LEG_SPACING_M / TURN_SPEED_MS
+
+
+def leg_trigger_times(ncaptures, interval, leg_m=LEG_M):
+    '''
+    Seconds after take-off of ncaptures camera triggers every interval
+    seconds (SPEED_MS * interval meters) along the legs, none on the crossings.
+    '''
+    leg_s, cycle_s = _cycle_s(leg_m)
+    per_leg = int(np.ceil(leg_s / interval))
+    leg, i = np.divmod(np.arange(ncaptures), per_leg)
+    return leg * cycle_s + i * interval
+
+
+def flight_track(seconds, hz, rng, leg_m=LEG_M, lat0=LAT0, lon0=LON0):
+    '''
+    Fix times (s since power on) and lat, lon, ele, course of a flight of
+    seconds: GROUND_S on the ground, CLIMB_S climbing, then lawnmower legs
+    at SPEED_MS with crossings at TURN_SPEED_MS, CLIMB_S descending and
+    GROUND_S landed.
+    '''
+    t = np.arange(int(seconds * hz)) / hz
+    air = np.clip(t - GROUND_S - CLIMB_S, 0, seconds - 2 * (GROUND_S + CLIMB_S))
+    #each leg is followed by a LEG_SPACING_M crossing to the next
+    leg_s, cycle_s = _cycle_s(leg_m)
+    leg, phase = np.divmod(air, cycle_s)
+    leg = leg.astype(int)
+    along = np.minimum(phase, leg_s) * SPEED_MS
+    x = np.where(leg % 2 == 0, along, leg_m - along)
+    y = leg * LEG_SPACING_M + np.maximum(phase - leg_s, 0) * TURN_SPEED_MS
+    lat = lat0 + (y + rng.normal(0, 0.3, len(t))) / m_per_deg_lat(lat0)
+    lon = lon0 + (x + rng.normal(0, 0.3, len(t))) / m_per_deg_lon(lat0)
+    ele = np.where((t > GROUND_S) & (t < seconds - GROUND_S), 60.0, 0.0) + rng.normal(0, 0.2, len(t))
+    course = np.where(phase > leg_s, 0.0, np.where(leg % 2 == 0, 90.0, 270.0))
+    return t, lat, lon, ele, course
+
+
+def write_gpx(path, utc_ns, lat, lon, ele, course, rng):
+    '''Writes a Mission Planner style gpx file (whole second local times with the utc offset)'''
+    local = (utc_ns // 1_000_000_000 + UTC_OFFSET_HOURS * 3600).astype('datetime64[s]').astype(str)
+    tz = f'{"-" if UTC_OFFSET_HOURS < 0 else "+"}{abs(UTC_OFFSET_HOURS):02d}:00'
+    roll = rng.normal(0, 2, len(lat))
+    pitch = rng.normal(0, 2, len(lat))
+    with open(path, 'w') as f:
+        f.write('<gpx creator="Mission Planner" xmlns="http://www.topografix.com/GPX/1/1"><trk><trkseg>')
+        f.write(''.join(f'<trkpt lat="{lat[i]:.7f}" lon="{lon[i]:.7f}"><ele>{ele[i]:.2f}</ele>'
+                        f'<time>{local[i]}{tz}</time><course>{course[i]:.2f}</course>'
+                        f'<roll>{roll[i]:.2f}</roll><pitch>{pitch[i]:.2f}</pitch><mode /></trkpt>'
+                        for i in range(len(lat))))
+        f.write('</trkseg></trk></gpx>')
+
+
+def make_mission(outdir, ncaptures, ftypes=('JPG', 'DNG'), captures_per_flight=600, hz=5, interval=1.0,
+                 jpg_bytes=8192, dng_bytes=32768, backups=False, seed=0):
+    '''
+    Writes a mission of ncaptures camera triggers to outdir: gpx/<n>.gpx
+    per flight and images/F<n>/ with one image per trigger and file type in
+    ftypes (and a *_original copy of each if backups).  Triggers are
+    interval seconds apart (with jitter) along the survey legs.  Returns dict
+    with imgdir, gpxdir, imgoffset (-imgoffset for geotag-with-gpx.py),
+    nimages, nfixes, nflights and bytes written.
+    '''
+    rng = np.random.default_rng(seed)
+    outdir = Path(outdir)
+    gpxdir = outdir / 'gpx'
+    imgdir = outdir / 'images'
+    gpxdir.mkdir(parents=True, exist_ok=True)
+    imgdir.mkdir(parents=True, exist_ok=True)
+    writers = {'JPG': lambda dt, ss: tiny_jpg(dt, ss, nbytes=jpg_bytes),
+               'DNG': lambda dt, ss: tiny_dng(dt, ss, nbytes=dng_bytes)}
+
+    start_ns = np.datetime64(START_UTC, 'ns').astype(np.int64)
+    nflights = max(1, int(np.ceil(ncaptures / captures_per_flight)))
+    nimages = nfixes = nbytes = 0
+    for k in range(nflights):
+        ncap = min(captures_per_flight, ncaptures - k * captures_per_flight)
+        leg_m = LEG_M + rng.uniform(-LEG_VARY_M, LEG_VARY_M)
+        trig_s = GROUND_S + CLIMB_S + leg_trigger_times(ncap, interval, leg_m)
+        seconds = trig_s[-1] + interval + CLIMB_S + GROUND_S
+        t, lat, lon, ele, course = flight_track(seconds, hz, rng, leg_m)
+        utc_ns = start_ns + (t * 1e9).astype(np.int64)
+        write_gpx(gpxdir / f'{k + 1}.gpx', utc_ns, lat, lon, ele, course, rng)
+        nfixes += len(t)
+
+        #camera triggers over the survey, camera clock is UTC minus the clock error
+        trig_ns = start_ns + (trig_s * 1e9).astype(np.int64)
+        trig_ns += rng.integers(0, 300_000_000, ncap)
+        cam_ns = trig_ns - int(CLOCK_ERROR_S * 1e9)
+        cam_s = (cam_ns // 1_000_000_000).astype('datetime64[s]').astype(str)
+        flightdir = imgdir / f'F{k + 1:02d}'
+        flightdir.mkdir(exist_ok=True)
+        for i in range(ncap):
+            dt_original = cam_s[i].replace('-', ':').replace('T', ' ')
+            subsec = f'{cam_ns[i] % 1_000_000_000 // 1_000_000:03d}'
+            for ftype in ftypes:
+                data = writers[ftype](dt_original, subsec)
+                fn = flightdir / f'IMG_{k * captures_per_flight + i:06d}.{ftype}'
+                fn.write_bytes(data)
+                if backups:
+                    fn.with_name(fn.name + '_original').write_bytes(data)
+                nimages += 1
+                nbytes += len(data) * (2 if backups else 1)
+        start_ns += int((seconds + FLIGHT_GAP_S) * 1e9)
+    return {'imgdir': imgdir, 'gpxdir': gpxdir, 'imgoffset': CLOCK_ERROR_S,
+            'nimages': nimages, 'nfixes': nfixes, 'nflights': nflights, 'bytes': nbytes}
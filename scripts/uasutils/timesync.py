@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Camera to UTC time offset estimation without time sync images.
+
+derive-time-sync-offset.py lists the camera times of photos of a GPS clock
+and the UTC times are read off the images by hand.  estimate_offset() gets
+the offset from the flight itself: the image capture rate (images per
+second, camera time) is cross-correlated with a reference signal on the
+UTC time line over a bounded range of offsets, and the offset with the
+highest correlation is returned with a confidence score.
+
+Reference signals:
+
+    - track_speed_signal(): speed of the 1 Hz track.  Cameras triggered by
+      distance, or only on the survey legs, take images at a rate that
+      follows the speed; take-off, landing and hovers (no images) line up
+      with the track.  Time lapse cameras running the whole flight only
+      give the take-off and landing edges.
+    - event_signal(): times of camera trigger events (e.g. CAM messages
+      of a dataflash log), which match the images one to one.
+
+The correlation is a normalized (Pearson) cross-correlation that only
+counts seconds with track fixes, computed for every offset at once with
+FFTs, so a search over hours of offsets takes milliseconds.
+
+example:
+    offset, corr, confidence, curve = estimate_offset(image_ns, track_speed_signal(gpxdf), -3600, 3600)
+"""
+
+import numpy as np
+import pandas as pd
+from uasutils.match import to_ns
+from uasutils.trackqc import m_per_deg_lat, m_per_deg_lon
+
+
+def _smooth(values, nbins):
+    '''Moving sum over nbins bins (same length, centered)'''
+    if nbins <= 1:
+        return values
+    return np.convolve(values, np.ones(nbins), mode='same')
+
+
+def track_speed_signal(gpxdf, step=1.0, max_speed_ms=40, max_gap_s=2):
+    '''
+    Returns reference signal (t0_ns, values, valid) of track gpxdf: speed
+    between consecutive fixes of the same gpx file (at most max_gap_s apart,
+    placed at their mid time) averaged in bins of step seconds starting at
+    t0_ns, valid False in bins without fixes.  Speeds above max_speed_ms
+    (bad fixes) are clipped.
+    '''
+    if 'source' in gpxdf:
+        order = np.lexsort((to_ns(gpxdf['dt']), pd.Categorical(gpxdf['source']).codes))
+        codes = pd.Categorical(gpxdf['source']).codes[order]
+    else:
+        order = np.arange(len(gpxdf))
+        codes = np.zeros(len(gpxdf), dtype=np.int8)
+    ns = to_ns(gpxdf['dt'])[order]
+    lat = gpxdf['lat'].to_numpy(dtype=float)[order]
+    lon = gpxdf['lon'].to_numpy(dtype=float)[order]
+    dt = np.diff(ns) / 1e9
+    midlat = (lat[1:] + lat[:-1]) / 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed = np.hypot(np.diff(lat) * m_per_deg_lat(midlat),
+                         ((np.diff(lon) + 180.0) % 360.0 - 180.0) * m_per_deg_lon(midlat)) / dt
+    ok = (codes[1:] == codes[:-1]) & (dt > 0) & (dt <= max_gap_s) & ~np.isnan(speed)
+    mid = ns[:-1][ok] + np.diff(ns)[ok] // 2
+    speed = np.minimum(speed[ok], max_speed_ms)
+
+    step_ns = int(round(step * 1e9))
+    t0 = int(ns.min())
+    bins = (mid - t0) // step_ns
+    nbins = int((ns.max() - t0) // step_ns) + 1
+    total = np.bincount(bins, weights=speed, minlength=nbins)
+    count = np.bincount(bins, minlength=nbins)
+    valid = count > 0
+    return t0, np.where(valid, total / np.maximum(count, 1), 0.0), valid
+
+
+def event_signal(event_ns, step=1.0):
+    '''Returns reference signal (t0_ns, counts, valid) of UTC event times event_ns (e.g. camera triggers)'''
+    event_ns = np.sort(np.asarray(event_ns, dtype=np.int64))
+    step_ns = int(round(step * 1e9))
+    t0 = int(event_ns[0])
+    counts = np.bincount((event_ns - t0) // step_ns).astype(float)
+    return t0, counts, np.ones(len(counts), dtype=bool)
+
+
+def _xcorr(a, b, n):
+    '''c[k] = sum_i a[i + k] * b[i] for all k (negative k at the end), FFT length n'''
+    return np.fft.irfft(np.fft.rfft(a, n) * np.conj(np.fft.rfft(b, n)), n)
+
+
+def estimate_offset(image_ns, reference, min_offset=-3600, max_offset=3600, step=1.0, window=5, min_overlap=0.9, pad=60):
+    '''
+    Finds the offset (seconds, camera time + offset = UTC, like -imgoffset)
+    in [min_offset, max_offset] (None: no limit, every offset that puts the
+    images within the reference) that best aligns the capture rate of images
+    taken at camera times image_ns (int64 ns) with reference (t0_ns, values,
+    valid) from track_speed_signal() or event_signal() built with the same
+    step.  The capture rate is padded with pad seconds without images on
+    both sides, so take-off and landing (no images, low speed) line up too
+    and a short flight can't match a stretch in the middle of a longer one.
+    Both series are smoothed over window seconds.  Bins without valid
+    reference (track gaps, time between flights) are left out of the
+    correlation, and offsets where less than min_overlap of the image time
+    span has valid reference are not considered.
+
+    Returns (offset, correlation, confidence, curve):
+        correlation: Pearson correlation at the best offset
+        confidence: 0-1, how far the best peak stands out from the next
+                    highest peak more than window seconds away
+                    ((r_best - r_second) / (1 - r_second))
+        curve: DataFrame of offset, r, overlap (seconds of image time span with
+               valid reference) for every offset searched
+    offset is refined below step by a parabola through the peak.  Returns
+    (nan, nan, 0, curve) if no offset has enough overlap.
+    '''
+    t0, x, m = reference
+    step_ns = int(round(step * 1e9))
+    image_ns = np.sort(np.asarray(image_ns, dtype=np.int64))
+    npad = int(round(pad / step))
+    i0 = int(image_ns[0]) - npad * step_ns
+    y = np.bincount((image_ns - i0) // step_ns).astype(float)
+    y = np.r_[y, np.zeros(npad)]
+    #image time span (without the padding), the part that must have valid reference
+    inspan = np.zeros(len(y))
+    inspan[npad:len(y) - npad] = 1
+    #odd number of bins so the moving window stays centered
+    nbins = 2 * int(round(window / step / 2)) + 1
+    y = _smooth(y, nbins)
+    #reference is averaged over the valid bins in the window (fixes may not fill every bin when step < 1)
+    nvalid = _smooth(m.astype(float), nbins)
+    x = np.where(nvalid > 0, _smooth(x * m, nbins) / np.maximum(nvalid, 1), 0.0)
+    m = (nvalid > 0).astype(float)
+
+    #masked normalized cross-correlation for every lag k (image bin i against reference bin i + k)
+    n = len(x) + len(y) - 1
+    n = 1 << int(np.ceil(np.log2(n)))
+    ones = np.ones(len(y))
+    cnt = _xcorr(m, ones, n)
+    cntspan = _xcorr(m, inspan, n)
+    sx = _xcorr(m * x, ones, n)
+    sxx = _xcorr(m * x * x, ones, n)
+    sy = _xcorr(m, y, n)
+    syy = _xcorr(m, y * y, n)
+    sxy = _xcorr(m * x, y, n)
+
+    #lags for offsets in range: offset = t0 - i0 + k * step
+    base = (t0 - i0) / 1e9
+    kmin, kmax = -(len(y) - 1), len(x) - 1
+    if min_offset is not None:
+        kmin = max(int(np.ceil((min_offset - base) / step)), kmin)
+    if max_offset is not None:
+        kmax = min(int(np.floor((max_offset - base) / step)), kmax)
+    lags = np.arange(kmin, kmax + 1)
+    curve = pd.DataFrame({'offset': base + lags * step, 'r': np.nan, 'overlap': 0.0})
+    if len(lags) == 0:
+        return np.nan, np.nan, 0.0, curve
+    idx = lags % n
+    cnt, cntspan, sx, sxx, sy, syy, sxy = (a[idx] for a in (cnt, cntspan, sx, sxx, sy, syy, sxy))
+    cnt, cntspan = np.round(cnt), np.round(cntspan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = sxy - sx * sy / cnt
+        var = (sxx - sx * sx / cnt) * (syy - sy * sy / cnt)
+        r = cov / np.sqrt(var)
+    #bins of the image time span with valid reference (not the time span overlap: the
+    #image window can fall in a gap between flights, where r is rounding noise)
+    r[(cntspan < min_overlap * inspan.sum()) | ~(var > 1e-12 * np.maximum(cnt, 1) ** 2)] = np.nan
+    r = np.minimum(r, 1.0)
+    curve['r'] = r
+    curve['overlap'] = np.maximum(cntspan, 0) * step
+    if np.all(np.isnan(r)):
+        return np.nan, np.nan, 0.0, curve
+
+    best = int(np.nanargmax(r))
+    rbest = r[best]
+    offset = curve['offset'].iloc[best]
+    #sub-step refinement (parabola through the peak and its neighbours)
+    if 0 < best < len(r) - 1 and not np.isnan(r[best - 1]) and not np.isnan(r[best + 1]):
+        denom = r[best - 1] - 2 * rbest + r[best + 1]
+        if denom < 0:
+            offset += step * 0.5 * (r[best - 1] - r[best + 1]) / denom
+
+    #highest other local maximum (more than window seconds from the peak)
+    rr = np.where(np.isnan(r), -np.inf, r)
+    peaks = (rr > np.r_[-np.inf, rr[:-1]]) & (rr >= np.r_[rr[1:], -np.inf])
+    peaks &= np.abs(np.arange(len(r)) - best) * step > window
+    if np.any(peaks & (rr > -np.inf)):
+        rsecond = rr[peaks].max()
+        confidence = float(np.clip((rbest - rsecond) / (1 - rsecond), 0, 1)) if rsecond < 1 else 0.0
+    else:
+        confidence = float(max(rbest, 0.0))
+    return float(offset), float(rbest), confidence, curve
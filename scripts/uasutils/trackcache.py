@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of parsed gpx tracks.
+
+geotag-with-gpx.py is re-run many times per mission while tuning -imgoffset
+and every run used to re-parse the same XML.  TrackCache stores the columns
+returned by parse_gpx_track() as a NumPy .npz per unique file content (times
+as int64 ns so loading needs no date parsing), with a small json index:
+
+    paths: absolute gpx path -> size, mtime and content hash at last parse
+    files: content hash -> npz file name, size on disk, last used time
+
+A gpx whose path, size and mtime match the index is loaded without reading
+it at all.  If size or mtime changed the file is hashed (sha1) and reused
+only if the content is unchanged, so edits invalidate the entry
+automatically.  Least recently used entries are evicted once the cache
+exceeds max_bytes.
+"""
+
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+INDEX_NAME = 'index.json'
+INDEX_VERSION = 1
+
+#default cache size limit
+DEFAULT_MAX_BYTES = 500 * 1024 * 1024
+
+#text columns of parse_gpx_track output (stored as unicode arrays, None <-> '')
+TEXT_COLUMNS = ['mode']
+
+#UTC datetime columns (stored as int64 ns since epoch)
+DATETIME_COLUMNS = ['dt']
+
+
+def file_digest(path, blocksize=1024 * 1024):
+    '''Returns sha1 hex digest of file contents'''
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class TrackCache:
+    '''Size bounded cache of parsed gpx tracks in cachedir'''
+    def __init__(self, cachedir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cachedir = Path(cachedir)
+        self.max_bytes = max_bytes
+        self.index = {'version': INDEX_VERSION, 'paths': {}, 'files': {}}
+        self.hits = 0
+        self.misses = 0
+        #path -> (size, mtime_ns, sha1) of misses, so put() doesn't hash them again
+        self._missed = {}
+        try:
+            with open(self.cachedir / INDEX_NAME) as f:
+                index = json.load(f)
+            if index.get('version') == INDEX_VERSION:
+                self.index = index
+        except (OSError, ValueError):
+            pass
+
+    def _load(self, digest):
+        '''Loads cached track for content digest, None if missing or unreadable'''
+        entry = self.index['files'].get(digest)
+        if entry is None:
+            return None
+        try:
+            with np.load(self.cachedir / entry['npz']) as npz:
+                df = pd.DataFrame({str(col): npz[col] for col in npz['columns']})
+        except (OSError, ValueError, KeyError):
+            del self.index['files'][digest]
+            return None
+        for col in TEXT_COLUMNS:
+            if col in df:
+                df[col] = df[col].astype(object).where(df[col] != '', None)
+        for col in DATETIME_COLUMNS:
+            if col in df:
+                df[col] = pd.to_datetime(df[col], unit='ns', utc=True)
+        entry['last_used'] = time.time()
+        return df
+
+    def get(self, path):
+        '''Returns cached DataFrame for gpx file path, or None if not cached / out of date'''
+        path = Path(path).resolve()
+        st = path.stat()
+        key = str(path)
+        pentry = self.index['paths'].get(key)
+        if pentry is not None and pentry['size'] == st.st_size and pentry['mtime_ns'] == st.st_mtime_ns:
+            digest = pentry['sha1']
+            df = self._load(digest)
+        else:
+            #file is new or touched, only reuse if contents are identical to a cached file
+            digest = file_digest(path)
+            df = self._load(digest)
+            if df is not None:
+                self.index['paths'][key] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha1': digest}
+        if df is None:
+            self.misses += 1
+            self._missed[key] = (st.st_size, st.st_mtime_ns, digest)
+        else:
+            self.hits += 1
+        return df
+
+    def put(self, path, df):
+        '''Adds parsed track df for gpx file path to the cache'''
+        path = Path(path).resolve()
+        st = path.stat()
+        missed = self._missed.pop(str(path), None)
+        if missed is not None and missed[:2] == (st.st_size, st.st_mtime_ns):
+            digest = missed[2]
+        else:
+            digest = file_digest(path)
+        self.cachedir.mkdir(parents=True, exist_ok=True)
+
+        arrays = {'columns': np.array(df.columns, dtype=str)}
+        for col in df.columns:
+            if col in TEXT_COLUMNS:
+                arrays[col] = df[col].fillna('').to_numpy(dtype=str)
+            elif col in DATETIME_COLUMNS:
+                arrays[col] = df[col].dt.tz_convert(None).to_numpy(dtype='datetime64[ns]').view(np.int64)
+            else:
+                arrays[col] = df[col].to_numpy()
+        npzname = digest + '.npz'
+        tmp = self.cachedir / (npzname + '.tmp')
+        with open(tmp, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, self.cachedir / npzname)
+
+        self.index['files'][digest] = {'npz': npzname,
+                                       'bytes': (self.cachedir / npzname).stat().st_size,
+                                       'last_used': time.time()}
+        self.index['paths'][str(path)] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha1': digest}
+
+    def evict(self):
+        '''Removes least recently used tracks until the cache is within max_bytes'''
+        files = self.index['files']
+        total = sum(e['bytes'] for e in files.values())
+        for digest in sorted(files, key=lambda d: files[d]['last_used']):
+            if total <= self.max_bytes:
+                break
+            total -= files[digest]['bytes']
+            try:
+                os.remove(self.cachedir / files.pop(digest)['npz'])
+            except OSError:
+                pass
+        #drop paths that point to evicted content
+        self.index['paths'] = {p: e for p, e in self.index['paths'].items() if e['sha1'] in files}
+
+    def save(self):
+        '''Evicts if needed and writes the index'''
+        if not self.index['files'] and not self.cachedir.exists():
+            return
+        self.evict()
+        self.cachedir.mkdir(parents=True, exist_ok=True)
+        tmp = self.cachedir / (INDEX_NAME + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self.cachedir / INDEX_NAME)
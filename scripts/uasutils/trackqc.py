@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Single pass quality check of a time sorted GPS track.
+
+Replaces the overlap check in geotag-with-gpx.py, which grouped the track by
+second twice (lat and lon spread measured separately) and stopped the whole
+run at the first bad second.  track_qc() works on the sorted arrays in one
+linear pass:
+
+    - spread: planar size of the fixes within a second, the diagonal of
+      their east-west by north-south extent (meters; the distance for two
+      fixes, at most 1.41x the largest pairwise distance for more)
+    - speed and acceleration of the 1 Hz centroid track
+    - seconds with fixes from more than one gpx file ('source')
+
+and returns flags per second plus a list of suspect intervals, so a long
+multi-drone log can be screened without aborting.
+"""
+
+import numpy as np
+import pandas as pd
+
+#flag bits of track_qc() output
+SPREAD = 1    #diagonal of the fixes' extent within the second longer than max_spread_m
+SPEED = 2     #centroid speed above max_speed_ms
+ACCEL = 4     #centroid acceleration above max_accel_ms2
+CONFLICT = 8  #spread exceeded with fixes from more than one gpx file (overlapping files)
+
+FLAG_NAMES = {SPREAD: 'spread', SPEED: 'speed', ACCEL: 'accel', CONFLICT: 'conflict'}
+
+
+def m_per_deg_lat(latdeg):
+    '''Calculates meters per degree of latitude at latdeg
+       from: https://en.wikipedia.org/wiki/Geographic_coordinate_system#Expressing_latitude_and_longitude_as_linear_units
+    '''
+    m_at_lat = 111132.954 - 559.822 * np.cos(np.deg2rad(2.0 * latdeg)) + 1.175 * np.cos(np.deg2rad(4.0 * latdeg)) - 0.0023 * np.cos(np.deg2rad(6.0 * latdeg))
+    return m_at_lat
+
+def m_per_deg_lon(latdeg):
+    '''Calculates meters per degree of longitude at latdeg
+       from: https://en.wikipedia.org/wiki/Geographic_coordinate_system#Expressing_latitude_and_longitude_as_linear_units
+    '''
+    m_at_lon = 111412.84 * np.cos(np.deg2rad(latdeg)) - 93.5 * np.cos(np.deg2rad(3.0 * latdeg)) + 0.118 * np.cos(np.deg2rad(5.0 * latdeg))
+    return m_at_lon
+
+
+def _dlon(lon1, lon0):
+    '''lon1 - lon0 wrapped to [-180, 180)'''
+    return (lon1 - lon0 + 180.0) % 360.0 - 180.0
+
+
+def flag_names(flags):
+    '''Comma separated names of the bits set in flags'''
+    return ','.join(name for bit, name in FLAG_NAMES.items() if flags & bit)
+
+
+def track_qc(gpxdf, max_spread_m=25, max_speed_ms=40, max_accel_ms2=15, max_gap_s=5):
+    '''
+    Checks track gpxdf (sorted by UTC 'dt', with lat, lon and optional
+    'source').  Returns (secdf, intervals, fixflags):
+
+        secdf: one row per second with fixes: dt, nfix, multi_source,
+               spread_m, speed_ms, accel_ms2, flags (SPREAD|SPEED|ACCEL|CONFLICT)
+        intervals: runs of flagged seconds: start, end, seconds (flagged
+               seconds in the run), nfix, flags, reasons, sources
+        fixflags: flags of each fix's second (uint8 array, gpxdf order)
+
+    Speed and acceleration are only computed between seconds at most
+    max_gap_s apart.
+    '''
+    ns = gpxdf['dt'].dt.tz_convert('UTC').dt.tz_localize(None).to_numpy(dtype='datetime64[ns]').view(np.int64)
+    lat = gpxdf['lat'].to_numpy(dtype=float)
+    lon = gpxdf['lon'].to_numpy(dtype=float)
+    if 'source' in gpxdf:
+        codes = pd.Categorical(gpxdf['source']).codes
+        categories = np.asarray(pd.Categorical(gpxdf['source']).categories, dtype=object)
+    else:
+        codes = np.zeros(len(gpxdf), dtype=np.int8)
+        categories = np.array([''], dtype=object)
+    if len(ns) == 0:
+        secdf = pd.DataFrame({'dt': pd.to_datetime(np.array([], dtype=np.int64), unit='ns', utc=True)})
+        return secdf, pd.DataFrame(columns=['start', 'end', 'seconds', 'nfix', 'flags', 'reasons', 'sources']), np.zeros(0, np.uint8)
+    if np.any(np.diff(ns) < 0):
+        raise ValueError('track must be sorted by time')
+
+    #group fixes by whole second (contiguous since the track is sorted)
+    sec = ns // 1_000_000_000
+    change = np.r_[True, sec[1:] != sec[:-1]]
+    starts = np.flatnonzero(change)
+    gid = np.cumsum(change) - 1
+    nfix = np.diff(np.r_[starts, len(ns)])
+
+    #planar offsets (m) from the first fix of each second
+    lat0 = lat[starts]
+    dlon = _dlon(lon, lon[starts][gid])
+    x = dlon * m_per_deg_lon(lat0)[gid]
+    y = (lat - lat0[gid]) * m_per_deg_lat(lat0)[gid]
+
+    #spread: diagonal of the east-west by north-south extent of each second's fixes
+    spread = np.hypot(np.maximum.reduceat(x, starts) - np.minimum.reduceat(x, starts),
+                      np.maximum.reduceat(y, starts) - np.minimum.reduceat(y, starts))
+
+    multi = np.maximum.reduceat(codes, starts) != np.minimum.reduceat(codes, starts)
+
+    #1 Hz centroid track, velocity between consecutive seconds
+    clat = np.add.reduceat(lat, starts) / nfix
+    clon = lon[starts] + np.add.reduceat(dlon, starts) / nfix
+    t = sec[starts].astype(float)
+    dt = np.diff(t)
+    midlat = (clat[1:] + clat[:-1]) / 2
+    vx = _dlon(clon[1:], clon[:-1]) * m_per_deg_lon(midlat) / dt
+    vy = (clat[1:] - clat[:-1]) * m_per_deg_lat(midlat) / dt
+    near = dt <= max_gap_s
+    speed = np.r_[np.nan, np.where(near, np.hypot(vx, vy), np.nan)]
+    accel = np.full(len(starts), np.nan)
+    if len(starts) > 2:
+        both = near[1:] & near[:-1]
+        accel[2:] = np.where(both, np.hypot(np.diff(vx), np.diff(vy)) / ((dt[1:] + dt[:-1]) / 2), np.nan)
+
+    flags = np.zeros(len(starts), dtype=np.uint8)
+    flags[spread > max_spread_m] |= SPREAD
+    flags[speed > max_speed_ms] |= SPEED
+    flags[accel > max_accel_ms2] |= ACCEL
+    flags[(spread > max_spread_m) & multi] |= CONFLICT
+
+    secdf = pd.DataFrame({'dt': pd.to_datetime(sec[starts] * 1_000_000_000, unit='ns', utc=True),
+                          'nfix': nfix, 'multi_source': multi, 'spread_m': spread,
+                          'speed_ms': speed, 'accel_ms2': accel, 'flags': flags})
+
+    #runs of flagged seconds not separated by a good second (seconds without fixes don't break a run)
+    bad = np.flatnonzero(flags)
+    rows = []
+    if len(bad):
+        runstarts = bad[np.r_[True, np.diff(bad) > 1]]
+        runends = bad[np.r_[np.diff(bad) > 1, True]]
+        for a, b in zip(runstarts, runends):
+            first, last = starts[a], starts[b] + nfix[b]
+            runflags = np.bitwise_or.reduce(flags[a:b + 1])
+            rows.append({'start': secdf['dt'].iloc[a], 'end': secdf['dt'].iloc[b],
+                         'seconds': int(b - a + 1),
+                         'nfix': int(last - first), 'flags': int(runflags),
+                         'reasons': flag_names(runflags),
+                         'sources': ','.join(categories[np.unique(codes[first:last])])})
+    intervals = pd.DataFrame(rows, columns=['start', 'end', 'seconds', 'nfix', 'flags', 'reasons', 'sources'])
+    return secdf, intervals, flags[gid]